@@ -0,0 +1,67 @@
+import struct
+from typing import Dict, List
+
+# Aggregated records start with a NUL byte, which never begins a CSV frame.
+AGGREGATION_MAGIC = b'\x00AG1'
+_LENGTH = struct.Struct('<I')
+
+
+def aggregate(payloads: List[bytes]) -> bytes:
+    """
+    Packs several payloads into one Kinesis record body.
+
+    Layout: AGGREGATION_MAGIC followed by (uint32 little-endian length, payload) pairs.
+    """
+    parts = [AGGREGATION_MAGIC]
+    for payload in payloads:
+        parts.append(_LENGTH.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def aggregated_size(payload: bytes) -> int:
+    """
+    Number of bytes `payload` adds to an aggregated record.
+    """
+    return _LENGTH.size + len(payload)
+
+
+def is_aggregated(data: bytes) -> bool:
+    return data[:len(AGGREGATION_MAGIC)] == AGGREGATION_MAGIC
+
+
+def unpack(data: bytes) -> List[bytes]:
+    """
+    Splits an aggregated record body back into its payloads.
+    """
+    payloads = []
+    offset = len(AGGREGATION_MAGIC)
+    view = memoryview(data)
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        payloads.append(bytes(view[offset:offset + length]))
+        offset += length
+    return payloads
+
+
+def deaggregate_records(records: List[Dict]) -> List[Dict]:
+    """
+    Expands aggregated records into one record per payload, in order. The
+    sub-records keep the metadata of their parent (sequence number, shard,
+    arrival time) and get a `SubSequenceNumber`. Plain records pass through.
+    """
+    if not any(is_aggregated(record.get('Data', b'')) for record in records):
+        return records
+    expanded = []
+    for record in records:
+        data = record.get('Data', b'')
+        if not is_aggregated(data):
+            expanded.append(record)
+            continue
+        for i, payload in enumerate(unpack(data)):
+            sub_record = dict(record)
+            sub_record['Data'] = payload
+            sub_record['SubSequenceNumber'] = i
+            expanded.append(sub_record)
+    return expanded
@@ -0,0 +1,83 @@
+"""
+Benchmark of the box corner computations.
+
+The objects of the museum recording are repeated to --boxes boxes (a crowded
+frame) and their corners computed:
+
+  per box        Box.corners as it was: templates, quaternion matrix and center
+                 rebuilt for every box
+  Box, cold      Box.corners on fresh boxes (computed, then cached)
+  Box, cached    Box.corners again on the same boxes
+  batch          geometry_utils.corners_batch on the stacked arrays
+  BoxArray       BoxArray.corner_points after a translate (recomputed)
+
+Usage: python bench_corners.py [--boxes N]
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from geometry_utils import corners_batch
+from utils import objects2boxarray, objects2boxes
+
+SYNCED_DATA = 'test_data/pcd/museum/museum/synced_data.json'
+
+
+def legacy_corners(box):
+    # Box.corners before the corner cache.
+    w, l, h = box.wlh
+    x_corners = l / 2 * np.array([1, 1, 1, 1, -1, -1, -1, -1])
+    y_corners = w / 2 * np.array([1, -1, -1, 1, 1, -1, -1, 1])
+    z_corners = h / 2 * np.array([1, 1, -1, -1, 1, 1, -1, -1])
+    corners = np.dot(box.orientation.rotation_matrix, np.vstack((x_corners, y_corners, z_corners)))
+    x, y, z = box.center
+    corners[0, :] = corners[0, :] + x
+    corners[1, :] = corners[1, :] + y
+    corners[2, :] = corners[2, :] + z
+    return corners
+
+
+def best_of(function, runs=20):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boxes', type=int, default=500, help="Boxes in the frame.")
+    args = parser.parse_args()
+
+    with open(SYNCED_DATA, 'r') as f:
+        objects = [obj for entry in json.load(f) for frame in entry.values() for obj in frame['objects']]
+    objects = (objects * (args.boxes // len(objects) + 1))[:args.boxes]
+    boxes = objects2boxes(objects)
+    box_array = objects2boxarray(objects)
+    reference = np.stack([legacy_corners(box) for box in boxes])
+    error = np.abs(box_array.corners() - reference).max()
+
+    results = {
+        'per box': best_of(lambda: [legacy_corners(box) for box in boxes]),
+        'Box, cold': best_of(lambda: [box.corners() for box in objects2boxes(objects)], runs=5)
+                     - best_of(lambda: objects2boxes(objects), runs=5),
+        'Box, cached': best_of(lambda: [box.corners() for box in boxes]),
+        'batch': best_of(lambda: corners_batch(box_array.centers, box_array.wlh, box_array.rotations)),
+    }
+
+    def translated():
+        box_array.translate([0.1, 0, 0])
+        box_array.corner_points()
+    results['BoxArray'] = best_of(translated)
+
+    print(f"{args.boxes} boxes, max corner difference {error:.1e}")
+    for name, seconds in results.items():
+        print(f"  {name:<12} {seconds * 1e6:10.1f} us/frame")
+
+
+if __name__ == '__main__':
+    main()
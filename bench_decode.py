@@ -0,0 +1,89 @@
+"""
+Benchmark of the frame decoders on the museum recording.
+
+The frames of test_data/pcd/museum/museum/synced_data.json are re-encoded as
+Outsight CSV records and decoded with record_to_frame, once into object dicts
+(the original parser) and once into a columnar OBJECT_DTYPE array. The batch
+rows decode GetRecords-sized batches with records_to_frames. A second run
+repeats the objects of every frame to emulate crowded scenes.
+
+Usage: python bench_decode.py [--repeat-objects N]
+"""
+import json
+import time
+import argparse
+
+from utils import record_to_frame, records_to_frames, objects2boxes
+
+SYNCED_DATA = 'test_data/pcd/museum/museum/synced_data.json'
+
+
+def frame_to_record(frame, repeat_objects=1):
+    objects = frame['objects'] * repeat_objects
+    lines = [f"FRAME,{frame['frame_Count']},{frame['time_s']},{frame['formatted_time']},"
+             f"{len(objects)},{frame['zone_bindings_len']}"]
+    for obj in objects:
+        lines.append(f"OBJECT,{obj['frame_count']},{obj['obj_id']},{obj['object_class']},"
+                     f"{obj['pos_x']},{obj['pos_y']},{obj['pos_z']},{obj['dim_x']},{obj['dim_y']},{obj['dim_z']},"
+                     f"{obj['speed_mph']},{obj['bearing_degrees']}")
+    return {'Data': '\n'.join(lines).encode('utf-8')}
+
+
+def load_records(repeat_objects=1):
+    with open(SYNCED_DATA, 'r') as f:
+        synced = json.load(f)
+    return [frame_to_record(entry[key], repeat_objects) for entry in synced for key in sorted(entry)]
+
+
+def best_of(function, runs=5):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+BATCH_SIZE = 100
+
+
+def run(repeat_objects):
+    records = load_records(repeat_objects)
+    n_objects = sum(len(record_to_frame([record], columnar=True)['objects']) for record in records)
+    print(f"{len(records)} frames, {n_objects / len(records):.1f} objects per frame")
+
+    results = {
+        'dicts': best_of(lambda: [record_to_frame([record]) for record in records]),
+        'columnar': best_of(lambda: [record_to_frame([record], columnar=True) for record in records]),
+    }
+    batches = [records[i:i + BATCH_SIZE] for i in range(0, len(records), BATCH_SIZE)]
+    results[f'batch of {BATCH_SIZE}, dicts'] = best_of(
+        lambda: [records_to_frames(batch, stats=None) for batch in batches])
+    results[f'batch of {BATCH_SIZE}, columnar'] = best_of(
+        lambda: [records_to_frames(batch, columnar=True, stats=None) for batch in batches])
+    dict_frames = [record_to_frame([record]) for record in records]
+    columnar_frames = [record_to_frame([record], columnar=True) for record in records]
+    results['dicts + objects2boxes'] = results['dicts'] + best_of(
+        lambda: [objects2boxes(frame['objects']) for frame in dict_frames], runs=3)
+    results['columnar + objects2boxes'] = results['columnar'] + best_of(
+        lambda: [objects2boxes(frame['objects']) for frame in columnar_frames], runs=3)
+
+    for name, seconds in results.items():
+        print(f"  {name:<26} {seconds * 1e6 / len(records):8.1f} us/frame")
+    print(f"  decode speed-up: {results['dicts'] / results['columnar']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat-objects', type=int, default=20,
+                        help="Object multiplier for the crowded-scene run.")
+    args = parser.parse_args()
+
+    print("Museum frames:")
+    run(1)
+    print(f"Crowded frames (objects x{args.repeat_objects}):")
+    run(args.repeat_objects)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Scaling benchmark of ParsePool on the museum recording.
+
+Decodes the re-encoded museum frames (objects repeated to emulate crowded
+scenes) in GetRecords-sized batches, first in-process with records_to_frames and
+then through ParsePool with an increasing number of worker processes. Batches
+are submitted ahead and collected in order, as the stream ingestor does.
+
+Usage: python bench_parse_pool.py [--repeat-objects N] [--max-workers N]
+"""
+import os
+import time
+import argparse
+from collections import deque
+
+from bench_decode import BATCH_SIZE, load_records
+from parse_pool import ParsePool
+from utils import records_to_frames
+
+
+def decode_in_pool(pool, batches):
+    frames = 0
+    in_flight = deque()
+    for batch in batches:
+        in_flight.append(pool.submit(batch))
+        if len(in_flight) > pool.workers:
+            frames += len(in_flight.popleft().result())
+    while in_flight:
+        frames += len(in_flight.popleft().result())
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat-objects', type=int, default=20)
+    parser.add_argument('--copies', type=int, default=5, help="Times the recording is decoded per run.")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    records = load_records(args.repeat_objects) * args.copies
+    batches = [records[i:i + BATCH_SIZE] for i in range(0, len(records), BATCH_SIZE)]
+    print(f"{len(records)} records in {len(batches)} batches, {os.cpu_count()} CPUs")
+
+    start = time.perf_counter()
+    for batch in batches:
+        records_to_frames(batch, columnar=True, stats=None)
+    baseline = time.perf_counter() - start
+    print(f"  in-process     {len(records) / baseline:10.0f} frames/s")
+
+    workers = 1
+    while workers <= args.max_workers:
+        pool = ParsePool(workers)
+        decode_in_pool(pool, batches[:pool.workers])  # Start the worker processes
+        start = time.perf_counter()
+        decoded = decode_in_pool(pool, batches)
+        elapsed = time.perf_counter() - start
+        pool.close()
+        assert decoded == len(records)
+        print(f"  {workers:2d} workers     {len(records) / elapsed:10.0f} frames/s"
+              f"   {baseline / elapsed:5.2f}x in-process")
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the point-in-box tests on a museum scan.
+
+The 28,800-point scan test_data/pcd/museum/museum/outsight1.pcd is tested
+against frames of --boxes boxes. The boxes have the sizes and headings of the
+museum objects and are centered on random scan points, so each one holds points:
+
+  per box        geometry_utils.points_in_box once per box, over the whole cloud
+  index build    PointCloudIndex over the scan (once per static cloud)
+  batch          points_in_boxes with the prebuilt index
+  labels         points_box_labels with the prebuilt index
+
+Usage: python bench_points_in_boxes.py [--boxes N] [--frames N]
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from geometry_utils import PointCloudIndex, points_box_labels, points_in_box, points_in_boxes
+from utils import objects2boxarray
+
+SCAN = 'test_data/pcd/museum/museum/outsight1.pcd'
+SYNCED_DATA = 'test_data/pcd/museum/museum/synced_data.json'
+
+
+def read_ascii_pcd(path):
+    # <np.float: 3, n> x, y, z of an ASCII PCD file.
+    with open(path, 'r') as f:
+        header = 0
+        for line in f:
+            header += 1
+            if line.startswith('DATA'):
+                break
+    return np.loadtxt(path, skiprows=header)[:, :3].T
+
+
+def make_frames(points, n_boxes, n_frames, seed=0):
+    with open(SYNCED_DATA, 'r') as f:
+        objects = [obj for entry in json.load(f) for frame in entry.values() for obj in frame['objects']]
+    rng = np.random.default_rng(seed)
+    finite = np.flatnonzero(np.all(np.isfinite(points), axis=0))
+    frames = []
+    for _ in range(n_frames):
+        boxes = objects2boxarray([objects[i] for i in rng.integers(0, len(objects), n_boxes)])
+        boxes.centers = points[:, rng.choice(finite, n_boxes)].T
+        frames.append(boxes)
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boxes', type=int, default=100, help="Boxes per frame.")
+    parser.add_argument('--frames', type=int, default=20)
+    args = parser.parse_args()
+
+    points = read_ascii_pcd(SCAN)
+    frames = make_frames(points, args.boxes, args.frames)
+    box_lists = [frame.to_boxes() for frame in frames]
+
+    start = time.perf_counter()
+    reference = [[np.flatnonzero(points_in_box(box, points)) for box in boxes] for boxes in box_lists]
+    per_box = (time.perf_counter() - start) / args.frames
+
+    start = time.perf_counter()
+    index = PointCloudIndex(points)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = [points_in_boxes(frame, index) for frame in frames]
+    batch = (time.perf_counter() - start) / args.frames
+
+    start = time.perf_counter()
+    labels = [points_box_labels(frame, index) for frame in frames]
+    labelling = (time.perf_counter() - start) / args.frames
+
+    same = all(np.array_equal(a, b) for expected, result in zip(reference, batched) for a, b in zip(expected, result))
+    inside = np.mean([np.count_nonzero(frame_labels >= 0) for frame_labels in labels])
+    print(f"{points.shape[1]} points, {args.boxes} boxes per frame, {inside:.0f} points in a box per frame")
+    print(f"  per box      {per_box * 1e3:8.2f} ms/frame")
+    print(f"  index build  {build * 1e3:8.2f} ms once")
+    print(f"  batch        {batch * 1e3:8.2f} ms/frame   same indices as per box: {same}")
+    print(f"  labels       {labelling * 1e3:8.2f} ms/frame")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Idle CPU use and wake-up latency of the ways the sync stage can wait for a cache.
+
+  spin        re-check the cache without sleeping (the original wait_for_data)
+  poll 5 ms   re-check every 5 ms with asyncio.sleep
+  notify      Cache.wait_for_timestamp_async, woken by Cache.add
+  thread      Cache.wait_for_timestamp from a plain thread
+
+Idle: the waiter waits for a timestamp that never arrives; CPU is process time
+over wall time. Latency: a producer thread adds frames at --rate Hz and the
+waiter waits for each one in turn; latency runs from add() to the wake-up.
+
+Usage: python bench_sync_wakeup.py [--idle-seconds S] [--frames N] [--rate HZ]
+"""
+import time
+import asyncio
+import argparse
+import threading
+
+import numpy as np
+
+from sync import Cache
+
+
+async def spin(cache, timestamp, deadline):
+    while time.monotonic() < deadline:
+        latest = cache.latest_timestamp()
+        if latest is not None and latest >= timestamp:
+            return True
+    return False
+
+
+async def poll(cache, timestamp, deadline):
+    while time.monotonic() < deadline:
+        latest = cache.latest_timestamp()
+        if latest is not None and latest >= timestamp:
+            return True
+        await asyncio.sleep(0.005)
+    return False
+
+
+async def notify(cache, timestamp, deadline):
+    return await cache.wait_for_timestamp_async(timestamp, deadline - time.monotonic())
+
+
+async def thread(cache, timestamp, deadline):
+    return cache.wait_for_timestamp(timestamp, deadline - time.monotonic())
+
+
+WAITERS = {'spin': spin, 'poll 5 ms': poll, 'notify': notify, 'thread': thread}
+
+
+def idle_cpu(waiter, seconds):
+    cache = Cache()
+    start_cpu, start_wall = time.process_time(), time.monotonic()
+    asyncio.run(waiter(cache, 1, start_wall + seconds))
+    return (time.process_time() - start_cpu) / (time.monotonic() - start_wall)
+
+
+def wake_latency(waiter, frames, rate):
+    cache = Cache()
+    added_at = {}
+
+    def produce():
+        time.sleep(0.05)
+        for timestamp in range(1, frames + 1):
+            added_at[timestamp] = time.perf_counter()
+            cache.add({'timestamp_ns': timestamp})
+            time.sleep(1 / rate)
+
+    async def consume():
+        latencies = []
+        for timestamp in range(1, frames + 1):
+            if not await waiter(cache, timestamp, time.monotonic() + 5):
+                raise RuntimeError(f"frame {timestamp} was not delivered")
+            latencies.append(time.perf_counter() - added_at[timestamp])
+        return latencies
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    latencies = asyncio.run(consume())
+    producer.join()
+    return np.array(latencies) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--idle-seconds', type=float, default=2.0)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=100.0, help="Frames per second added by the producer.")
+    args = parser.parse_args()
+
+    print(f"{'waiter':<10} {'idle CPU':>9} {'median':>10} {'p99':>10} {'max':>10}")
+    for name, waiter in WAITERS.items():
+        cpu = idle_cpu(waiter, args.idle_seconds)
+        latencies = wake_latency(waiter, args.frames, args.rate)
+        print(f"{name:<10} {cpu:8.1%} {np.median(latencies):8.0f}us "
+              f"{np.percentile(latencies, 99):8.0f}us {latencies.max():8.0f}us")
+
+
+if __name__ == '__main__':
+    main()
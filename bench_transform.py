@@ -0,0 +1,123 @@
+"""
+Benchmark of the box transforms on the museum recording.
+
+The boxes of cache1 (outsight2) in test_data/pcd/museum/museum/synced_data.json
+are moved into cache0's frame (outsight1) with the museum calibration:
+
+  process pool   the previous transform_boxes_list: a ProcessPoolExecutor per
+                 frame, one transform_box task per box (run on --pool-frames frames)
+  per box        transform_box on every box, scipy Rotation round trip
+  per frame      transform_boxes_list on the boxes of each frame
+  recording      transform_boxes_list on the boxes of every frame at once
+  arrays only    transform_boxes_batch on stacked arrays, without Box objects
+
+Every path is checked against the per-box reference before it is timed.
+
+Usage: python bench_transform.py [--pool-frames N]
+"""
+import copy
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pyquaternion import Quaternion
+from scipy.spatial.transform import Rotation as R
+
+from calibration import load_calibration
+from utils import (objects2boxes, quaternions_to_matrices, transform_boxes_batch,
+                   transform_boxes_list)
+
+SYNCED_DATA = 'test_data/pcd/museum/museum/synced_data.json'
+calibration_matrix = load_calibration().get('outsight2', 'outsight1')
+
+
+def scipy_transform_box(box, transformation_matrix):
+    # transform_box before the batched transforms.
+    box.center = (transformation_matrix @ np.append(box.center, 1))[:3]
+    rotation_matrix = np.dot(transformation_matrix[:3, :3], box.orientation.rotation_matrix)
+    quat = R.from_matrix(rotation_matrix).as_quat()
+    box.orientation = Quaternion(quat[3], quat[0], quat[1], quat[2])
+    return box
+
+
+def pool_transform_boxes_list(boxes, matrix):
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(scipy_transform_box, box, matrix) for box in boxes]
+        return [future.result() for future in futures]
+
+
+def load_frames():
+    with open(SYNCED_DATA, 'r') as f:
+        synced = json.load(f)
+    return [objects2boxes(entry['cache1']['objects']) for entry in synced]
+
+
+def timed(function, frames, runs=3):
+    # Boxes are transformed in place, so every run gets fresh copies.
+    best = None
+    for _ in range(runs):
+        boxes = copy.deepcopy(frames)
+        start = time.perf_counter()
+        result = function(boxes)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def max_error(frames, reference):
+    # Largest center and rotation matrix difference (quaternion signs may differ).
+    boxes = [box for frame in frames for box in frame]
+    expected = [box for frame in reference for box in frame]
+    centers = max(np.abs(a.center - b.center).max() for a, b in zip(boxes, expected))
+    rotations = max(np.abs(a.orientation.rotation_matrix - b.orientation.rotation_matrix).max()
+                    for a, b in zip(boxes, expected))
+    return max(centers, rotations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pool-frames', type=int, default=10,
+                        help="Frames run through the process pool path, which is slow.")
+    args = parser.parse_args()
+
+    frames = load_frames()
+    n_boxes = sum(len(frame) for frame in frames)
+    print(f"{len(frames)} frames, {n_boxes / len(frames):.1f} boxes per frame")
+    _, reference = timed(lambda fs: [[scipy_transform_box(box, calibration_matrix) for box in frame]
+                                     for frame in fs], frames, runs=1)
+
+    def whole_recording(fs):
+        transform_boxes_list([box for frame in fs for box in frame], calibration_matrix)
+        return fs
+
+    paths = {
+        'per box': lambda fs: [[scipy_transform_box(box, calibration_matrix) for box in frame] for frame in fs],
+        'per frame': lambda fs: [transform_boxes_list(frame, calibration_matrix) for frame in fs],
+        'recording': whole_recording,
+    }
+    results = {}
+    pool_frames = frames[:args.pool_frames]
+    seconds, transformed = timed(lambda fs: [pool_transform_boxes_list(frame, calibration_matrix) for frame in fs],
+                                 pool_frames, runs=1)
+    results['process pool'] = (seconds / len(pool_frames), max_error(transformed, reference[:len(pool_frames)]))
+    for name, function in paths.items():
+        seconds, transformed = timed(function, frames)
+        results[name] = (seconds / len(frames), max_error(transformed, reference))
+
+    boxes = [box for frame in frames for box in frame]
+    centers = np.array([box.center for box in boxes])
+    rotations = quaternions_to_matrices([box.orientation.elements for box in boxes])
+    velocities = np.array([box.velocity for box in boxes])
+    start = time.perf_counter()
+    transform_boxes_batch(centers, rotations, velocities, calibration_matrix)
+    results['arrays only'] = ((time.perf_counter() - start) / len(frames), 0.0)
+
+    for name, (seconds, error) in results.items():
+        print(f"  {name:<14} {seconds * 1e6:10.1f} us/frame   max error {error:.1e}")
+    print(f"  per frame speed-up over the process pool: {results['process pool'][0] / results['per frame'][0]:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark of the planar (yaw) box path against the quaternion paths.
+
+Every frame of test_data/pcd/museum/museum/synced_data.json is turned into
+boxes and moved from outsight2 into outsight1 (cache1 -> cache0):
+
+  quaternion     objects2boxes, then per box Quaternion -> matrix -> scipy
+                 Rotation -> quaternion (the transform_box of old)
+  batched Box    objects2boxes, then transform_boxes_list
+  BoxArray 3x3   objects2boxarray with full rotation matrices, then transform
+  BoxArray yaw   objects2boxarray (planar), then transform
+  + quaternions  the same, plus the quaternions built on demand
+
+The museum extrinsic tilts the z axis by ~0.8 degrees, so its planar rows fall
+back to rotation matrices. The rows are repeated with a z-aligned extrinsic
+(the museum heading and translation only), and with the museum extrinsic at a
+planar tolerance of 1e-3 (tilts up to ~2.6 degrees), which keeps the yaws and
+drops the tilt; the corner error of that approximation is printed.
+
+Usage: python bench_yaw.py [--repeat-objects N]
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from bench_transform import scipy_transform_box
+from calibration import load_calibration
+from data_classes import PLANAR_TOLERANCE
+from geometry_utils import yaw_matrices
+from utils import objects2boxarray, objects2boxes, transform_boxes_list
+
+SYNCED_DATA = 'test_data/pcd/museum/museum/synced_data.json'
+
+
+def best_of(function, runs=3):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def z_aligned(matrix):
+    # The heading and translation of a transform, without its tilt.
+    aligned = np.eye(4)
+    aligned[:3, :3] = yaw_matrices(np.array([np.arctan2(matrix[1, 0], matrix[0, 0])]))[0]
+    aligned[:3, 3] = matrix[:3, 3]
+    return aligned
+
+
+def box_array_path(frames, matrix, planar=True, quaternions=False, planar_tolerance=PLANAR_TOLERANCE):
+    results = []
+    for objects in frames:
+        boxes = objects2boxarray(objects)
+        if not planar:
+            boxes.rotations = boxes.rotations
+        boxes.transform(matrix, planar_tolerance)
+        if quaternions:
+            boxes.quaternions()
+        results.append(boxes)
+    return results
+
+
+def run(frames, matrix, label):
+    n = len(frames)
+    paths = {
+        'quaternion': lambda: [[scipy_transform_box(box, matrix) for box in objects2boxes(objects)]
+                               for objects in frames],
+        'batched Box': lambda: [transform_boxes_list(objects2boxes(objects), matrix) for objects in frames],
+        'BoxArray 3x3': lambda: box_array_path(frames, matrix, planar=False),
+        'BoxArray yaw': lambda: box_array_path(frames, matrix),
+        '+ quaternions': lambda: box_array_path(frames, matrix, quaternions=True),
+    }
+    results = {}
+    for name, function in paths.items():
+        results[name] = best_of(function)
+    reference = np.concatenate([np.stack([box.corners().T for box in frame]) for frame in results['quaternion'][1]])
+    planar = results['BoxArray yaw'][1]
+    corners = np.concatenate([boxes.corner_points() for boxes in planar])
+    print(f"{label}: yaw path stays planar: {all(boxes.planar for boxes in planar)}, "
+          f"max corner difference {np.abs(corners - reference).max():.1e}")
+    for name, (seconds, _) in results.items():
+        print(f"  {name:<14} {seconds * 1e6 / n:8.1f} us/frame   {results['quaternion'][0] / seconds:6.1f}x")
+    return reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat-objects', type=int, default=1, help="Object multiplier for crowded frames.")
+    args = parser.parse_args()
+
+    with open(SYNCED_DATA, 'r') as f:
+        frames = [entry['cache1']['objects'] * args.repeat_objects for entry in json.load(f)]
+    print(f"{len(frames)} frames, {sum(map(len, frames)) / len(frames):.1f} objects per frame")
+
+    museum = load_calibration().get('outsight2', 'outsight1')
+    reference = run(frames, museum, "museum extrinsic")
+    run(frames, z_aligned(museum), "z-aligned extrinsic")
+
+    seconds, approximated = best_of(lambda: box_array_path(frames, museum, planar_tolerance=1e-3))
+    corners = np.concatenate([boxes.corner_points() for boxes in approximated])
+    print(f"museum extrinsic, planar tolerance 1e-3: {seconds * 1e6 / len(frames):8.1f} us/frame, "
+          f"max corner error {np.abs(corners - reference).max():.3f} m")
+
+
+if __name__ == '__main__':
+    main()
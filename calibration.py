@@ -0,0 +1,149 @@
+"""
+Sensor extrinsics of a site as a graph of coordinate frames.
+
+A calibration file lists the measured transforms between frames (PCD scan axes,
+lidars, Outsight sensors, ...), which frame is the world frame, and the frame of
+every stream:
+
+    {"site": "museum",
+     "world": "outsight1",
+     "streams": {"museum-outsight-1": "outsight1", ...},
+     "transforms": [{"from": "lidar1", "to": "outsight1", "matrix": [[...], ...]}, ...]}
+
+A matrix maps points in its "from" frame to its "to" frame; all of them are
+rigid transforms. The registry composes and inverts them once, when it is
+loaded, so every lookup afterwards is a dict access.
+"""
+import os
+import json
+import logging
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+MUSEUM_CALIBRATION = os.path.join(CONFIG_DIR, 'museum_calibration.json')
+
+WORLD = 'world'
+CONSISTENCY_TOLERANCE = 1e-3  # Largest disagreement between two paths around a loop of the graph
+
+
+def invert_transform(matrix: np.ndarray) -> np.ndarray:
+    """
+    :param matrix: <np.float: 4, 4>. Rigid transform.
+    :return: <np.float: 4, 4>. Its inverse, using the transposed rotation.
+    """
+    rotation = matrix[:3, :3]
+    inverse = np.eye(4)
+    inverse[:3, :3] = rotation.T
+    inverse[:3, 3] = -rotation.T @ matrix[:3, 3]
+    return inverse
+
+
+class CalibrationRegistry:
+    """
+    Every transform between the frames of a site, precomputed.
+
+    get(a, b) returns the 4x4 matrix taking points from frame a to frame b, for
+    any two frames connected by a chain of measured transforms (in either
+    direction). The matrices are shared and read-only; copy them to modify them.
+    """
+
+    def __init__(self, transforms: List[Tuple[str, str, np.ndarray]], world: str = None,
+                 streams: Dict[str, str] = None, site: str = None):
+        """
+        :param transforms: (from frame, to frame, <np.float: 4, 4>) measured transforms.
+        :param world: Frame that the 'world' frame coincides with, optional.
+        :param streams: Frame of every stream by stream name, optional.
+        :param site: Site name, for messages.
+        """
+        self.site = site
+        self.streams = dict(streams or {})
+        edges = {}
+        for source, target, matrix in transforms:
+            matrix = np.asarray(matrix, dtype=float)
+            if matrix.shape != (4, 4):
+                raise ValueError(f"Transform {source} -> {target} is not 4x4")
+            edges.setdefault(source, []).append((target, matrix))
+            edges.setdefault(target, []).append((source, invert_transform(matrix)))
+        if world is not None:
+            edges.setdefault(world, []).append((WORLD, np.eye(4)))
+            edges.setdefault(WORLD, []).append((world, np.eye(4)))
+        self._transforms = {}
+        for frame in edges:
+            self._transforms.update(self._compose_from(frame, edges))
+
+    @classmethod
+    def from_dict(cls, config: Dict) -> 'CalibrationRegistry':
+        transforms = [(transform['from'], transform['to'], transform['matrix']) for transform in config['transforms']]
+        return cls(transforms, world=config.get('world'), streams=config.get('streams'), site=config.get('site'))
+
+    @classmethod
+    def from_json(cls, filename: str) -> 'CalibrationRegistry':
+        with open(filename, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def _compose_from(self, source: str, edges: Dict) -> Dict[Tuple[str, str], np.ndarray]:
+        # Breadth-first walk from `source`, composing the transforms along the way.
+        reached = {source: np.eye(4)}
+        pending = deque([source])
+        while pending:
+            frame = pending.popleft()
+            for neighbour, matrix in edges[frame]:
+                composed = matrix @ reached[frame]
+                if neighbour not in reached:
+                    reached[neighbour] = composed
+                    pending.append(neighbour)
+                elif np.abs(composed - reached[neighbour]).max() > CONSISTENCY_TOLERANCE:
+                    logger.warning("Calibration %s: the paths from %s to %s disagree by %.4f.", self.site, source,
+                                   neighbour, np.abs(composed - reached[neighbour]).max())
+        for matrix in reached.values():
+            matrix.flags.writeable = False
+        return {(source, target): matrix for target, matrix in reached.items()}
+
+    @property
+    def frames(self) -> List[str]:
+        return sorted({source for source, _ in self._transforms})
+
+    def has(self, source: str, target: str) -> bool:
+        return (source, target) in self._transforms
+
+    def get(self, source: str, target: str = WORLD) -> np.ndarray:
+        """
+        :return: <np.float: 4, 4>. Transform of points from frame `source` to frame `target`.
+        """
+        try:
+            return self._transforms[source, target]
+        except KeyError:
+            frames = self.frames
+            missing = [frame for frame in (source, target) if frame not in frames]
+            if missing:
+                raise KeyError(f"Unknown frame {missing[0]!r}; frames: {frames}") from None
+            raise KeyError(f"No chain of transforms from {source!r} to {target!r}") from None
+
+    def stream_frame(self, stream: str) -> str:
+        if stream not in self.streams:
+            raise KeyError(f"No frame for stream {stream!r} in the calibration of {self.site}")
+        return self.streams[stream]
+
+    def stream_transform(self, stream: str, target_stream: str) -> np.ndarray:
+        """
+        :return: <np.float: 4, 4>. Transform from the frame of one stream to another's.
+        """
+        return self.get(self.stream_frame(stream), self.stream_frame(target_stream))
+
+
+_registries = {}
+
+
+def load_calibration(filename: str = MUSEUM_CALIBRATION) -> CalibrationRegistry:
+    """
+    :return: The registry of a calibration file, loaded once per process.
+    """
+    filename = os.path.abspath(filename)
+    if filename not in _registries:
+        _registries[filename] = CalibrationRegistry.from_json(filename)
+    return _registries[filename]
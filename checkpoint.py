@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def position_key(sequence_number: str, sub_sequence_number: Optional[int]) -> Tuple[int, float]:
+    # A whole record comes after every payload of an aggregated record with its sequence number.
+    return int(sequence_number), float('inf') if sub_sequence_number is None else sub_sequence_number
+
+
+class CheckpointStore:
+    """
+    Local store of the last processed sequence number per stream and shard.
+
+    Updates are kept in memory and written to disk (atomically, as JSON) at most
+    once every `flush_interval_ms`, so checkpointing costs one small file write
+    per interval no matter how many frames are processed.
+
+    A checkpoint inside a record written by an aggregating KinesisProducer also
+    holds the sub-sequence number of the last processed payload; it is stored as
+    {"sequence_number": ..., "sub_sequence_number": ...} instead of the plain
+    sequence number string.
+    """
+
+    def __init__(self, path: str, flush_interval_ms: int = 1000):
+        """
+        :param path: JSON file holding the checkpoints. Loaded if it exists.
+        :param flush_interval_ms: Minimum time between two writes of the file.
+        """
+        self.path = path
+        self.flush_interval = flush_interval_ms / 1000
+        self.lock = threading.Lock()
+        self.checkpoints: Dict[str, Dict[str, Tuple[str, Optional[int]]]] = {}
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for stream_name, shards in json.load(f).items():
+                    self.checkpoints[stream_name] = {
+                        shard_id: ((checkpoint['sequence_number'], checkpoint['sub_sequence_number'])
+                                   if isinstance(checkpoint, dict) else (checkpoint, None))
+                        for shard_id, checkpoint in shards.items()
+                    }
+            logger.info("Loaded checkpoints from %s.", path)
+
+    def get(self, stream_name: str, shard_id: str) -> Optional[str]:
+        """
+        :return: The last processed sequence number of the shard, or None.
+        """
+        position = self.get_position(stream_name, shard_id)
+        return None if position is None else position[0]
+
+    def get_position(self, stream_name: str, shard_id: str) -> Optional[Tuple[str, Optional[int]]]:
+        """
+        :return: (sequence number, sub-sequence number) of the last processed record
+                 of the shard, or None. The sub-sequence number is None unless the
+                 checkpoint is inside an aggregated record.
+        """
+        with self.lock:
+            return self.checkpoints.get(stream_name, {}).get(shard_id)
+
+    def update(self, stream_name: str, shard_id: str, sequence_number: str,
+               sub_sequence_number: Optional[int] = None) -> None:
+        """
+        Records that a record, or one payload of an aggregated record, has been
+        fully processed. Checkpoints only move forward; older positions are ignored.
+        """
+        with self.lock:
+            shards = self.checkpoints.setdefault(stream_name, {})
+            current = shards.get(shard_id)
+            if current is not None and position_key(*current) >= position_key(sequence_number, sub_sequence_number):
+                return
+            shards[shard_id] = (sequence_number, sub_sequence_number)
+            self._dirty = True
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._write()
+
+    def flush(self) -> None:
+        """
+        Writes pending checkpoints now.
+        """
+        with self.lock:
+            if self._dirty:
+                self._write()
+
+    def _write(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({stream_name: {shard_id: sequence if sub is None else
+                                     {'sequence_number': sequence, 'sub_sequence_number': sub}
+                                     for shard_id, (sequence, sub) in shards.items()}
+                       for stream_name, shards in self.checkpoints.items()}, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_flush = time.monotonic()
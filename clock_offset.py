@@ -0,0 +1,116 @@
+from collections import deque
+from typing import Dict, List
+
+import numpy as np
+
+
+class ClockOffsetEstimator:
+    """
+    Online estimate of the clock offset and drift of every stream relative to a
+    reference stream.
+
+    Each frame carries its sensor timestamp and the time the stream received it
+    (Kinesis' ApproximateArrivalTimestamp, one server clock for all streams). Their
+    difference is the transport delay plus the sensor's clock error. The smallest
+    delay seen in each window of sensor time is taken as the delay floor (the
+    lower envelope), and a line fitted through the floors of the last windows
+    gives the stream's clock error and its drift. Differences to the reference
+    stream's line are the offsets.
+
+    This assumes the streams have similar minimum transport delays. Co-observed
+    object motion is not used.
+    """
+
+    def __init__(self, n_streams: int, reference: int = 0, window_s: float = 10.0, history: int = 30,
+                 max_offset_s: float = 1.0):
+        """
+        :param n_streams: Number of streams.
+        :param reference: Index of the stream whose clock the offsets are relative to.
+        :param window_s: Sensor time over which the delay floor is taken.
+        :param history: Number of windows the fit uses.
+        :param max_offset_s: Offsets are clamped to this magnitude.
+        """
+        self.reference = reference
+        self.window_ns = int(window_s * 1e9)
+        self.max_offset_ns = int(max_offset_s * 1e9)
+        self._floors = [deque(maxlen=history) for _ in range(n_streams)]  # [window, minimum delay (ns)]
+        self._models = [None] * n_streams
+        self.samples = [0] * n_streams
+        self.resets = [0] * n_streams
+
+    def observe(self, stream: int, sensor_ns: int, arrival_ns: int) -> None:
+        """
+        Adds one frame of `stream`: its sensor timestamp and its arrival time (ns).
+        A frame from before the stream's newest window means its clock jumped back;
+        the stream's history is then dropped.
+        """
+        delay = arrival_ns - sensor_ns
+        window = sensor_ns // self.window_ns
+        floors = self._floors[stream]
+        self.samples[stream] += 1
+        if floors and window < floors[-1][0]:
+            # The sensor clock jumped back: the floors measured on the old clock do not
+            # apply to the new one, so the estimate starts over.
+            floors.clear()
+            self.resets[stream] += 1
+        if floors and floors[-1][0] == window:
+            if delay >= floors[-1][1]:
+                return
+            floors[-1][1] = delay
+        else:
+            floors.append([window, delay])
+        self._models[stream] = None
+
+    def _model(self, stream: int):
+        # (reference time, slope, delay at the reference time) of the stream's delay floor.
+        if self._models[stream] is None:
+            floors = np.array(self._floors[stream], dtype=np.float64)
+            times = (floors[:, 0] + 0.5) * self.window_ns
+            origin = times[-1]
+            # The newest window is still open, so its floor is only an upper bound.
+            closed = slice(0, len(floors) - 1)
+            if len(floors) > 3:
+                slope, intercept = np.polyfit(times[closed] - origin, floors[closed, 1], 1)
+            else:
+                slope, intercept = 0.0, floors[:, 1].min()
+            self._models[stream] = (origin, slope, intercept)
+        return self._models[stream]
+
+    def ready(self, stream: int) -> bool:
+        return bool(self._floors[stream]) and bool(self._floors[self.reference])
+
+    def delay_floor_ns(self, stream: int, at_ns: int) -> float:
+        origin, slope, intercept = self._model(stream)
+        return intercept + slope * (at_ns - origin)
+
+    def offset_ns(self, stream: int, at_ns: int) -> int:
+        """
+        :return: Nanoseconds to add to the timestamps of `stream` around `at_ns` to
+            express them in the reference stream's clock; 0 until both streams
+            have been observed.
+        """
+        if stream == self.reference or not self.ready(stream):
+            return 0
+        offset = self.delay_floor_ns(stream, at_ns) - self.delay_floor_ns(self.reference, at_ns)
+        return int(np.clip(offset, -self.max_offset_ns, self.max_offset_ns))
+
+    def drift_ppm(self, stream: int) -> float:
+        """
+        :return: How fast the offset of `stream` changes, in microseconds per second.
+        """
+        if stream == self.reference or not self.ready(stream):
+            return 0.0
+        return (self._model(stream)[1] - self._model(self.reference)[1]) * 1e6
+
+    def metrics(self, at_ns: int, keys: List[str] = None) -> Dict[str, Dict]:
+        """
+        :param at_ns: Time at which the offsets are evaluated.
+        :param keys: Stream names for the output; defaults to the indices.
+        """
+        keys = keys or list(range(len(self._floors)))
+        return {
+            'offset_ms': {key: self.offset_ns(i, at_ns) / 1e6 for i, key in enumerate(keys)},
+            'drift_ppm': {key: float(self.drift_ppm(i)) for i, key in enumerate(keys)},
+            'samples': dict(zip(keys, self.samples)),
+            'resets': dict(zip(keys, self.resets)),
+        }
@@ -13,7 +13,8 @@ from matplotlib.axes import Axes
 from pyquaternion import Quaternion
 
 
-from geometry_utils import view_points, transform_matrix
+from geometry_utils import view_points, transform_matrix, corners_batch, matrices_to_quaternions, \
+    quaternions_to_matrices, yaw_matrices
 
 def string2array(data_string):
 
@@ -31,7 +32,13 @@ def string2array(data_string):
     return array
 
 class Box:
-    """ Simple data class representing a 3d box including, label, score and velocity. """
+    """
+    Simple data class representing a 3d box including, label, score and velocity.
+
+    The rotation matrix and the corners are cached; assigning center, wlh or
+    orientation (which translate and rotate do) clears the cache. Modify those
+    arrays in place only through translate.
+    """
 
     def __init__(self,
                  center: List[float],
@@ -58,6 +65,8 @@ class Box:
         assert len(size) == 3
         assert type(orientation) == Quaternion
 
+        self._rotation_matrix = None
+        self._corners = None
         self.center = np.array(center)
         self.wlh = np.array(size)
         self.orientation = orientation
@@ -88,13 +97,43 @@ class Box:
                                self.orientation.axis[2], self.orientation.degrees, self.orientation.radians,
                                self.velocity[0], self.velocity[1], self.velocity[2], self.name, self.token)
 
+    @property
+    def center(self) -> np.ndarray:
+        return self._center
+
+    @center.setter
+    def center(self, center: np.ndarray) -> None:
+        self._center = center
+        self._corners = None
+
+    @property
+    def wlh(self) -> np.ndarray:
+        return self._wlh
+
+    @wlh.setter
+    def wlh(self, wlh: np.ndarray) -> None:
+        self._wlh = wlh
+        self._corners = None
+
+    @property
+    def orientation(self) -> Quaternion:
+        return self._orientation
+
+    @orientation.setter
+    def orientation(self, orientation: Quaternion) -> None:
+        self._orientation = orientation
+        self._rotation_matrix = None
+        self._corners = None
+
     @property
     def rotation_matrix(self) -> np.ndarray:
         """
         Return a rotation matrix.
         :return: <np.float: 3, 3>. The box's rotation matrix.
         """
-        return self.orientation.rotation_matrix
+        if self._rotation_matrix is None:
+            self._rotation_matrix = self.orientation.rotation_matrix
+        return self._rotation_matrix
 
     def translate(self, x: np.ndarray) -> None:
         """
@@ -123,29 +162,19 @@ class Box:
 
     def corners(self, wlh_factor: float = 1.0) -> np.ndarray:
         """
-        Returns the bounding box corners.
+        Returns the bounding box corners. The unscaled corners are cached and read-only.
         :param wlh_factor: Multiply w, l, h by a factor to scale the box.
         :return: <np.float: 3, 8>. First four corners are the ones facing forward.
             The last four are the ones facing backwards.
         """
-        w, l, h = self.wlh * wlh_factor
-
-        # 3D bounding box corners. (Convention: x points forward, y to the left, z up.)
-        x_corners = l / 2 * np.array([1,  1,  1,  1, -1, -1, -1, -1])
-        y_corners = w / 2 * np.array([1, -1, -1,  1,  1, -1, -1,  1])
-        z_corners = h / 2 * np.array([1,  1, -1, -1,  1,  1, -1, -1])
-        corners = np.vstack((x_corners, y_corners, z_corners))
-
-        # Rotate
-        corners = np.dot(self.orientation.rotation_matrix, corners)
-
-        # Translate
-        x, y, z = self.center
-        corners[0, :] = corners[0, :] + x
-        corners[1, :] = corners[1, :] + y
-        corners[2, :] = corners[2, :] + z
-
-        return corners
+        if wlh_factor != 1.0:
+            return corners_batch(self.center[np.newaxis], self.wlh[np.newaxis], self.rotation_matrix[np.newaxis],
+                                 wlh_factor)[0].T
+        if self._corners is None:
+            self._corners = corners_batch(self.center[np.newaxis], self.wlh[np.newaxis],
+                                          self.rotation_matrix[np.newaxis])[0].T
+            self._corners.flags.writeable = False
+        return self._corners
 
     def bottom_corners(self) -> np.ndarray:
         """
@@ -243,4 +272,269 @@ class Box:
         Create a copy of self.
         :return: A copy.
         """
-        return copy.deepcopy(self)
\ No newline at end of file
+        return copy.deepcopy(self)
+
+# Largest z axis tilt (1 - cosine of the angle) of a rotation that keeps planar boxes planar.
+PLANAR_TOLERANCE = 1e-12  # A tilt of ~1.4e-6 rad
+
+
+class BoxArray:
+    """
+    N 3d boxes stored as contiguous arrays, the batched counterpart of Box: every
+    operation works on all boxes at once.
+
+    Boxes built from yaws are planar: their orientation is only a heading about z,
+    and rotation matrices and quaternions are derived from it on demand. Rotations
+    that keep z up are composed with the yaws directly; any other rotation turns
+    the array into full rotation matrices.
+
+    Like Box, the corners are cached until centers, wlh, rotations or yaws are assigned.
+
+    Labels and ids are -1 where unknown, scores and velocities NaN.
+    """
+
+    def __init__(self,
+                 centers: np.ndarray,
+                 wlh: np.ndarray,
+                 rotations: np.ndarray = None,
+                 yaws: np.ndarray = None,
+                 velocities: np.ndarray = None,
+                 labels: np.ndarray = None,
+                 scores: np.ndarray = None,
+                 ids: np.ndarray = None):
+        """
+        :param centers: <np.float: n, 3>. Box centers as x, y, z.
+        :param wlh: <np.float: n, 3>. Box sizes as width, length, height.
+        :param rotations: <np.float: n, 3, 3>. Box orientations as rotation matrices.
+        :param yaws: <np.float: n>. Rotations about the z axis in radians, instead of
+            `rotations`; makes the array planar.
+        :param velocities: <np.float: n, 3>. Box velocities in x, y, z direction, optional.
+        :param labels: <np.int: n>. Integer labels, optional.
+        :param scores: <np.float: n>. Classification scores, optional.
+        :param ids: <np.int: n>. Track ids, optional.
+        """
+        self._corners = None
+        self.centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        n = len(self.centers)
+        self.wlh = np.asarray(wlh, dtype=float).reshape(n, 3)
+        if rotations is not None:
+            self.rotations = np.asarray(rotations, dtype=float).reshape(n, 3, 3)
+        else:
+            self.yaws = np.zeros(n) if yaws is None else np.asarray(yaws, dtype=float).reshape(n)
+        self.velocities = (np.full((n, 3), np.nan) if velocities is None
+                           else np.asarray(velocities, dtype=float).reshape(n, 3))
+        self.labels = np.full(n, -1, dtype=np.int64) if labels is None else np.asarray(labels, dtype=np.int64)
+        self.scores = np.full(n, np.nan) if scores is None else np.asarray(scores, dtype=float)
+        self.ids = np.full(n, -1, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+
+    @classmethod
+    def from_boxes(cls, boxes: List[Box]) -> 'BoxArray':
+        """
+        :param boxes: Boxes to copy; names and tokens are not kept.
+        """
+        if not boxes:
+            return cls(np.zeros((0, 3)), np.zeros((0, 3)))
+        labels = [-1 if np.isnan(box.label) else box.label for box in boxes]
+        return cls(centers=[box.center for box in boxes],
+                   wlh=[box.wlh for box in boxes],
+                   rotations=quaternions_to_matrices([box.orientation.elements for box in boxes]),
+                   velocities=[box.velocity for box in boxes],
+                   labels=labels,
+                   scores=[box.score for box in boxes])
+
+    @classmethod
+    def concatenate(cls, arrays: List['BoxArray']) -> 'BoxArray':
+        """
+        :param arrays: Box arrays, e.g. the frames of a recording.
+        :return: One array holding all their boxes in order.
+        """
+        if not arrays:
+            return cls(np.zeros((0, 3)), np.zeros((0, 3)))
+        planar = all(a.planar for a in arrays)
+        return cls(centers=np.concatenate([a.centers for a in arrays]),
+                   wlh=np.concatenate([a.wlh for a in arrays]),
+                   rotations=None if planar else np.concatenate([a.rotations for a in arrays]),
+                   yaws=np.concatenate([a.yaws for a in arrays]) if planar else None,
+                   velocities=np.concatenate([a.velocities for a in arrays]),
+                   labels=np.concatenate([a.labels for a in arrays]),
+                   scores=np.concatenate([a.scores for a in arrays]),
+                   ids=np.concatenate([a.ids for a in arrays]))
+
+    def to_boxes(self) -> List[Box]:
+        """
+        :return: One Box per box of the array.
+        """
+        quaternions = self.quaternions()
+        return [Box(center, size, Quaternion(quaternion),
+                    label=np.nan if label < 0 else label, score=score, velocity=velocity)
+                for center, size, quaternion, velocity, label, score
+                in zip(self.centers, self.wlh, quaternions, self.velocities, self.labels, self.scores)]
+
+    def __len__(self) -> int:
+        return len(self.centers)
+
+    def __getitem__(self, index) -> 'BoxArray':
+        """
+        :param index: An integer returns that box as a Box; a slice, index array or
+            boolean mask returns a BoxArray.
+        """
+        if isinstance(index, (int, np.integer)):
+            return self[index:index + 1 if index != -1 else None].to_boxes()[0]
+        if self.planar:
+            orientation = {'yaws': self._yaws[index]}
+        else:
+            orientation = {'rotations': self._rotations[index]}
+        return BoxArray(self.centers[index], self.wlh[index], velocities=self.velocities[index],
+                        labels=self.labels[index], scores=self.scores[index], ids=self.ids[index], **orientation)
+
+    def __repr__(self):
+        return 'BoxArray of {} boxes, labels: {}'.format(len(self), np.unique(self.labels).tolist())
+
+    def filter(self, mask: np.ndarray) -> 'BoxArray':
+        """
+        :param mask: <np.bool: n>. Boxes to keep.
+        """
+        return self[np.asarray(mask, dtype=bool)]
+
+    @property
+    def planar(self) -> bool:
+        """
+        :return: Whether the orientations are yaws only.
+        """
+        return self._yaws is not None
+
+    @property
+    def yaws(self) -> np.ndarray:
+        """
+        :return: <np.float: n>. Heading of every box about the z axis in radians.
+        """
+        if self._yaws is not None:
+            return self._yaws
+        return np.arctan2(self._rotations[:, 1, 0], self._rotations[:, 0, 0])
+
+    @yaws.setter
+    def yaws(self, yaws: np.ndarray) -> None:
+        # Headings wrapped to [-pi, pi); rotation matrices are derived when needed.
+        self._yaws = np.mod(yaws + np.pi, 2 * np.pi) - np.pi
+        self._rotations = None
+        self._corners = None
+
+    def quaternions(self) -> np.ndarray:
+        """
+        :return: <np.float: n, 4>. Orientations as (w, x, y, z) quaternions, with w >= 0.
+        """
+        if self._yaws is None:
+            return matrices_to_quaternions(self._rotations)
+        # The yaws are in [-pi, pi), so cos(yaw / 2) >= 0.
+        quaternions = np.zeros((len(self._yaws), 4))
+        quaternions[:, 0] = np.cos(self._yaws / 2)
+        quaternions[:, 3] = np.sin(self._yaws / 2)
+        return quaternions
+
+    def translate(self, x: np.ndarray) -> None:
+        """
+        Applies a translation to all boxes.
+        :param x: <np.float: 3> or <np.float: n, 3>. Translation in x, y, z direction.
+        """
+        self.centers = self.centers + np.asarray(x, dtype=float).reshape(-1, 3)
+
+    def rotate(self, rotation, planar_tolerance: float = PLANAR_TOLERANCE) -> None:
+        """
+        Rotates all boxes about the origin.
+        :param rotation: Quaternion or <np.float: 3, 3> rotation matrix to apply.
+        :param planar_tolerance: Planar boxes stay planar if the rotation keeps the z axis
+            up, with 1 - cos(tilt) at most this much; their new yaws are the headings of
+            their rotated x axes. Otherwise they get full rotation matrices.
+        """
+        rotation_matrix = rotation.rotation_matrix if isinstance(rotation, Quaternion) else np.asarray(rotation)
+        if rotation_matrix.shape != (3, 3):
+            raise ValueError("Rotation matrix must be 3x3")
+        self.centers = self.centers @ rotation_matrix.T
+        self.velocities = self.velocities @ rotation_matrix.T
+        # z must stay up: R[2, 2] near +1 (a tilt of at most the tolerance), not -1 as in a roll by 180 degrees.
+        if self.planar and 1 - rotation_matrix[2, 2] <= planar_tolerance:
+            # Rotated heading (cos, sin, 0) -> R[:2, :2] @ (cos, sin).
+            cos, sin = np.cos(self._yaws), np.sin(self._yaws)
+            self.yaws = np.arctan2(rotation_matrix[1, 0] * cos + rotation_matrix[1, 1] * sin,
+                                   rotation_matrix[0, 0] * cos + rotation_matrix[0, 1] * sin)
+        else:
+            self.rotations = np.matmul(rotation_matrix, self.rotations)
+
+    def transform(self, transformation_matrix: np.ndarray, planar_tolerance: float = PLANAR_TOLERANCE) -> None:
+        """
+        Applies a rigid transformation to all boxes.
+        :param transformation_matrix: <np.float: 4, 4>. From the boxes' frame to the target frame.
+        :param planar_tolerance: See rotate.
+        """
+        self.rotate(transformation_matrix[:3, :3], planar_tolerance)
+        self.translate(transformation_matrix[:3, 3])
+
+    @property
+    def centers(self) -> np.ndarray:
+        return self._centers
+
+    @centers.setter
+    def centers(self, centers: np.ndarray) -> None:
+        self._centers = centers
+        self._corners = None
+
+    @property
+    def wlh(self) -> np.ndarray:
+        return self._wlh
+
+    @wlh.setter
+    def wlh(self, wlh: np.ndarray) -> None:
+        self._wlh = wlh
+        self._corners = None
+
+    @property
+    def rotations(self) -> np.ndarray:
+        if self._rotations is None:
+            self._rotations = yaw_matrices(self._yaws)
+        return self._rotations
+
+    @rotations.setter
+    def rotations(self, rotations: np.ndarray) -> None:
+        self._rotations = rotations
+        self._yaws = None
+        self._corners = None
+
+    def corner_points(self) -> np.ndarray:
+        """
+        Returns the corners of all boxes as rows, see geometry_utils.corners_batch.
+        The result is cached and read-only.
+        :return: <np.float: n, 8, 3>.
+        """
+        if self._corners is None:
+            self._corners = corners_batch(self.centers, self.wlh, self.rotations)
+            self._corners.flags.writeable = False
+        return self._corners
+
+    def corners(self, wlh_factor: float = 1.0) -> np.ndarray:
+        """
+        Returns the corners of all boxes, each as Box.corners returns them.
+        :param wlh_factor: Multiply w, l, h by a factor to scale the boxes.
+        :return: <np.float: n, 3, 8>.
+        """
+        if wlh_factor != 1.0:
+            return corners_batch(self.centers, self.wlh, self.rotations, wlh_factor).transpose(0, 2, 1)
+        return self.corner_points().transpose(0, 2, 1)
+
+    def bottom_corners(self) -> np.ndarray:
+        """
+        :return: <np.float: n, 3, 4>. Bottom corners of all boxes, as Box.bottom_corners.
+        """
+        return self.corners()[:, :, [2, 3, 7, 6]]
+
+    def copy(self) -> 'BoxArray':
+        """
+        Create a copy of self.
+        :return: A copy.
+        """
+        if self.planar:
+            orientation = {'yaws': self._yaws.copy()}
+        else:
+            orientation = {'rotations': self._rotations.copy()}
+        return BoxArray(self.centers.copy(), self.wlh.copy(), velocities=self.velocities.copy(),
+                        labels=self.labels.copy(), scores=self.scores.copy(), ids=self.ids.copy(), **orientation)
+
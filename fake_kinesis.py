@@ -0,0 +1,259 @@
+import hashlib
+import itertools
+import threading
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+MAX_HASH_KEY = 2 ** 128 - 1
+
+
+def _client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class _Waiter:
+    def wait(self, **kwargs):
+        return None
+
+
+class _Shard:
+    def __init__(self, shard_id, start_hash, end_hash, starting_sequence,
+                 parent=None, adjacent_parent=None):
+        self.shard_id = shard_id
+        self.start_hash = start_hash
+        self.end_hash = end_hash
+        self.starting_sequence = starting_sequence
+        self.ending_sequence = None
+        self.parent = parent
+        self.adjacent_parent = adjacent_parent
+        self.records = []
+
+    @property
+    def is_open(self):
+        return self.ending_sequence is None
+
+    def describe(self):
+        shard = {
+            'ShardId': self.shard_id,
+            'HashKeyRange': {
+                'StartingHashKey': str(self.start_hash),
+                'EndingHashKey': str(self.end_hash),
+            },
+            'SequenceNumberRange': {'StartingSequenceNumber': self.starting_sequence},
+        }
+        if self.ending_sequence is not None:
+            shard['SequenceNumberRange']['EndingSequenceNumber'] = self.ending_sequence
+        if self.parent is not None:
+            shard['ParentShardId'] = self.parent
+        if self.adjacent_parent is not None:
+            shard['AdjacentParentShardId'] = self.adjacent_parent
+        return shard
+
+
+class _Stream:
+    def __init__(self, name, shard_count, region_name):
+        self.name = name
+        self.arn = f"arn:aws:kinesis:{region_name}:000000000000:stream/{name}"
+        self.shards = {}
+        self.shard_ids = itertools.count()
+        step = (MAX_HASH_KEY + 1) // shard_count
+        for i in range(shard_count):
+            end = MAX_HASH_KEY if i == shard_count - 1 else (i + 1) * step - 1
+            self.new_shard(i * step, end, '0')
+
+    def new_shard(self, start_hash, end_hash, starting_sequence, parent=None, adjacent_parent=None):
+        shard_id = f"shardId-{next(self.shard_ids):012d}"
+        self.shards[shard_id] = _Shard(shard_id, start_hash, end_hash, starting_sequence,
+                                       parent, adjacent_parent)
+        return self.shards[shard_id]
+
+    def shard_for_key(self, partition_key, explicit_hash_key=None):
+        if explicit_hash_key is not None:
+            hash_key = int(explicit_hash_key)
+        else:
+            hash_key = int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+        for shard in self.shards.values():
+            if shard.is_open and shard.start_hash <= hash_key <= shard.end_hash:
+                return shard
+        raise _client_error('InternalFailure', f"No open shard for hash key {hash_key}", 'PutRecord')
+
+
+class FakeKinesisClient:
+    """
+    In-process stand-in for a Boto3 Kinesis client.
+
+    Implements the subset of the Kinesis API used by KinesisStream (describe,
+    list, iterators, get/put records) plus resharding, so consumers and
+    producers can be exercised without AWS credentials or network access.
+    """
+
+    def __init__(self, region_name='eu-west-2', max_records_per_call=10000):
+        self.region_name = region_name
+        self.max_records_per_call = max_records_per_call
+        self.streams = {}
+        self.calls = {}
+        self._iterators = {}
+        self._iterator_ids = itertools.count()
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def _stream(self, name, operation):
+        if name not in self.streams:
+            raise _client_error('ResourceNotFoundException', f"Stream {name} not found.", operation)
+        return self.streams[name]
+
+    def _next_sequence(self):
+        return f"{next(self._sequence):056d}"
+
+    def get_waiter(self, name):
+        return _Waiter()
+
+    def create_stream(self, StreamName, ShardCount=1, **kwargs):
+        with self._lock:
+            self._count('CreateStream')
+            if StreamName in self.streams:
+                raise _client_error('ResourceInUseException', f"Stream {StreamName} exists.", 'CreateStream')
+            self.streams[StreamName] = _Stream(StreamName, ShardCount, self.region_name)
+        return {}
+
+    def delete_stream(self, StreamName, **kwargs):
+        with self._lock:
+            self._count('DeleteStream')
+            self._stream(StreamName, 'DeleteStream')
+            del self.streams[StreamName]
+        return {}
+
+    def describe_stream(self, StreamName, **kwargs):
+        with self._lock:
+            self._count('DescribeStream')
+            stream = self._stream(StreamName, 'DescribeStream')
+            return {
+                'StreamDescription': {
+                    'StreamName': stream.name,
+                    'StreamARN': stream.arn,
+                    'StreamStatus': 'ACTIVE',
+                    'Shards': [shard.describe() for shard in stream.shards.values()],
+                    'HasMoreShards': False,
+                }
+            }
+
+    def list_shards(self, StreamName=None, NextToken=None, **kwargs):
+        with self._lock:
+            self._count('ListShards')
+            stream = self._stream(StreamName, 'ListShards')
+            return {'Shards': [shard.describe() for shard in stream.shards.values()]}
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType,
+                           StartingSequenceNumber=None, Timestamp=None, **kwargs):
+        with self._lock:
+            self._count('GetShardIterator')
+            stream = self._stream(StreamName, 'GetShardIterator')
+            if ShardId not in stream.shards:
+                raise _client_error('ResourceNotFoundException', f"Shard {ShardId} not found.",
+                                    'GetShardIterator')
+            shard = stream.shards[ShardId]
+            if ShardIteratorType == 'TRIM_HORIZON':
+                position = 0
+            elif ShardIteratorType == 'LATEST':
+                position = len(shard.records)
+            elif ShardIteratorType in ('AT_SEQUENCE_NUMBER', 'AFTER_SEQUENCE_NUMBER'):
+                target = int(StartingSequenceNumber)
+                position = len(shard.records)
+                for i, record in enumerate(shard.records):
+                    sequence = int(record['SequenceNumber'])
+                    if sequence > target or (sequence == target and ShardIteratorType == 'AT_SEQUENCE_NUMBER'):
+                        position = i
+                        break
+            elif ShardIteratorType == 'AT_TIMESTAMP':
+                position = len(shard.records)
+                for i, record in enumerate(shard.records):
+                    if record['ApproximateArrivalTimestamp'] >= Timestamp:
+                        position = i
+                        break
+            else:
+                raise _client_error('InvalidArgumentException',
+                                    f"Unknown iterator type {ShardIteratorType}.", 'GetShardIterator')
+            return {'ShardIterator': self._new_iterator(StreamName, ShardId, position)}
+
+    def _new_iterator(self, stream_name, shard_id, position):
+        iterator = f"fake-iterator-{next(self._iterator_ids)}"
+        self._iterators[iterator] = (stream_name, shard_id, position)
+        return iterator
+
+    def get_records(self, ShardIterator, Limit=10000, **kwargs):
+        with self._lock:
+            self._count('GetRecords')
+            if ShardIterator not in self._iterators:
+                raise _client_error('ExpiredIteratorException', "Iterator expired.", 'GetRecords')
+            stream_name, shard_id, position = self._iterators.pop(ShardIterator)
+            shard = self._stream(stream_name, 'GetRecords').shards[shard_id]
+            limit = min(Limit, self.max_records_per_call)
+            records = [dict(record) for record in shard.records[position:position + limit]]
+            position += len(records)
+            response = {
+                'Records': records,
+                'MillisBehindLatest': 0 if position == len(shard.records) else 1,
+            }
+            if shard.is_open or position < len(shard.records):
+                response['NextShardIterator'] = self._new_iterator(stream_name, shard_id, position)
+            else:
+                response['NextShardIterator'] = None
+            return response
+
+    def _append(self, stream, data, partition_key, explicit_hash_key=None):
+        shard = stream.shard_for_key(partition_key, explicit_hash_key)
+        record = {
+            'SequenceNumber': self._next_sequence(),
+            'ApproximateArrivalTimestamp': datetime.now(timezone.utc),
+            'Data': bytes(data),
+            'PartitionKey': partition_key,
+        }
+        shard.records.append(record)
+        return shard.shard_id, record['SequenceNumber']
+
+    def put_record(self, StreamName, Data, PartitionKey, ExplicitHashKey=None, **kwargs):
+        with self._lock:
+            self._count('PutRecord')
+            stream = self._stream(StreamName, 'PutRecord')
+            shard_id, sequence = self._append(stream, Data, PartitionKey, ExplicitHashKey)
+            return {'ShardId': shard_id, 'SequenceNumber': sequence}
+
+    def put_records(self, StreamName, Records, **kwargs):
+        with self._lock:
+            self._count('PutRecords')
+            stream = self._stream(StreamName, 'PutRecords')
+            results = []
+            for entry in Records:
+                shard_id, sequence = self._append(stream, entry['Data'], entry['PartitionKey'],
+                                                  entry.get('ExplicitHashKey'))
+                results.append({'ShardId': shard_id, 'SequenceNumber': sequence})
+            return {'FailedRecordCount': 0, 'Records': results}
+
+    def split_shard(self, StreamName, ShardToSplit, NewStartingHashKey, **kwargs):
+        with self._lock:
+            self._count('SplitShard')
+            stream = self._stream(StreamName, 'SplitShard')
+            parent = stream.shards[ShardToSplit]
+            split_at = int(NewStartingHashKey)
+            parent.ending_sequence = self._next_sequence()
+            start = self._next_sequence()
+            stream.new_shard(parent.start_hash, split_at - 1, start, parent=parent.shard_id)
+            stream.new_shard(split_at, parent.end_hash, start, parent=parent.shard_id)
+        return {}
+
+    def merge_shards(self, StreamName, ShardToMerge, AdjacentShardToMerge, **kwargs):
+        with self._lock:
+            self._count('MergeShards')
+            stream = self._stream(StreamName, 'MergeShards')
+            first = stream.shards[ShardToMerge]
+            second = stream.shards[AdjacentShardToMerge]
+            ending = self._next_sequence()
+            first.ending_sequence = ending
+            second.ending_sequence = ending
+            stream.new_shard(min(first.start_hash, second.start_hash), max(first.end_hash, second.end_hash),
+                             self._next_sequence(), parent=first.shard_id, adjacent_parent=second.shard_id)
+        return {}
@@ -1,88 +1,219 @@
+import os
 import signal
-
+import logging
+import functools
+import argparse
+
+from calibration import MUSEUM_CALIBRATION
+from checkpoint import CheckpointStore
+from ingest import StreamIngestor
+from parse_pool import ParsePool
 from kinesis_stream import KinesisStream
+from replay import ReplayClock, ReplayStream, StreamRecorder, recording_path
+from sinks import open_sink
 from sync import *
 from utils import *
 
-kinesis_stream1 = KinesisStream('museum-outsight-1', create_if_not_found=False)
-kinesis_stream2 = KinesisStream('museum-outsight-2', create_if_not_found=False)
-
-
-records_gen1 = kinesis_stream1.get_records_iter(shard_iter_type="LATEST") #TRIM_HORIZON
-records_gen2 = kinesis_stream2.get_records_iter(shard_iter_type="LATEST")
-
-caches = [Cache() for _ in range(2)]
-# generators = [continuous_generator() for _ in range(3)]
-generators = [records_gen1, records_gen2]
-
-synchronization_manager = SynchronizationManager(caches[0], caches)
-
-
-def process_generators(caches, generators):
-    def base_worker(cache, generator):
-        for entry in generator:
-            entry = record_to_frame(entry)
-            if entry is None:
-                continue
-            cache.add(entry)
-            synchronization_manager.new_data_available()
-            
-    def worker(cache, generator):
-        for entry in generator:
-            entry = record_to_frame(entry)
-            if entry is None:
-                continue
-            cache.add(entry)
-
-    threads = []
-
-    thread = threading.Thread(target=base_worker, args=(caches[0], generators[0]))
-    threads.append(thread)
-    thread.start()
-    
-    for cache, generator in zip(caches[1:], generators[1:]):
-        thread = threading.Thread(target=worker, args=(cache, generator))
-        threads.append(thread)
-        thread.start()
-
-    return threads
-
-
-
-
-async def fusion():
-    try:
-        # Run the synchronization process
-        await synchronization_manager.start_synchronization()
-    except asyncio.CancelledError:
-        print("Synchronization cancelled")
-    
-    synchronization_manager.stop()
-    await asyncio.sleep(1)  # Ensure sync_manager stops properly
-
-    print(f"Total synchronized entries: {len(synchronization_manager.synced_data)}")
-
+STREAM_NAMES = ['museum-outsight-1', 'museum-outsight-2']  # Base stream first; see --sync-config for other sites
+
+RECORDS_PER_POLL = 100  # Per shard and GetRecords call
+POLL_INTERVAL = 0.2  # Seconds between polls of a shard (Kinesis allows 5 reads/s per shard)
+INGEST_QUEUE_SIZE = 64  # Frames buffered between each stream and its cache
+INGEST_OVERFLOW = 'drop_oldest'  # 'block', 'drop_oldest' or 'drop_newest'
+MAX_CACHE_ENTRIES = 200  # Ingestion pauses while a cache holds this many frames (10 s at 20 Hz)
+CACHE_MAX_AGE_S = 30.0  # Frames older than this (relative to the newest one) are evicted
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # Approximate memory limit per cache
+CACHE_POLICY = 'drop_oldest'  # 'drop_oldest' or 'reject_newest' when a cache is full
+REORDER_WINDOW_S = 0.1  # Frames up to this much out of order (e.g. across shards) are put back in order
+PARSE_WORKERS = 0  # Processes decoding records; 0 decodes on the event loop thread (faster unless cores are spare)
+
+CHECKPOINT_PATH = 'checkpoints.json'  # Last synced sequence number per stream and shard
+CHECKPOINT_INTERVAL_MS = 1000  # Checkpoints are written to disk at most this often
+
+SYNC_MAX_DELAY_S = 0.5  # Longest a base frame waits for the other sensors once it leaves the reorder buffer
+SYNC_TOLERANCE_S = 0.2  # Partner frames further than this from the base frame count as missing
+SYNC_INTERPOLATION = 'nearest'  # 'linear' moves partner objects to the base timestamp, 'nearest' does not
+SYNC_MAX_EXTRAPOLATION_S = 0.1  # Partners are extrapolated at most this far past their newest frame
+SYNC_CORRECT_CLOCK_OFFSETS = False  # Correct sensor clock offsets estimated from the Kinesis arrival times
+CLOCK_OFFSET_WINDOW_S = 10.0  # Sensor time over which each delay floor of the estimator is taken
+CALIBRATION_FILE = MUSEUM_CALIBRATION  # Sensor extrinsics of the site, see calibration.py
+
+SYNC_OUTPUT = 'synced_data.jsonl'  # .jsonl (JSON Lines) or .bin (compact binary)
+SINK_ROTATE_BYTES = 256 * 1024 * 1024  # Synced output is split into segments of at most this size
+SINK_FLUSH_INTERVAL_S = 1.0  # Synced entries reach the disk at most this late
+
+DRAIN_TIMEOUT = 1.0  # Seconds the sync stage may keep working once the sources have ended
+
+
+def default_sync_config():
+    return SyncConfig(STREAM_NAMES, max_delay_s=SYNC_MAX_DELAY_S, tolerance_s=SYNC_TOLERANCE_S,
+                      interpolation=SYNC_INTERPOLATION, max_extrapolation_s=SYNC_MAX_EXTRAPOLATION_S,
+                      correct_clock_offsets=SYNC_CORRECT_CLOCK_OFFSETS, clock_offset_window_s=CLOCK_OFFSET_WINDOW_S,
+                      calibration_file=CALIBRATION_FILE)
+
+
+class FusionPipeline:
+    """
+    Wires the record sources of one sensor group to their caches, ingestors and
+    the synchronization manager.
+
+    Sources are live Kinesis streams by default. With `replay_dir` they are
+    recordings made with `record_dir`, replayed at `replay_speed`.
+    """
+
+    def __init__(self, sync_config, record_dir=None, replay_dir=None, replay_speed=1.0, output=SYNC_OUTPUT,
+                 checkpoint_path=CHECKPOINT_PATH, verbose=True):
+        """
+        :param sync_config: SyncConfig of the sensor group.
+        :param output: File the synced entries are streamed to, see sinks.open_sink.
+        :param checkpoint_path: Checkpoint file of the Kinesis streams; one per site.
+        :param verbose: Print every synced entry and the final totals.
+        """
+        self.verbose = verbose
+        self.sync_config = sync_config
+        stream_names = sync_config.names
+        self.stream_names = stream_names
+        self.cache_keys = sync_config.keys
+        self.recorders = []
+        self.checkpoint_store = None
+
+        if replay_dir is not None:
+            paths = [recording_path(replay_dir, name) for name in stream_names]
+            # One time origin for all streams, so their recorded relative timing is kept.
+            clock = ReplayClock.from_recordings(paths, replay_speed) if replay_speed else None
+            generators = [
+                ReplayStream(path, name).get_records_iter(speed=replay_speed, clock=clock)
+                for path, name in zip(paths, stream_names)
+            ]
+        else:
+            self.checkpoint_store = CheckpointStore(checkpoint_path, flush_interval_ms=CHECKPOINT_INTERVAL_MS)
+            generators = [
+                KinesisStream(name, create_if_not_found=False).get_records_iter(
+                    shard_iter_type="LATEST", limit=RECORDS_PER_POLL, poll_interval=POLL_INTERVAL,
+                    checkpoint_store=self.checkpoint_store)  # TRIM_HORIZON
+                for name in stream_names
+            ]
+
+        if record_dir is not None:
+            os.makedirs(record_dir, exist_ok=True)
+            self.recorders = [StreamRecorder(recording_path(record_dir, name)) for name in stream_names]
+            generators = [recorder.record(generator) for recorder, generator in zip(self.recorders, generators)]
+
+        self.parse_pool = ParsePool(PARSE_WORKERS) if PARSE_WORKERS > 0 else None
+        self.caches = [Cache(max_age_s=CACHE_MAX_AGE_S, max_bytes=CACHE_MAX_BYTES, policy=CACHE_POLICY,
+                             reorder_window_s=REORDER_WINDOW_S)
+                       for _ in stream_names]
+        self.sink = open_sink(output, rotate_bytes=SINK_ROTATE_BYTES, flush_interval_s=SINK_FLUSH_INTERVAL_S,
+                              on_flushed=self.checkpoint_synced_entries)
+        self.synchronization_manager = SynchronizationManager.from_config(sync_config, self.caches,
+                                                                          sink=self.sink, verbose=verbose)
+        self.ingestors = [
+            StreamIngestor(generator, cache, max_queue=INGEST_QUEUE_SIZE, overflow=INGEST_OVERFLOW,
+                           max_cache_entries=MAX_CACHE_ENTRIES, name=name, parse_pool=self.parse_pool,
+                           on_frame=functools.partial(self.synchronization_manager.observe_frame, i))
+            for i, (name, generator, cache) in enumerate(zip(stream_names, generators, self.caches))
+        ]
+
+    def checkpoint_synced_entries(self, synced_entries):
+        # Called by the sink's writer thread: only frames of synced entries that have
+        # been flushed to the output advance the checkpoints.
+        if self.checkpoint_store is None:
+            return
+        for synced_entry in synced_entries:
+            for cache_key, frame in synced_entry.items():
+                if cache_key in self.cache_keys and frame and frame.get('sequence_number') is not None:
+                    stream_name = self.stream_names[self.cache_keys.index(cache_key)]
+                    self.checkpoint_store.update(stream_name, frame['shard_id'], frame['sequence_number'],
+                                                 frame.get('sub_sequence_number'))
+
+    def stop(self):
+        for ingestor in self.ingestors:
+            ingestor.stop()
+
+    def health(self):
+        """
+        :return: Snapshot of the synchronization metrics and, per stream, the ingestion
+            counters and cache size.
+        """
+        health = self.synchronization_manager.metrics()
+        health['streams'] = {
+            name: {
+                'frames': ingestor.stats['frames'],
+                'dropped': ingestor.stats['dropped_oldest'] + ingestor.stats['dropped_newest'],
+                'cached': len(cache),
+                'late': cache.stats['late'],
+            }
+            for name, ingestor, cache in zip(self.stream_names, self.ingestors, self.caches)
+        }
+        return health
+
+    async def run(self):
+        ingest_tasks = [asyncio.create_task(ingestor.run()) for ingestor in self.ingestors]
+        sync_task = asyncio.create_task(self.synchronization_manager.start_synchronization())
+
+        # Live streams run until stop() is called; recordings end on their own.
+        await asyncio.gather(*ingest_tasks, return_exceptions=True)
+        for cache in self.caches:
+            cache.flush_reorder()
+        await asyncio.sleep(DRAIN_TIMEOUT)
+        self.synchronization_manager.stop()
+        try:
+            await sync_task
+        except asyncio.CancelledError:
+            print("Synchronization cancelled")
+
+        # Closing waits for the sink's writer thread; keep the loop free for other pipelines.
+        await asyncio.get_running_loop().run_in_executor(None, self.sink.close)
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        for recorder in self.recorders:
+            recorder.close()
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.flush()
+
+        if not self.verbose:
+            return
+        print(f"Total synchronized entries: {self.synchronization_manager.stats['synced']}")
+        print(f"Synced output: {self.sink.paths} {self.sink.stats}")
+        print(f"Synchronization: {self.synchronization_manager.metrics()}")
+        for name, cache in zip(self.stream_names, self.caches):
+            print(f"Cache of {name}: {cache.metrics()}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Synchronize the Outsight streams of a site.")
+    parser.add_argument('--record', metavar='DIR', help="Also write the raw records of every stream to DIR.")
+    parser.add_argument('--replay', metavar='DIR', help="Read the streams from recordings in DIR instead of Kinesis.")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Replay speed relative to real time; 0 replays as fast as possible.")
+    parser.add_argument('--output', default=SYNC_OUTPUT,
+                        help="Synced entries file: .jsonl for JSON Lines, .bin for the compact binary format.")
+    parser.add_argument('--sync-config', metavar='FILE',
+                        help="JSON SyncConfig (streams, base or clock_hz, tolerances, calibrations) "
+                             "instead of the museum streams.")
+    return parser.parse_args()
 
 
 def main():
-    threads = process_generators(caches, generators)
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    sync_config = SyncConfig.from_json(args.sync_config) if args.sync_config else default_sync_config()
+    pipeline = FusionPipeline(sync_config, record_dir=args.record, replay_dir=args.replay,
+                              replay_speed=args.speed, output=args.output)
 
     loop = asyncio.get_event_loop()
 
     # Function to handle keyboard interrupt and stop synchronization
     def handle_interrupt(signal, frame):
         print("KeyboardInterrupt (ID: {}) has been caught. Cleaning up...")
-        synchronization_manager.stop()
-        for thread in threads:
-            thread.join()
-        loop.call_soon_threadsafe(loop.stop)
+        loop.call_soon_threadsafe(pipeline.stop)
 
 
     # Register the signal handler
     signal.signal(signal.SIGINT, handle_interrupt)
 
     try:
-        loop.run_until_complete(fusion())
+        loop.run_until_complete(pipeline.run())
     except KeyboardInterrupt:
         print("Keyboard Interrupt. Stopping synchronization.")
     finally:
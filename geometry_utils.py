@@ -1,10 +1,11 @@
 # Ref: https://github.com/nutonomy/nuscenes-devkit/blob/master/python-sdk/nuscenes/utils/geometry_utils.py
 
 from enum import IntEnum
-from typing import Tuple
+from typing import List, Tuple
 
 import numpy as np
 from pyquaternion import Quaternion
+from scipy.spatial import cKDTree
 
 
 class BoxVisibility(IntEnum):
@@ -107,6 +108,88 @@ def transform_matrix(translation: np.ndarray = np.array([0, 0, 0]),
     return tm
 
 
+def quaternions_to_matrices(quaternions: np.ndarray) -> np.ndarray:
+    """
+    :param quaternions: <np.float: n, 4>. Unit quaternions as (w, x, y, z).
+    :return: <np.float: n, 3, 3>. Rotation matrices.
+    """
+    w, x, y, z = np.asarray(quaternions, dtype=float).T
+    matrices = np.empty((len(w), 3, 3))
+    matrices[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    matrices[:, 0, 1] = 2 * (x * y - z * w)
+    matrices[:, 0, 2] = 2 * (x * z + y * w)
+    matrices[:, 1, 0] = 2 * (x * y + z * w)
+    matrices[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    matrices[:, 1, 2] = 2 * (y * z - x * w)
+    matrices[:, 2, 0] = 2 * (x * z - y * w)
+    matrices[:, 2, 1] = 2 * (y * z + x * w)
+    matrices[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return matrices
+
+
+def matrices_to_quaternions(matrices: np.ndarray) -> np.ndarray:
+    """
+    :param matrices: <np.float: n, 3, 3>. Rotation matrices.
+    :return: <np.float: n, 4>. Unit quaternions as (w, x, y, z), with w >= 0.
+    """
+    m = np.asarray(matrices, dtype=float)
+    m00, m01, m02 = m[:, 0, 0], m[:, 0, 1], m[:, 0, 2]
+    m10, m11, m12 = m[:, 1, 0], m[:, 1, 1], m[:, 1, 2]
+    m20, m21, m22 = m[:, 2, 0], m[:, 2, 1], m[:, 2, 2]
+    # Shepperd's method: derive the quaternion from its largest component for stability.
+    candidates = np.stack([
+        [1 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01],
+        [m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20],
+        [m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21],
+        [m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22],
+    ]).transpose(2, 0, 1)  # <n, case, component>
+    largest = np.argmax(np.stack([1 + m00 + m11 + m22, 1 + m00 - m11 - m22,
+                                  1 - m00 + m11 - m22, 1 - m00 - m11 + m22], axis=1), axis=1)
+    quaternions = candidates[np.arange(len(m)), largest]
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    quaternions[quaternions[:, 0] < 0] *= -1
+    return quaternions
+
+
+def yaw_matrices(yaws: np.ndarray) -> np.ndarray:
+    """
+    :param yaws: <np.float: n>. Rotations about the z axis in radians.
+    :return: <np.float: n, 3, 3>. Rotation matrices.
+    """
+    cos, sin = np.cos(yaws), np.sin(yaws)
+    matrices = np.zeros((len(cos), 3, 3))
+    matrices[:, 0, 0] = cos
+    matrices[:, 0, 1] = -sin
+    matrices[:, 1, 0] = sin
+    matrices[:, 1, 1] = cos
+    matrices[:, 2, 2] = 1
+    return matrices
+
+
+# Corner directions of a box in its own frame, in the order of Box.corners: x follows
+# the length, y the width, z the height. The first four corners face forward.
+CORNER_SIGNS = np.array([[1, 1, 1], [1, -1, 1], [1, -1, -1], [1, 1, -1],
+                         [-1, 1, 1], [-1, -1, 1], [-1, -1, -1], [-1, 1, -1]], dtype=float)
+
+
+def corners_batch(centers: np.ndarray, wlh: np.ndarray, rotations: np.ndarray, wlh_factor: float = 1.0) -> np.ndarray:
+    """
+    Returns the corners of many boxes with a single matrix product.
+    :param centers: <np.float: n, 3>. Box centers.
+    :param wlh: <np.float: n, 3>. Box sizes as width, length, height.
+    :param rotations: <np.float: n, 3, 3>. Box rotation matrices.
+    :param wlh_factor: Multiply w, l, h by a factor to scale the boxes.
+    :return: <np.float: n, 8, 3>. Corners of every box, in the order of Box.corners.
+    """
+    centers = np.asarray(centers, dtype=float)
+    n = len(centers)
+    # Box axes scaled by the half sizes; a corner is the center plus a signed sum of them.
+    half_sizes = np.asarray(wlh, dtype=float)[:, [1, 0, 2]] * (wlh_factor / 2)
+    axes = np.asarray(rotations, dtype=float) * half_sizes[:, np.newaxis, :]
+    offsets = (CORNER_SIGNS @ axes.transpose(2, 0, 1).reshape(3, -1)).reshape(8, n, 3)
+    return offsets.transpose(1, 0, 2) + centers[:, np.newaxis, :]
+
+
 def points_in_box(box: 'Box', points: np.ndarray, wlh_factor: float = 1.0):
     """
     Checks whether points are inside the box.
@@ -141,4 +224,100 @@ def points_in_box(box: 'Box', points: np.ndarray, wlh_factor: float = 1.0):
     mask_z = np.logical_and(0 <= kv, kv <= np.dot(k, k))
     mask = np.logical_and(np.logical_and(mask_x, mask_y), mask_z)
 
-    return mask
\ No newline at end of file
+    return mask
+
+
+class PointCloudIndex:
+    """
+    KD-tree over a point cloud for box queries. Building it is the expensive part,
+    so build it once per static cloud (e.g. a site scan) and reuse it for the boxes
+    of every frame.
+    """
+
+    def __init__(self, points: np.ndarray, leafsize: int = 32):
+        """
+        :param points: <np.float: 3, n>. The cloud, one point per column as in points_in_box.
+            Points with NaN coordinates are never inside a box.
+        :param leafsize: Leaf size of the KD-tree.
+        """
+        self.points = np.ascontiguousarray(np.asarray(points, dtype=float)[:3].T)
+        # Scans mark missing returns with NaN; they are left out of the tree.
+        self.valid = np.flatnonzero(np.all(np.isfinite(self.points), axis=1))
+        self.tree = cKDTree(self.points[self.valid], leafsize=leafsize)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def candidates(self, centers: np.ndarray, radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param centers: <np.float: m, 3>. Query centers.
+        :param radii: <np.float: m>. Query radii.
+        :return: (<np.int: k>, <np.int: k>). Box index and point index of every point
+            within its box's radius.
+        """
+        if len(centers) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        neighbours = self.tree.query_ball_point(centers, radii, return_sorted=True)
+        counts = np.array([len(indices) for indices in neighbours], dtype=np.intp)
+        if not counts.sum():
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        return np.repeat(np.arange(len(centers)), counts), self.valid[np.concatenate(neighbours).astype(np.intp)]
+
+
+def _box_arrays(boxes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Centers, sizes and rotation matrices of a BoxArray or a list of Box.
+    if hasattr(boxes, 'rotations'):
+        return boxes.centers, boxes.wlh, boxes.rotations
+    if not boxes:
+        return np.zeros((0, 3)), np.zeros((0, 3)), np.zeros((0, 3, 3))
+    return (np.array([box.center for box in boxes], dtype=float), np.array([box.wlh for box in boxes], dtype=float),
+            np.array([box.rotation_matrix for box in boxes]))
+
+
+def _points_in_boxes_pairs(boxes, points, wlh_factor: float) -> Tuple[np.ndarray, np.ndarray]:
+    # Box index and point index of every point inside a box, ordered by box then point.
+    index = points if isinstance(points, PointCloudIndex) else PointCloudIndex(points)
+    centers, wlh, rotations = _box_arrays(boxes)
+    half_sizes = np.asarray(wlh, dtype=float)[:, [1, 0, 2]] * (wlh_factor / 2)  # Along the box's x, y, z
+    # Only points within the half diagonal of a box can be inside it.
+    box_ids, point_ids = index.candidates(centers, np.linalg.norm(half_sizes, axis=1))
+    if not len(box_ids):
+        return box_ids, point_ids
+    # Candidate points in the frame of their box.
+    offsets = index.points[point_ids] - centers[box_ids]
+    local = np.einsum('ni,nij->nj', offsets, rotations[box_ids])
+    inside = np.all(np.abs(local) <= half_sizes[box_ids], axis=1)
+    return box_ids[inside], point_ids[inside]
+
+
+def points_in_boxes(boxes, points, wlh_factor: float = 1.0) -> List[np.ndarray]:
+    """
+    Finds the points inside each of many boxes. Candidate points are taken from a
+    KD-tree around each box and only those are tested, in one batch.
+    :param boxes: <BoxArray> or list of <Box>.
+    :param points: <np.float: 3, n>, or a PointCloudIndex over them to reuse across frames.
+    :param wlh_factor: Inflates or deflates the boxes.
+    :return: Per box, <np.int: k>, the sorted indices of the points inside it.
+    """
+    box_ids, point_ids = _points_in_boxes_pairs(boxes, points, wlh_factor)
+    n_boxes = len(_box_arrays(boxes)[0])
+    if not n_boxes:
+        return []
+    return np.split(point_ids, np.searchsorted(box_ids, np.arange(1, n_boxes)))
+
+
+def points_box_labels(boxes, points, wlh_factor: float = 1.0) -> np.ndarray:
+    """
+    Labels every point with the box it is in, see points_in_boxes.
+    :param boxes: <BoxArray> or list of <Box>.
+    :param points: <np.float: 3, n>, or a PointCloudIndex over them.
+    :param wlh_factor: Inflates or deflates the boxes.
+    :return: <np.int: n>. Index of the box containing each point (the lowest one if
+        boxes overlap), -1 for points outside every box.
+    """
+    n_points = len(points) if isinstance(points, PointCloudIndex) else np.asarray(points).shape[1]
+    box_ids, point_ids = _points_in_boxes_pairs(boxes, points, wlh_factor)
+    labels = np.full(n_points, -1, dtype=np.intp)
+    # Assigned from the highest box down, so the lowest box index wins.
+    labels[point_ids[::-1]] = box_ids[::-1]
+    return labels
@@ -0,0 +1,315 @@
+"""
+Runs the fusion pipelines of many sites in a pool of worker processes.
+
+The site list is a JSON file:
+
+    {"sites": [
+        {"name": "museum",
+         "sync": {"streams": ["museum-outsight-1", "museum-outsight-2"], "max_delay_s": 0.5},
+         "output": "out/museum.jsonl"},
+        ...
+    ]}
+
+"sync" holds the arguments of sync.SyncConfig. The other keys are optional:
+output, checkpoint_path, record_dir, replay_dir and replay_speed (see
+fusion.FusionPipeline); output and checkpoint_path default to files named after
+the site. calibration_file is the site's calibration registry (see
+calibration.py), used unless "sync" names one; it defaults to
+config/<name>_calibration.json when that file exists.
+
+Usage: python host.py SITES.json [--workers N] [--report-interval S]
+"""
+import os
+import json
+import time
+import queue
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from typing import Dict, List
+
+from calibration import CONFIG_DIR
+from fusion import FusionPipeline
+from sync import SyncConfig
+
+logger = logging.getLogger(__name__)
+
+HEALTH_INTERVAL_S = 1.0  # How often the workers publish the health of their sites
+STOP_TIMEOUT_S = 10.0  # Longest a site may take to drain and close once stopped
+
+
+class SiteConfig:
+    """
+    One site of the host: a sensor group and where its pipeline reads and writes.
+    """
+
+    def __init__(self, name: str, sync: Dict, output: str = None, checkpoint_path: str = None,
+                 record_dir: str = None, replay_dir: str = None, replay_speed: float = 1.0,
+                 calibration_file: str = None):
+        """
+        :param name: Unique site name.
+        :param sync: Arguments of sync.SyncConfig.
+        :param output: Synced entries file; defaults to <name>.jsonl.
+        :param checkpoint_path: Kinesis checkpoints; defaults to <name>.checkpoints.json.
+        :param calibration_file: Calibration registry of the site; defaults to
+            config/<name>_calibration.json if it exists. A calibration_file in `sync` wins.
+        """
+        self.name = name
+        if calibration_file is None:
+            default_file = os.path.join(CONFIG_DIR, f"{name}_calibration.json")
+            calibration_file = default_file if os.path.exists(default_file) else None
+        self.calibration_file = calibration_file
+        self.sync = dict(sync)
+        if calibration_file is not None:
+            self.sync.setdefault('calibration_file', calibration_file)
+        self.output = output or f"{name}.jsonl"
+        self.checkpoint_path = checkpoint_path or f"{name}.checkpoints.json"
+        self.record_dir = record_dir
+        self.replay_dir = replay_dir
+        self.replay_speed = replay_speed
+
+    @classmethod
+    def from_dict(cls, config: Dict) -> 'SiteConfig':
+        return cls(**config)
+
+
+def load_sites(filename: str) -> List[SiteConfig]:
+    with open(filename, 'r') as f:
+        sites = [SiteConfig.from_dict(site) for site in json.load(f)['sites']]
+    names = [site.name for site in sites]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Site names in {filename} are not unique")
+    return sites
+
+
+class _SiteRunner:
+    """
+    A site pipeline inside a worker process, with its health bookkeeping.
+    """
+
+    def __init__(self, site: SiteConfig):
+        self.site = site
+        self.pipeline = FusionPipeline(SyncConfig.from_dict(site.sync), record_dir=site.record_dir,
+                                       replay_dir=site.replay_dir, replay_speed=site.replay_speed,
+                                       output=site.output, checkpoint_path=site.checkpoint_path, verbose=False)
+        self.task = asyncio.ensure_future(self.pipeline.run())
+        self.state = 'running'
+        self.error = None
+        self.started = time.time()
+        self._last_synced = 0
+        self._last_report = time.monotonic()
+
+    def stop(self) -> None:
+        if self.state == 'running':
+            self.state = 'stopping'
+            self.pipeline.stop()
+
+    async def wait_stopped(self) -> None:
+        """
+        Waits up to STOP_TIMEOUT_S for the pipeline to drain, then cancels it.
+        """
+        await asyncio.wait([self.task], timeout=STOP_TIMEOUT_S)
+        if not self.task.done():
+            logger.warning("Site %s did not stop within %s s, cancelling it.", self.site.name, STOP_TIMEOUT_S)
+            self.task.cancel()
+            await asyncio.wait([self.task])
+
+    def health(self, worker: int) -> Dict:
+        if self.task.done() and self.state in ('running', 'stopping'):
+            error = None if self.task.cancelled() else self.task.exception()
+            self.state = 'failed' if error else 'stopped'
+            self.error = repr(error) if error else None
+        health = self.pipeline.health()
+        now = time.monotonic()
+        health['synced_per_s'] = (health['synced'] - self._last_synced) / max(now - self._last_report, 1e-9)
+        self._last_synced, self._last_report = health['synced'], now
+        health.update(state=self.state, error=self.error, worker=worker, pid=os.getpid(),
+                      started=self.started, updated=time.time())
+        return health
+
+
+async def _serve(worker: int, commands, health) -> None:
+    loop = asyncio.get_running_loop()
+    runners = {}
+
+    async def report():
+        while True:
+            for name, runner in list(runners.items()):
+                health[name] = runner.health(worker)
+            await asyncio.sleep(HEALTH_INTERVAL_S)
+
+    reporter = asyncio.ensure_future(report())
+    while True:
+        command, argument = await loop.run_in_executor(None, commands.get)
+        if command == 'start':
+            site = argument
+            if site.name in runners and not runners[site.name].task.done():
+                logger.warning("Site %s is already running.", site.name)
+                continue
+            try:
+                runners[site.name] = _SiteRunner(site)
+                logger.info("Worker %s started site %s.", worker, site.name)
+            except Exception as err:
+                logger.exception("Site %s failed to start.", site.name)
+                health[site.name] = {'state': 'failed', 'error': repr(err), 'worker': worker, 'updated': time.time()}
+        elif command == 'stop':
+            runner = runners.get(argument)
+            if runner is not None:
+                runner.stop()
+                await runner.wait_stopped()
+                health[argument] = runner.health(worker)
+                del runners[argument]
+                logger.info("Worker %s stopped site %s.", worker, argument)
+        elif command == 'shutdown':
+            for runner in runners.values():
+                runner.stop()
+            await asyncio.gather(*(runner.wait_stopped() for runner in runners.values()))
+            for name, runner in runners.items():
+                health[name] = runner.health(worker)
+            break
+    reporter.cancel()
+
+
+def _worker_main(worker: int, commands, health) -> None:
+    # The host handles Ctrl-C and shuts the workers down in order.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s worker{worker} %(name)s %(message)s")
+    asyncio.run(_serve(worker, commands, health))
+
+
+class FusionHost:
+    """
+    Spreads site pipelines over `workers` processes, each running its sites on
+    its own event loop. Sites can be started and stopped one at a time; their
+    health and throughput are collected in one shared dict.
+    """
+
+    def __init__(self, sites: List[SiteConfig], workers: int = None):
+        """
+        :param sites: Sites started by start().
+        :param workers: Number of worker processes; defaults to the number of CPUs,
+            and never exceeds the number of sites.
+        """
+        self.sites = {site.name: site for site in sites}
+        self.workers = max(1, min(workers or os.cpu_count(), len(sites) or 1))
+        self.context = multiprocessing.get_context('spawn')
+        self.manager = None
+        self.health = None
+        self.processes = []
+        self.queues = []
+        self.assignments = {}  # Site name -> worker index
+
+    def start(self) -> None:
+        """
+        Starts the worker processes and every site.
+        """
+        self.manager = self.context.Manager()
+        self.health = self.manager.dict()
+        for worker in range(self.workers):
+            commands = self.context.Queue()
+            process = self.context.Process(target=_worker_main, args=(worker, commands, self.health),
+                                           name=f"fusion-worker-{worker}", daemon=True)
+            process.start()
+            self.queues.append(commands)
+            self.processes.append(process)
+        for name in self.sites:
+            self.start_site(name)
+
+    def start_site(self, name: str, site: SiteConfig = None) -> None:
+        """
+        Starts a site on the least loaded worker.
+
+        :param site: Configuration of a site not given to the constructor.
+        """
+        if site is not None:
+            self.sites[name] = site
+        self._release_stopped()
+        if name in self.assignments:
+            # Queued after the site's stop, if any, so the old pipeline is gone by then.
+            worker = self.assignments[name]
+        else:
+            loads = [list(self.assignments.values()).count(worker) for worker in range(self.workers)]
+            worker = loads.index(min(loads))
+            self.assignments[name] = worker
+        self.health[name] = {'state': 'starting', 'worker': worker, 'updated': time.time()}
+        self.queues[worker].put(('start', self.sites[name]))
+
+    def stop_site(self, name: str) -> None:
+        """
+        Stops a site; it drains, flushes its output and checkpoints, and reports 'stopped'.
+        The site keeps its worker until then, so restarting it cannot run two
+        pipelines on the same output and checkpoint files.
+        """
+        self.queues[self.assignments[name]].put(('stop', name))
+
+    def _release_stopped(self) -> None:
+        # Workers of sites that reported their end are free for other sites.
+        for name in list(self.assignments):
+            if self.health.get(name, {}).get('state') in ('stopped', 'failed'):
+                del self.assignments[name]
+
+    def site_health(self) -> Dict[str, Dict]:
+        """
+        :return: Latest health of every site: state, synced entries and rate, missing
+            and late counts, per-stream ingestion and cache figures.
+        """
+        return dict(self.health)
+
+    def stop(self) -> None:
+        """
+        Stops every site and the workers.
+        """
+        for commands in self.queues:
+            commands.put(('shutdown', None))
+        for process in self.processes:
+            process.join(STOP_TIMEOUT_S + 5)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop, terminating it.", process.name)
+                process.terminate()
+        self.assignments.clear()
+
+    def close(self) -> None:
+        if self.manager is not None:
+            self.manager.shutdown()
+
+
+def format_health(health: Dict[str, Dict]) -> str:
+    lines = []
+    for name, site in sorted(health.items()):
+        lines.append(f"  {name:<20} {site.get('state', '?'):<9} worker {site.get('worker', '?')}"
+                     f"  synced {site.get('synced', 0):>8}  {site.get('synced_per_s', 0.0):6.1f}/s"
+                     f"  missing {site.get('missing', 0):>6}  late {site.get('late', 0):>6}"
+                     + (f"  error {site['error']}" if site.get('error') else ''))
+    return '\n'.join(lines)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sites', help="Site list (JSON).")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes; defaults to the CPU count.")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="Seconds between health reports.")
+    args = parser.parse_args()
+
+    host = FusionHost(load_sites(args.sites), workers=args.workers)
+    stopping = []
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(True))
+    host.start()
+    print(f"Running {len(host.sites)} sites on {host.workers} workers")
+    try:
+        while not stopping:
+            time.sleep(args.report_interval)
+            health = host.site_health()
+            print(format_health(health))
+            if health and all(site.get('state') in ('stopped', 'failed') for site in health.values()):
+                break  # Replayed sites end on their own
+    finally:
+        host.stop()
+        print(format_health(host.site_health()))
+        host.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+from sync import Cache
+from utils import records_to_frames
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+_END = object()
+
+
+def parse_records(records: List[Dict], columnar: bool = False) -> List[Dict]:
+    """
+    Default parser: decodes every record of a GetRecords batch into a frame, with
+    the objects of each frame as object dicts, or as one OBJECT_DTYPE array when
+    `columnar` is True. Dicts are the default: on the museum frames (~4 objects)
+    columnar decoding runs at 0.84x, and only pays off in crowded scenes (2x at
+    ~80 objects per frame, see bench_decode.py). Dicts also keep class names that
+    are not in OBJECT_CLASSES.
+    """
+    return records_to_frames(records, columnar=columnar)
+
+
+class StreamIngestor:
+    """
+    Feeds one record stream into its Cache from inside the asyncio event loop.
+
+    The blocking record generator (e.g. KinesisStream.get_records_iter) runs on a
+    dedicated thread and the next batch is prefetched while the current one is
+    parsed. Parsed frames go through a bounded queue before reaching the cache;
+    when the queue is full the overflow policy decides whether the producer waits
+    ('block'), the oldest queued frame is discarded ('drop_oldest') or the new
+    frame is discarded ('drop_newest').
+    """
+
+    def __init__(self,
+                 generator: Iterator[List[Dict]],
+                 cache: Cache,
+                 max_queue: int = 64,
+                 overflow: str = 'block',
+                 max_cache_entries: Optional[int] = None,
+                 parse: Callable[[List[Dict]], List[Dict]] = parse_records,
+                 on_frame: Optional[Callable[[Dict], None]] = None,
+                 name: str = None,
+                 parse_pool=None):
+        """
+        :param generator: Yields lists of raw records.
+        :param cache: Destination cache.
+        :param max_queue: Capacity of the queue between the stream and the cache.
+        :param overflow: One of OVERFLOW_POLICIES.
+        :param max_cache_entries: Hold frames in the queue while the cache holds this many
+                                  entries, so a lagging sync stage pushes back on ingestion.
+        :param parse: Turns a list of records into a list of frames.
+        :param on_frame: Called on the event loop after each frame is added to the cache.
+        :param name: Used in log messages.
+        :param parse_pool: Optional parse_pool.ParsePool. Batches are then decoded in worker
+                           processes (replacing `parse`), with up to one batch in flight per
+                           worker; frames are still queued in stream order.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        self.generator = generator
+        self.cache = cache
+        self.overflow = overflow
+        self.max_cache_entries = max_cache_entries
+        self.parse = parse
+        self.on_frame = on_frame
+        self.name = name
+        self.parse_pool = parse_pool
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.stats = {
+            'batches': 0,
+            'frames': 0,
+            'consumed': 0,
+            'dropped_oldest': 0,
+            'dropped_newest': 0,
+            'blocked': 0,
+            'queue_high_water': 0,
+            'parse_seconds': 0.0,
+        }
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ingest-{name}")
+        self._stopped = False
+        self._stop_event = asyncio.Event()
+
+    async def _enqueue(self, frame: Dict) -> None:
+        if self._stopped:
+            # stop() has queued _END; nothing may follow it or push it out of the queue.
+            return
+        if self.queue.full():
+            if self.overflow == 'drop_newest':
+                self.stats['dropped_newest'] += 1
+                return
+            if self.overflow == 'drop_oldest':
+                self.queue.get_nowait()
+                self.stats['dropped_oldest'] += 1
+            else:
+                self.stats['blocked'] += 1
+        await self.queue.put(frame)
+        self.stats['queue_high_water'] = max(self.stats['queue_high_water'], self.queue.qsize())
+
+    async def _enqueue_frames(self, frames: List[Dict]) -> None:
+        for frame in frames:
+            if self._stopped:
+                return
+            self.stats['frames'] += 1
+            await self._enqueue(frame)
+
+    async def _produce(self) -> None:
+        loop = asyncio.get_running_loop()
+        pending = loop.run_in_executor(self._executor, next, self.generator, _END)
+        in_flight = collections.deque()
+        while not self._stopped:
+            records = await pending
+            if records is _END:
+                # Batches still being parsed by the pool keep their place in the stream.
+                while in_flight:
+                    await self._enqueue_frames(await in_flight.popleft())
+                await self.queue.put(_END)
+                return
+            # Prefetch the next batch while this one is parsed.
+            pending = loop.run_in_executor(self._executor, next, self.generator, _END)
+            self.stats['batches'] += 1
+
+            if self.parse_pool is not None:
+                in_flight.append(asyncio.wrap_future(self.parse_pool.submit(records)))
+                while in_flight and (in_flight[0].done() or len(in_flight) > self.parse_pool.workers):
+                    await self._enqueue_frames(await in_flight.popleft())
+                continue
+
+            parse_start = time.perf_counter()
+            frames = self.parse(records)
+            self.stats['parse_seconds'] += time.perf_counter() - parse_start
+            await self._enqueue_frames(frames)
+
+    async def _consume(self) -> None:
+        while True:
+            frame = await self.queue.get()
+            if frame is _END:
+                break
+            if self.max_cache_entries is not None:
+                await self._wait_for_cache_space()
+            self.cache.add(frame)
+            self.stats['consumed'] += 1
+            if self.on_frame is not None:
+                self.on_frame(frame)
+
+    async def _wait_for_cache_space(self) -> None:
+        # Sleeps until the sync stage has taken entries out of the cache, or stop().
+        while len(self.cache) >= self.max_cache_entries and not self._stopped:
+            waits = [asyncio.ensure_future(self.cache.wait_for_space_async(self.max_cache_entries)),
+                     asyncio.ensure_future(self._stop_event.wait())]
+            await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            for wait in waits:
+                wait.cancel()
+
+    async def run(self) -> None:
+        """
+        Ingests until the generator is exhausted or stop() is called.
+        """
+        logger.info("Started ingestion of %s.", self.name)
+        producer = asyncio.ensure_future(self._produce())
+        try:
+            await self._consume()
+        finally:
+            producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+            self._executor.shutdown(wait=False)
+            logger.info("Stopped ingestion of %s: %s", self.name, self.stats)
+
+    def stop(self) -> None:
+        if self._stopped:
+            return
+        self._stopped = True
+        self._stop_event.set()
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_END)
@@ -1,6 +1,10 @@
-import sys
 import json
+import time
+import heapq
 import logging
+import threading
+
+from aggregation import aggregate, aggregated_size, deaggregate_records
 
 import boto3
 from botocore.exceptions import ClientError
@@ -12,11 +16,18 @@ logger = logging.getLogger(__name__)
 class KinesisStream:
     """Encapsulates a Kinesis stream."""
 
-    def __init__(self, name, region_name='eu-west-2', create_if_not_found=True):
+    def __init__(self, name, region_name='eu-west-2', create_if_not_found=True, kinesis_client=None):
         """
-        :param kinesis_client: A Boto3 Kinesis client.
+        :param name: The name of the stream.
+        :param region_name: AWS region used when no client is given.
+        :param create_if_not_found: Create the stream when it does not exist; otherwise
+                                    a missing stream raises ValueError.
+        :param kinesis_client: A Boto3 Kinesis client (or a compatible fake such as
+                               fake_kinesis.FakeKinesisClient). Defaults to a new Boto3 client.
         """
-        self.kinesis_client = self.kinesis_client = boto3.client('kinesis', region_name=region_name)
+        if kinesis_client is None:
+            kinesis_client = boto3.client('kinesis', region_name=region_name)
+        self.kinesis_client = kinesis_client
         self.name = name
         
         self.stream_exists_waiter = self.kinesis_client.get_waiter("stream_exists")
@@ -87,12 +98,11 @@ class KinesisStream:
         except ClientError as err:
             if err.response['Error']['Code'] == 'ResourceNotFoundException':
                 if create_if_not_found==True:
-                    logger.warn("Stream not found, Creating a new stream: {self.name}")
+                    logger.warning("Stream %s not found, creating it.", self.name)
                     self._create(wait_until_exists=True)
                 
                 else:
-                    logger.error('Stream not found, Exiting.')
-                    sys.exit()
+                    raise ValueError(f"Stream {self.name} does not exist.") from err
             
             else: 
                 raise err
@@ -126,7 +136,7 @@ class KinesisStream:
             response = self.kinesis_client.put_record(
                 StreamName=self.name, Data=data, PartitionKey=partition_key
             )
-            logger.info("Put record in stream %s.", self.name)
+            logger.debug("Put record in stream %s.", self.name)
         except ClientError:
             logger.exception("Couldn't put record in stream %s.", self.name)
             raise
@@ -135,6 +145,42 @@ class KinesisStream:
 
     # snippet-end:[python.example_code.kinesis.PutRecord]
 
+    def put_records(self, entries, max_retries=3, backoff=0.1):
+        """
+        Puts many records with PutRecords calls, split into requests that respect
+        the service limits (500 records, 5 MiB). Entries the service rejects (e.g.
+        throttled) are retried on their own with exponential backoff.
+
+        :param entries: Dicts with `Data` (bytes) and `PartitionKey`.
+        :param max_retries: How many times failed entries are resent.
+        :param backoff: Delay in seconds before the first retry; doubled each retry.
+        :return: The entries that still failed after all retries.
+        """
+        failed = []
+        for request in _chunk_entries(entries):
+            pending = request
+            for attempt in range(max_retries + 1):
+                if attempt:
+                    time.sleep(backoff * 2 ** (attempt - 1))
+                try:
+                    response = self.kinesis_client.put_records(StreamName=self.name, Records=pending)
+                except ClientError:
+                    logger.exception("Couldn't put records in stream %s.", self.name)
+                    raise
+                if not response.get("FailedRecordCount"):
+                    pending = []
+                    break
+                pending = [
+                    entry for entry, result in zip(pending, response["Records"])
+                    if "ErrorCode" in result
+                ]
+                logger.debug("%s records rejected by stream %s.", len(pending), self.name)
+            if pending:
+                logger.warning("Dropping %s records after %s retries on stream %s.",
+                               len(pending), max_retries, self.name)
+                failed.extend(pending)
+        return failed
+
     # snippet-start:[python.example_code.kinesis.GetRecords]
     def get_records(self, limit):
         """
@@ -172,37 +218,349 @@ class KinesisStream:
             raise
     # snippet-end:[python.example_code.kinesis.GetRecords]
 
-    def get_records_iter(self, shard_iter_type = "LATEST"):
+    def list_shards(self):
         """
-        Gets records from the stream. This function is a generator that first gets
-        a shard iterator for the stream, then uses the shard iterator to get records
-        in batches from the stream. Each batch of records is yielded back to the
-        caller until the specified maximum number of records has been retrieved.
+        Lists every shard of the stream, following pagination.
 
-        :param max_records: The maximum number of records to retrieve.
-        :return: Yields the current batch of retrieved records.
+        :return: The shard descriptions, including closed parent shards.
         """
         try:
-            response = self.kinesis_client.get_shard_iterator(
-                StreamName=self.name,
-                ShardId=self.details["Shards"][2]["ShardId"],
-                ShardIteratorType=shard_iter_type,
-            )
-            shard_iter = response["ShardIterator"]
+            shards = []
+            response = self.kinesis_client.list_shards(StreamName=self.name)
+            shards.extend(response["Shards"])
+            while response.get("NextToken"):
+                response = self.kinesis_client.list_shards(NextToken=response["NextToken"])
+                shards.extend(response["Shards"])
+            return shards
+        except ClientError:
+            logger.exception("Couldn't list shards of stream %s.", self.name)
+            raise
 
-            while response:
-                response = self.kinesis_client.get_records(
-                    ShardIterator=shard_iter, Limit=1
-                )
-                shard_iter = response["NextShardIterator"]
-                records = response["Records"]
-                # logger.info("Got %s records.", len(records))
+    def _shard_iterator(self, shard_id, shard_iter_type, sequence_number=None):
+        kwargs = {}
+        if sequence_number is not None:
+            kwargs["StartingSequenceNumber"] = sequence_number
+        response = self.kinesis_client.get_shard_iterator(
+            StreamName=self.name,
+            ShardId=shard_id,
+            ShardIteratorType=shard_iter_type,
+            **kwargs,
+        )
+        return response["ShardIterator"]
+
+    def _open_children(self, readers, finished):
+        """
+        Starts reading every shard whose parents have all been drained. Children
+        are read from TRIM_HORIZON so no record written after a split or merge is lost.
+        """
+        for shard in self.list_shards():
+            shard_id = shard["ShardId"]
+            if shard_id in readers or shard_id in finished:
+                continue
+            parents = [shard.get("ParentShardId"), shard.get("AdjacentParentShardId")]
+            if all(parent is None or parent in finished for parent in parents):
+                logger.info("Following new shard %s of stream %s.", shard_id, self.name)
+                readers[shard_id] = {
+                    "iterator": self._shard_iterator(shard_id, "TRIM_HORIZON"),
+                    "last_sequence": None,
+                }
+
+    def get_records_iter(self, shard_iter_type="LATEST", limit=100, poll_interval=0.2, checkpoint_store=None,
+                         deaggregate=True):
+        """
+        Gets records from every open shard of the stream. This function is a generator:
+        each poll reads up to `limit` records from each shard, merges them into one
+        list ordered by arrival time and yields it (the list may be empty when no
+        new data arrived). Closed shards are dropped and the children created by a
+        split or merge are picked up automatically, so the consumer survives resharding.
+
+        :param shard_iter_type: Where to start reading the shards that are open at start-up.
+        :param limit: The maximum number of records fetched per shard and call.
+        :param poll_interval: Minimum time in seconds between two polls of a shard.
+                              Kinesis allows 5 GetRecords calls per shard per second.
+        :param checkpoint_store: Optional checkpoint.CheckpointStore. Shards with a
+                                 checkpoint resume right after it (AFTER_SEQUENCE_NUMBER,
+                                 or at the next payload of a partly processed aggregated
+                                 record). Closed shards are read too unless starting
+                                 from LATEST; children wait until their parents are drained.
+        :param deaggregate: Expand records written by an aggregating KinesisProducer
+                            into one record per frame.
+        :return: Yields lists of records; each record carries its source `ShardId`.
+        """
+        try:
+            shards = self.list_shards()
+            checkpoints = {}
+            if checkpoint_store is not None:
+                for shard in shards:
+                    position = checkpoint_store.get_position(self.name, shard["ShardId"])
+                    if position is not None:
+                        checkpoints[shard["ShardId"]] = position
+
+            # Parents of checkpointed shards were read to the end before the checkpoint.
+            drained = {parent for shard in shards if shard["ShardId"] in checkpoints
+                       for parent in (shard.get("ParentShardId"), shard.get("AdjacentParentShardId"))}
+            finished = set()
+            readers = {}
+            waiting = set()
+            # Children have higher shard ids than their parents.
+            for shard in sorted(shards, key=lambda shard: shard["ShardId"]):
+                shard_id = shard["ShardId"]
+                parents = (shard.get("ParentShardId"), shard.get("AdjacentParentShardId"))
+                if shard_id in checkpoints:
+                    sequence, sub_sequence = checkpoints[shard_id]
+                    logger.info("Resuming shard %s of stream %s after %s.", shard_id, self.name,
+                                sequence if sub_sequence is None else f"{sequence}/{sub_sequence}")
+                    if sub_sequence is not None and deaggregate:
+                        # Read the aggregated record again and drop the payloads already processed.
+                        readers[shard_id] = {
+                            "iterator": self._shard_iterator(shard_id, "AT_SEQUENCE_NUMBER", sequence),
+                            "last_sequence": None,
+                            "skip_through": (sequence, sub_sequence),
+                        }
+                    else:
+                        readers[shard_id] = {
+                            "iterator": self._shard_iterator(shard_id, "AFTER_SEQUENCE_NUMBER", sequence),
+                            "last_sequence": sequence,
+                        }
+                elif "EndingSequenceNumber" in shard["SequenceNumberRange"] and (
+                        shard_iter_type == "LATEST" or shard_id in drained):
+                    finished.add(shard_id)
+                elif any(parent in readers or parent in waiting for parent in parents):
+                    # Picked up by _open_children once its parents are drained.
+                    waiting.add(shard_id)
+                else:
+                    readers[shard_id] = {
+                        "iterator": self._shard_iterator(shard_id, shard_iter_type),
+                        "last_sequence": None,
+                    }
+            logger.info("Reading %s shards of stream %s.", len(readers), self.name)
+
+            while True:
+                poll_start = time.monotonic()
+                shard_batches = []
+                closed = []
+                for shard_id, reader in readers.items():
+                    try:
+                        response = self.kinesis_client.get_records(
+                            ShardIterator=reader["iterator"], Limit=limit
+                        )
+                    except ClientError as err:
+                        code = err.response["Error"]["Code"]
+                        if code == "ExpiredIteratorException":
+                            if reader.get("skip_through") is not None:
+                                reader["iterator"] = self._shard_iterator(
+                                    shard_id, "AT_SEQUENCE_NUMBER", reader["skip_through"][0]
+                                )
+                            elif reader["last_sequence"] is None:
+                                reader["iterator"] = self._shard_iterator(shard_id, shard_iter_type)
+                            else:
+                                reader["iterator"] = self._shard_iterator(
+                                    shard_id, "AFTER_SEQUENCE_NUMBER", reader["last_sequence"]
+                                )
+                            continue
+                        if code == "ProvisionedThroughputExceededException":
+                            logger.warning("Read throughput exceeded on shard %s of stream %s.",
+                                           shard_id, self.name)
+                            continue
+                        raise
+
+                    records = response["Records"]
+                    for record in records:
+                        record["ShardId"] = shard_id
+                    if records:
+                        reader["last_sequence"] = records[-1]["SequenceNumber"]
+                        if deaggregate:
+                            records = deaggregate_records(records)
+                        if reader.get("skip_through") is not None:
+                            sequence, sub_sequence = reader.pop("skip_through")
+                            records = [record for record in records
+                                       if record["SequenceNumber"] != sequence
+                                       or record.get("SubSequenceNumber", sub_sequence + 1) > sub_sequence]
+                        if records:
+                            shard_batches.append(records)
+
+                    reader["iterator"] = response.get("NextShardIterator")
+                    if reader["iterator"] is None:
+                        closed.append(shard_id)
+
+                if closed:
+                    for shard_id in closed:
+                        logger.info("Shard %s of stream %s closed.", shard_id, self.name)
+                        del readers[shard_id]
+                        finished.add(shard_id)
+                    self._open_children(readers, finished)
+
+                if len(shard_batches) == 1:
+                    records = shard_batches[0]
+                else:
+                    records = list(heapq.merge(
+                        *shard_batches, key=lambda record: record["ApproximateArrivalTimestamp"]
+                    ))
                 yield records
-            logger.exception("Shard closed. Couldn't get records from stream %s.", self.name)
-            raise 
-            # TODO: Now the consumer closes when the shard closes. It should keep looking for new data in the stream and auto start if there is data
+
+                remaining = poll_interval - (time.monotonic() - poll_start)
+                if remaining > 0:
+                    time.sleep(remaining)
         except ClientError:
             logger.exception("Couldn't get records from stream %s.", self.name)
             raise
 
-    
\ No newline at end of file
+
+MAX_RECORDS_PER_REQUEST = 500
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024
+MAX_BYTES_PER_RECORD = 1024 * 1024
+
+
+def _entry_size(entry):
+    return len(entry["Data"]) + len(entry["PartitionKey"])
+
+
+def _chunk_entries(entries):
+    """
+    Splits PutRecords entries into requests within the per-request limits.
+    """
+    chunk = []
+    chunk_bytes = 0
+    for entry in entries:
+        size = _entry_size(entry)
+        if chunk and (len(chunk) == MAX_RECORDS_PER_REQUEST or chunk_bytes + size > MAX_BYTES_PER_REQUEST):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(entry)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+class KinesisProducer:
+    """
+    Buffers records for a KinesisStream and sends them with PutRecords.
+
+    The buffer is flushed when it holds `max_count` records or `max_bytes` bytes,
+    or when its oldest record has waited `linger_ms`. With `aggregate=True`, small
+    payloads sharing a partition key are packed into one Kinesis record (see
+    aggregation.py); consumers expand them again in get_records_iter and
+    utils.records_to_frames. Aggregated payloads share a sequence number; their
+    frames carry a sub-sequence number as well, so a checkpoint taken inside an
+    aggregated record resumes at the next payload.
+    """
+
+    def __init__(self, stream, max_count=500, max_bytes=MAX_BYTES_PER_REQUEST, linger_ms=100,
+                 aggregate=False, max_aggregate_bytes=64 * 1024, max_retries=3, backoff=0.1):
+        """
+        :param stream: The KinesisStream to write to.
+        :param max_count: Flush once this many payloads are buffered.
+        :param max_bytes: Flush once the buffered payloads reach this size.
+        :param linger_ms: Maximum time a payload waits in the buffer.
+        :param aggregate: Pack several payloads into each Kinesis record.
+        :param max_aggregate_bytes: Size limit of one aggregated record.
+        :param max_retries: Retries of rejected entries, see KinesisStream.put_records.
+        :param backoff: Initial retry delay in seconds.
+        """
+        self.stream = stream
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.linger = linger_ms / 1000
+        self.aggregate = aggregate
+        self.max_aggregate_bytes = min(max_aggregate_bytes, MAX_BYTES_PER_RECORD)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = {"payloads": 0, "records": 0, "requests": 0, "failed": 0}
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._linger_thread = threading.Thread(target=self._linger_loop, daemon=True,
+                                               name=f"producer-{stream.name}")
+        self._linger_thread.start()
+
+    def put(self, data, partition_key="No"):
+        """
+        Adds a payload to the buffer, flushing first if a size or count limit is hit.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Producer for stream {self.stream.name} is closed.")
+            if not self._buffer:
+                self._oldest = time.monotonic()
+                self._wakeup.notify()
+            self._buffer.append((data, partition_key))
+            self._buffer_bytes += len(data) + len(partition_key)
+            full = len(self._buffer) >= self.max_count or self._buffer_bytes >= self.max_bytes
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends everything buffered so far.
+        """
+        # Held from the swap to the send, so two flushes (put and the linger
+        # thread) cannot send their batches out of order; it also guards stats.
+        with self._send_lock:
+            with self._lock:
+                payloads = self._buffer
+                self._buffer = []
+                self._buffer_bytes = 0
+                self._oldest = None
+            if not payloads:
+                return
+            entries = self._pack(payloads) if self.aggregate else [
+                {"Data": data, "PartitionKey": key} for data, key in payloads
+            ]
+            failed = self.stream.put_records(entries, max_retries=self.max_retries, backoff=self.backoff)
+            self.stats["payloads"] += len(payloads)
+            self.stats["records"] += len(entries)
+            self.stats["requests"] += sum(1 for _ in _chunk_entries(entries))
+            self.stats["failed"] += len(failed)
+
+    def _pack(self, payloads):
+        """
+        Groups payloads by partition key, keeping their order, into aggregated records.
+        """
+        by_key = {}
+        for data, key in payloads:
+            by_key.setdefault(key, []).append(data)
+        entries = []
+        for key, items in by_key.items():
+            group = []
+            group_bytes = 0
+            for data in items:
+                size = aggregated_size(data)
+                if group and group_bytes + size > self.max_aggregate_bytes:
+                    entries.append({"Data": aggregate(group), "PartitionKey": key})
+                    group = []
+                    group_bytes = 0
+                group.append(data)
+                group_bytes += size
+            entries.append({"Data": aggregate(group), "PartitionKey": key})
+        return entries
+
+    def _linger_loop(self):
+        while True:
+            with self._lock:
+                while not self._closed and self._oldest is None:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                wait = self._oldest + self.linger - time.monotonic()
+                if wait > 0:
+                    self._wakeup.wait(wait)
+                    continue
+            self.flush()
+
+    def close(self):
+        """
+        Flushes the buffer and stops the linger thread.
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._linger_thread.join()
+        self.flush()
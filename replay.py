@@ -0,0 +1,208 @@
+import os
+import time
+import struct
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'CIIMREC1'
+# arrival time (s), approximate arrival time (ns, -1 if unknown), then the lengths of
+# sequence number, shard id, partition key and data.
+_ENTRY = struct.Struct('<dqHHHI')
+
+
+def recording_path(directory: str, stream_name: str) -> str:
+    return os.path.join(directory, f"{stream_name}.rec")
+
+
+class StreamRecorder:
+    """
+    Appends the raw records of a stream to a compact binary file, each with the
+    local time at which its GetRecords batch arrived.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Recording file. New records are appended if it exists.
+        """
+        self.path = path
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        if is_new:
+            self.file.write(FILE_MAGIC)
+        self.records_written = 0
+
+    def write(self, records: List[Dict], arrival: float = None) -> None:
+        """
+        Appends one batch of records.
+
+        :param records: Records as returned by GetRecords.
+        :param arrival: Arrival time of the batch (epoch seconds). Defaults to now.
+        """
+        if arrival is None:
+            arrival = time.time()
+        parts = []
+        for record in records:
+            approximate = record.get('ApproximateArrivalTimestamp')
+            approximate_ns = -1 if approximate is None else int(approximate.timestamp() * 1e9)
+            sequence = record.get('SequenceNumber', '').encode('ascii')
+            shard = (record.get('ShardId') or '').encode('ascii')
+            key = record.get('PartitionKey', '').encode('utf-8')
+            data = record['Data']
+            parts.append(_ENTRY.pack(arrival, approximate_ns, len(sequence), len(shard), len(key), len(data)))
+            parts.extend((sequence, shard, key, data))
+        self.file.write(b''.join(parts))
+        self.records_written += len(records)
+
+    def record(self, generator: Iterator[List[Dict]]) -> Iterator[List[Dict]]:
+        """
+        Passes batches through unchanged while writing them to the file.
+        """
+        for records in generator:
+            if records:
+                self.write(records)
+            yield records
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+        logger.info("Recorded %s records to %s.", self.records_written, self.path)
+
+
+def read_recording(path: str) -> Iterator[tuple]:
+    """
+    Reads a recording file one record at a time.
+
+    :return: Yields (arrival time, record) tuples in file order.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{path} is not a stream recording")
+        while True:
+            header = f.read(_ENTRY.size)
+            if len(header) < _ENTRY.size:
+                return
+            arrival, approximate_ns, sequence_len, shard_len, key_len, data_len = _ENTRY.unpack(header)
+            body = f.read(sequence_len + shard_len + key_len + data_len)
+            if len(body) < sequence_len + shard_len + key_len + data_len:
+                logger.warning("%s ends with a truncated record.", path)
+                return
+            offset = 0
+            sequence = body[offset:offset + sequence_len].decode('ascii')
+            offset += sequence_len
+            shard = body[offset:offset + shard_len].decode('ascii')
+            offset += shard_len
+            key = body[offset:offset + key_len].decode('utf-8')
+            offset += key_len
+            record = {
+                'SequenceNumber': sequence,
+                'ShardId': shard or None,
+                'PartitionKey': key,
+                'Data': body[offset:],
+            }
+            if approximate_ns >= 0:
+                record['ApproximateArrivalTimestamp'] = datetime.fromtimestamp(approximate_ns / 1e9, tz=timezone.utc)
+            yield arrival, record
+
+
+def first_arrival(path: str) -> Optional[float]:
+    """
+    :return: Arrival time of the first record of a recording, or None if it is empty.
+    """
+    records = read_recording(path)
+    try:
+        return next(records, (None,))[0]
+    finally:
+        records.close()
+
+
+class ReplayClock:
+    """
+    Time origin shared by the ReplayStreams of one run, so recordings made
+    together keep their recorded timing relative to each other.
+
+    The wall clock origin is taken when the first batch of any stream is due;
+    the recording origin is the earliest first arrival of the recordings.
+    """
+
+    def __init__(self, start_arrival: float = None, speed: float = 1.0):
+        """
+        :param start_arrival: Recorded arrival time played at the origin. Defaults to
+                              the arrival of the first batch waited for.
+        :param speed: Playback rate relative to the recording.
+        """
+        self.start_arrival = start_arrival
+        self.speed = speed
+        self.start_wall = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_recordings(cls, paths: List[str], speed: float = 1.0) -> 'ReplayClock':
+        arrivals = [arrival for arrival in map(first_arrival, paths) if arrival is not None]
+        return cls(min(arrivals, default=None), speed)
+
+    def wait_until(self, arrival: float) -> None:
+        """
+        Sleeps until the batch recorded at `arrival` is due.
+        """
+        with self.lock:
+            if self.start_wall is None:
+                self.start_wall = time.monotonic()
+                if self.start_arrival is None:
+                    self.start_arrival = arrival
+        delay = self.start_wall + (arrival - self.start_arrival) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ReplayStream:
+    """
+    Plays a recording back with the same iterator interface as
+    KinesisStream.get_records_iter, so the rest of the pipeline can run offline.
+    """
+
+    def __init__(self, path: str, name: str = None):
+        """
+        :param path: Recording written by StreamRecorder.
+        :param name: Stream name used in logs; defaults to the file name.
+        """
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+
+    def batches(self) -> Iterator[tuple]:
+        """
+        :return: Yields (arrival time, records) with the batches as they were recorded.
+        """
+        batch = []
+        batch_arrival = None
+        for arrival, record in read_recording(self.path):
+            if batch and arrival != batch_arrival:
+                yield batch_arrival, batch
+                batch = []
+            batch_arrival = arrival
+            batch.append(record)
+        if batch:
+            yield batch_arrival, batch
+
+    def get_records_iter(self, speed: float = 1.0, clock: ReplayClock = None, **kwargs) -> Iterator[List[Dict]]:
+        """
+        Yields the recorded batches.
+
+        :param speed: Playback rate relative to the recording (1 is real time, 10 is
+                      ten times faster). 0 or None replays as fast as possible.
+        :param clock: ReplayClock shared with the other streams of the run; it sets
+                      the speed. Defaults to a clock of this stream alone.
+        :param kwargs: Accepted and ignored for compatibility with KinesisStream.
+        """
+        if clock is None and speed:
+            clock = ReplayClock(speed=speed)
+        for arrival, records in self.batches():
+            if clock is not None:
+                clock.wait_until(arrival)
+            yield records
+        logger.info("Replay of %s finished.", self.name)
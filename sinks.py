@@ -0,0 +1,272 @@
+import os
+import glob
+import json
+import queue
+import struct
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List
+
+import numpy as np
+
+from sync import json_default
+from utils import OBJECT_DTYPE, objects_to_array
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+BINARY_MAGIC = b'CIIMSYN1'
+# Lengths of the JSON metadata and of the raw object arrays that follow it.
+_BINARY_RECORD = struct.Struct('<II')
+
+
+class FileSink:
+    """
+    Writes synced entries to disk as they are emitted.
+
+    write() only queues the entry; a writer thread encodes and writes it, so disk
+    I/O never runs on the event loop thread. The file is flushed every
+    `flush_interval_s` or `flush_bytes`, whichever comes first. With a rotation
+    limit the output is split into numbered segments, see segment_paths.
+
+    Entries only count as written once they are flushed: `on_flushed` is called on
+    the writer thread with the entries of each flush, e.g. to advance checkpoints.
+    Entries dropped by write() never reach it.
+
+    Subclasses implement encode() and may write a file header.
+    """
+
+    header = b''
+
+    def __init__(self, path: str, rotate_bytes: int = None, rotate_interval_s: float = None,
+                 flush_interval_s: float = 1.0, flush_bytes: int = 1 << 20, max_queue: int = 10000,
+                 on_flushed: Callable[[List[Dict]], None] = None):
+        """
+        :param path: Output file. With rotation, segments are named <stem>.<n><ext>.
+        :param rotate_bytes: Start a new segment once a segment reaches this size.
+        :param rotate_interval_s: Start a new segment after this many seconds.
+        :param flush_interval_s: Longest time written entries may sit in the file buffer.
+        :param flush_bytes: Flush once this many bytes have been written since the last flush.
+        :param max_queue: Entries waiting for the writer thread; further entries are dropped.
+        :param on_flushed: Optional callback receiving the entries written since the
+                           previous flush, once they have been flushed.
+        """
+        self.path = path
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval_s = rotate_interval_s
+        self.flush_interval_s = flush_interval_s
+        self.flush_bytes = flush_bytes
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.on_flushed = on_flushed
+        self.paths = []
+        self.stats = {'written': 0, 'dropped': 0, 'bytes': 0, 'flushes': 0}
+        self.file = None
+        self._segment_bytes = 0
+        self._segment_start = None
+        self._unflushed_entries = []
+        self._closed = False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name=f"sink-{os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    @property
+    def rotates(self) -> bool:
+        return self.rotate_bytes is not None or self.rotate_interval_s is not None
+
+    def write(self, entry: Dict) -> bool:
+        """
+        Queues a synced entry without blocking.
+
+        :return: False if the queue was full and the entry was dropped.
+        """
+        try:
+            self.queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] == 1:
+                logger.warning("Sink %s cannot keep up, dropping synced entries.", self.path)
+            return False
+
+    def encode(self, entry: Dict) -> bytes:
+        raise NotImplementedError
+
+    def _open_segment(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        if self.rotates:
+            stem, ext = os.path.splitext(self.path)
+            path = f"{stem}.{len(self.paths):05d}{ext}"
+        else:
+            path = self.path
+        self.file = open(path, 'wb')
+        self.file.write(self.header)
+        self.paths.append(path)
+        self._segment_bytes = len(self.header)
+        self._segment_start = time.monotonic()
+
+    def _needs_rotation(self, size: int) -> bool:
+        if not self.rotates or self._segment_bytes == len(self.header):
+            return False
+        if self.rotate_bytes is not None and self._segment_bytes + size > self.rotate_bytes:
+            return True
+        return (self.rotate_interval_s is not None
+                and time.monotonic() - self._segment_start >= self.rotate_interval_s)
+
+    def _flush(self) -> None:
+        self.file.flush()
+        self.stats['flushes'] += 1
+        entries, self._unflushed_entries = self._unflushed_entries, []
+        if self.on_flushed is not None and entries:
+            try:
+                self.on_flushed(entries)
+            except Exception:
+                logger.exception("on_flushed callback of %s failed.", self.path)
+
+    def _run(self) -> None:
+        self._open_segment()
+        unflushed = 0
+        flush_deadline = None
+        while True:
+            timeout = None if flush_deadline is None else max(flush_deadline - time.monotonic(), 0)
+            try:
+                entry = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+            if entry is _END:
+                break
+            if entry is not None:
+                try:
+                    data = self.encode(entry)
+                except Exception:
+                    logger.exception("Could not encode a synced entry for %s.", self.path)
+                    continue
+                if self._needs_rotation(len(data)):
+                    # Closing the segment flushes it; acknowledge its entries first.
+                    if self._unflushed_entries:
+                        self._flush()
+                    self._open_segment()
+                    unflushed, flush_deadline = 0, None
+                self.file.write(data)
+                self._segment_bytes += len(data)
+                self.stats['written'] += 1
+                self._unflushed_entries.append(entry)
+                self.stats['bytes'] += len(data)
+                unflushed += len(data)
+                if flush_deadline is None:
+                    flush_deadline = time.monotonic() + self.flush_interval_s
+            if unflushed and (unflushed >= self.flush_bytes or time.monotonic() >= flush_deadline):
+                self._flush()
+                unflushed, flush_deadline = 0, None
+        self._flush()
+        self.file.close()
+
+    def close(self) -> None:
+        """
+        Writes the queued entries and closes the output. Idempotent.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(_END)
+        self.thread.join()
+        logger.info("Wrote %s synced entries to %s (%s).", self.stats['written'], self.path,
+                    ', '.join(self.paths))
+
+
+class JsonLinesSink(FileSink):
+    """
+    One synced entry per line, as JSON (object arrays become object dicts).
+    """
+
+    def encode(self, entry: Dict) -> bytes:
+        return (json.dumps(entry, default=json_default) + '\n').encode('utf-8')
+
+
+class BinarySink(FileSink):
+    """
+    Compact binary synced entries: per entry, the frame headers as JSON followed by
+    the raw OBJECT_DTYPE bytes of every frame's objects. Class codes are those of
+    OBJECT_CLASSES. Read with read_binary_synced.
+    """
+
+    header = BINARY_MAGIC
+
+    def encode(self, entry: Dict) -> bytes:
+        metadata = {}
+        counts = {}
+        arrays = []
+        for key, value in entry.items():
+            if isinstance(value, dict) and 'objects' in value:
+                objects = objects_to_array(value['objects'])
+                counts[key] = len(objects)
+                arrays.append(objects.tobytes())
+                value = {name: field for name, field in value.items() if name != 'objects'}
+            metadata[key] = value
+        record = {'entry': metadata, 'counts': counts}
+        metadata_bytes = json.dumps(record, default=json_default).encode('utf-8')
+        objects_bytes = b''.join(arrays)
+        return _BINARY_RECORD.pack(len(metadata_bytes), len(objects_bytes)) + metadata_bytes + objects_bytes
+
+
+SINKS = {'.jsonl': JsonLinesSink, '.bin': BinarySink}
+
+
+def open_sink(path: str, **kwargs) -> FileSink:
+    """
+    :return: The sink matching the extension of `path` (see SINKS), started.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in SINKS:
+        raise ValueError(f"No sink for {path!r}; use one of {sorted(SINKS)}")
+    return SINKS[extension](path, **kwargs)
+
+
+def segment_paths(path: str) -> List[str]:
+    """
+    :return: The segments written by a rotating sink for `path` in order, or `path`
+        itself if it was not rotated.
+    """
+    stem, ext = os.path.splitext(path)
+    segments = sorted(glob.glob(f"{glob.escape(stem)}.[0-9][0-9][0-9][0-9][0-9]{ext}"))
+    return segments or [path]
+
+
+def read_jsonl_synced(path: str) -> Iterator[Dict]:
+    for segment in segment_paths(path):
+        with open(segment, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_binary_synced(path: str) -> Iterator[Dict]:
+    """
+    Reads the entries written by BinarySink; frames get their objects back as
+    OBJECT_DTYPE arrays, with class codes into OBJECT_CLASSES.
+    """
+    for segment in segment_paths(path):
+        with open(segment, 'rb') as f:
+            data = f.read()
+        if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            raise ValueError(f"{segment} is not a binary synced-data file")
+        offset = len(BINARY_MAGIC)
+        while offset + _BINARY_RECORD.size <= len(data):
+            metadata_len, objects_len = _BINARY_RECORD.unpack_from(data, offset)
+            offset += _BINARY_RECORD.size
+            record = json.loads(data[offset:offset + metadata_len])
+            offset += metadata_len
+            objects = np.frombuffer(data, dtype=OBJECT_DTYPE, count=objects_len // OBJECT_DTYPE.itemsize,
+                                    offset=offset).copy()
+            offset += objects_len
+
+            entry = record['entry']
+            start = 0
+            for key, count in record['counts'].items():
+                entry[key]['objects'] = objects[start:start + count]
+                start += count
+            yield entry
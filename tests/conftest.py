@@ -0,0 +1,50 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_object(obj_id, object_class='PERSON', position=(1.0, 2.0, 0.5), bearing_degrees=30.0, frame_count=0,
+                speed_mph=1.5):
+    """
+    An Outsight object dict, as record_to_frame produces them.
+    """
+    return {'frame_count': frame_count, 'obj_id': obj_id, 'object_class': object_class,
+            'pos_x': position[0], 'pos_y': position[1], 'pos_z': position[2],
+            'dim_x': 0.6, 'dim_y': 0.5, 'dim_z': 1.8, 'speed_mph': speed_mph, 'bearing_degrees': bearing_degrees}
+
+
+def make_frame(timestamp_ns, objects=None, frame_count=0):
+    """
+    A small synthetic frame dict.
+    """
+    objects = [make_object(1, frame_count=frame_count)] if objects is None else objects
+    return {'frame_Count': frame_count, 'timestamp_ns': timestamp_ns, 'objects': objects}
+
+
+def make_payload(frame_count, objects=None):
+    """
+    The Outsight CSV payload of a frame, as the sensors put it on their streams.
+    Frames are 100 ms apart from 2024-05-01T12:00:00.
+    """
+    objects = [make_object(1, frame_count=frame_count)] if objects is None else objects
+    time_s = 1714564800 + frame_count / 10
+    formatted_time = datetime.fromtimestamp(time_s, timezone.utc).replace(tzinfo=None).isoformat(timespec='microseconds')
+    lines = [f"FRAME,{frame_count},{time_s:.6f},{formatted_time},{len(objects)},0"]
+    for obj in objects:
+        lines.append(f"OBJECT,{obj['frame_count']},{obj['obj_id']},{obj['object_class']},"
+                     f"{obj['pos_x']},{obj['pos_y']},{obj['pos_z']},{obj['dim_x']},{obj['dim_y']},{obj['dim_z']},"
+                     f"{obj['speed_mph']},{obj['bearing_degrees']}")
+    return '\n'.join(lines).encode('utf-8')
+
+
+async def wait_until(condition, timeout=5.0):
+    """
+    Yields to the event loop until `condition()` holds; fails after `timeout` seconds.
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.001)
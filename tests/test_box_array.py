@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from pyquaternion import Quaternion
+
+from conftest import make_object
+from data_classes import Box, BoxArray
+from geometry_utils import PointCloudIndex, points_box_labels, points_in_box, points_in_boxes, yaw_matrices
+from utils import objects2boxarray, objects2boxes, transform_boxes_list
+
+
+def sample_objects():
+    return [make_object(i, position=(i, -i, 0.5 * i), bearing_degrees=bearing)
+            for i, bearing in enumerate([-170.0, -45.0, 0.0, 30.0, 179.0])]
+
+
+def rigid(rotation, translation=(0.0, 0.0, 0.0)):
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = translation
+    return matrix
+
+
+def full_rotation_copy(boxes):
+    return BoxArray(boxes.centers, boxes.wlh, rotations=boxes.rotations, velocities=boxes.velocities)
+
+
+def test_box_array_matches_boxes():
+    objects = sample_objects()
+    boxes = objects2boxes(objects)
+    array = objects2boxarray(objects)
+
+    assert array.planar
+    assert np.allclose(array.corners(), np.stack([box.corners() for box in boxes]))
+    assert np.allclose(array.yaws, np.radians([obj['bearing_degrees'] for obj in objects]))
+    for box, converted in zip(boxes, array.to_boxes()):
+        assert np.allclose(box.orientation.rotation_matrix, converted.orientation.rotation_matrix)
+
+
+@pytest.mark.parametrize('rotation, planar', [
+    (yaw_matrices(np.array([2.5]))[0], True),
+    (np.diag([1.0, -1.0, -1.0]), False),  # Roll by 180 degrees: z points down
+    (Quaternion(axis=[1, 0, 0], angle=0.3).rotation_matrix, False),
+])
+def test_transform_matches_the_matrix_path(rotation, planar):
+    array = objects2boxarray(sample_objects())
+    reference = full_rotation_copy(array)
+    matrix = rigid(rotation, (1.0, 2.0, 3.0))
+    array.transform(matrix)
+    reference.transform(matrix)
+
+    assert array.planar == planar
+    assert np.allclose(array.corner_points(), reference.corner_points())
+    assert np.allclose(array.bottom_corners(), reference.bottom_corners())
+
+
+def test_transform_matches_transform_boxes_list():
+    objects = sample_objects()
+    matrix = rigid(Quaternion(axis=[0.2, 0.1, 1.0], angle=1.0).rotation_matrix, (4.0, -1.0, 0.5))
+    boxes = transform_boxes_list(objects2boxes(objects), matrix)
+    array = objects2boxarray(objects)
+    array.transform(matrix)
+
+    assert np.allclose(array.corners(), np.stack([box.corners() for box in boxes]))
+    assert np.allclose(array.velocities, np.stack([box.velocity for box in boxes]))
+
+
+def test_slicing_filtering_and_concatenation_keep_the_boxes():
+    array = objects2boxarray(sample_objects())
+    assert isinstance(array[1], Box)
+    assert array[-1] == array.to_boxes()[-1]
+    assert len(array[1:3]) == 2 and array[1:3].planar
+    kept = array.filter(array.centers[:, 0] >= 2)
+    assert kept.ids.tolist() == [2, 3, 4]
+    joined = BoxArray.concatenate([array[:2], array[2:]])
+    assert np.array_equal(joined.corner_points(), array.corner_points())
+
+
+def test_cached_corners_follow_translate_and_rotate():
+    box = objects2boxes(sample_objects())[1]
+    corners = box.corners().copy()
+    box.translate(np.array([1.0, 0.0, 0.0]))
+    assert np.allclose(box.corners(), corners + [[1.0], [0.0], [0.0]])
+    box.rotate(Quaternion(axis=[0, 0, 1], angle=np.pi))
+    assert np.allclose(box.corners()[:2], -(corners + [[1.0], [0.0], [0.0]])[:2])
+    with pytest.raises(ValueError):
+        box.corners()[0, 0] = 0.0
+
+    array = objects2boxarray(sample_objects())
+    before = array.corner_points().copy()
+    array.translate([0.0, 0.0, 2.0])
+    assert np.allclose(array.corner_points(), before + [0.0, 0.0, 2.0])
+
+
+def test_points_in_boxes_matches_points_in_box():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-6, 6, (3, 5000))
+    points[:, :10] = np.nan  # Missing returns
+    array = objects2boxarray(sample_objects())
+    index = PointCloudIndex(points)
+
+    expected = [np.flatnonzero(points_in_box(box, points)) for box in array.to_boxes()]
+    for result, indices in zip(points_in_boxes(array, index), expected):
+        assert np.array_equal(result, indices)
+    labels = points_box_labels(array, index)
+    for i, indices in enumerate(expected):
+        assert np.all(labels[indices] <= i) and np.all(labels[indices] >= 0)
+    assert np.count_nonzero(labels >= 0) == len(np.unique(np.concatenate(expected)))
+    assert points_in_boxes([], index) == []
@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import queue
+import threading
+import time
+
+import fusion
+import host
+from calibration import MUSEUM_CALIBRATION
+from conftest import make_payload
+from fake_kinesis import FakeKinesisClient
+from host import SiteConfig, _SiteRunner, load_sites
+from kinesis_stream import KinesisStream
+from replay import StreamRecorder, recording_path
+from sync import SyncConfig
+
+
+class HangingPipeline:
+    # Ignores stop(), like a pipeline stuck on a source.
+    def __init__(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    async def run(self):
+        await asyncio.sleep(3600)
+
+
+def test_stop_cancels_a_site_that_does_not_drain(monkeypatch):
+    monkeypatch.setattr(host, 'STOP_TIMEOUT_S', 0.05)
+
+    async def scenario():
+        runner = _SiteRunner.__new__(_SiteRunner)
+        runner.site = SiteConfig('stuck', {'streams': ['a']})
+        runner.pipeline = HangingPipeline()
+        runner.task = asyncio.ensure_future(runner.pipeline.run())
+        runner.state = 'running'
+        runner.stop()
+        await runner.wait_stopped()
+        return runner
+
+    runner = asyncio.run(scenario())
+    assert runner.pipeline.stopped
+    assert runner.task.cancelled()
+
+
+def test_load_sites_rejects_duplicate_names(tmp_path):
+    path = tmp_path / 'sites.json'
+    path.write_text('{"sites": [{"name": "a", "sync": {"streams": ["x"]}}, {"name": "a", "sync": {"streams": ["y"]}}]}')
+    try:
+        load_sites(str(path))
+    except ValueError as err:
+        assert 'not unique' in str(err)
+    else:
+        raise AssertionError("duplicate site names were accepted")
+
+
+def test_sites_get_their_calibration_file():
+    streams = {'streams': ['museum-outsight-1', 'museum-outsight-2']}
+    site = SiteConfig('museum', streams)
+    assert site.sync['calibration_file'] == MUSEUM_CALIBRATION
+    assert list(SyncConfig.from_dict(site.sync).calibration_dict()) == ['cache1']
+
+    assert 'calibration_file' not in SiteConfig('elsewhere', {'streams': ['a']}).sync
+    overridden = SiteConfig('museum', dict(streams, calibration_file='site.json'), calibration_file='other.json')
+    assert overridden.sync['calibration_file'] == 'site.json'
+
+
+def test_a_site_with_an_unknown_stream_fails_alone(tmp_path, monkeypatch):
+    monkeypatch.setattr(host, 'HEALTH_INTERVAL_S', 0.01)
+    monkeypatch.setattr(fusion, 'KinesisStream', functools.partial(KinesisStream, kinesis_client=FakeKinesisClient()))
+    for name in ('good-a', 'good-b'):
+        recorder = StreamRecorder(recording_path(str(tmp_path), name))
+        for frame_count in range(20):
+            recorder.write([{'SequenceNumber': str(frame_count), 'Data': make_payload(frame_count)}],
+                           arrival=1714564800 + frame_count / 10)
+        recorder.close()
+    good = SiteConfig('good', {'streams': ['good-a', 'good-b']}, output=str(tmp_path / 'good.jsonl'),
+                      replay_dir=str(tmp_path), replay_speed=0)
+    bad = SiteConfig('bad', {'streams': ['no-such-stream']}, output=str(tmp_path / 'bad.jsonl'),
+                     checkpoint_path=str(tmp_path / 'bad.checkpoints.json'))
+    commands = queue.Queue()
+    health = {}
+
+    def drive():
+        commands.put(('start', good))
+        commands.put(('start', bad))
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and health.get('good', {}).get('state') != 'stopped':
+            time.sleep(0.01)
+        commands.put(('shutdown', None))
+
+    driver = threading.Thread(target=drive)
+    driver.start()
+    asyncio.run(host._serve(0, commands, health))
+    driver.join()
+
+    assert health['bad']['state'] == 'failed'
+    assert 'no-such-stream' in health['bad']['error']
+    assert health['good']['state'] == 'stopped'
+    assert health['good']['error'] is None
+    assert health['good']['synced'] == 20
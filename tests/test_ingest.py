@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+import pytest
+
+from conftest import make_frame, wait_until
+from ingest import StreamIngestor
+from sync import Cache
+
+MS = 1_000_000
+
+
+def frames(first, count):
+    return [make_frame((first + k) * 100 * MS, frame_count=first + k) for k in range(count)]
+
+
+def frame_counts(cache):
+    return [entry['frame_Count'] for entry in cache.get_all()]
+
+
+def run_ingestor(ingestor):
+    asyncio.run(asyncio.wait_for(ingestor.run(), 5))
+
+
+@pytest.mark.parametrize('overflow, kept', [('drop_newest', [0, 1]), ('drop_oldest', [3, 4])])
+def test_drop_policies_count_the_frames_they_drop(overflow, kept):
+    # The whole batch is queued before the consumer runs, so three frames do not fit.
+    cache = Cache()
+    ingestor = StreamIngestor(iter([frames(0, 5)]), cache, max_queue=2, overflow=overflow, parse=list)
+    run_ingestor(ingestor)
+
+    assert frame_counts(cache) == kept
+    assert ingestor.stats[f'dropped_{overflow[5:]}'] == 3
+    assert (ingestor.stats['frames'], ingestor.stats['consumed']) == (5, 2)
+
+
+def test_block_policy_keeps_every_frame():
+    cache = Cache()
+    ingestor = StreamIngestor(iter([frames(0, 5)]), cache, max_queue=2, overflow='block', parse=list)
+    run_ingestor(ingestor)
+
+    assert frame_counts(cache) == [0, 1, 2, 3, 4]
+    assert ingestor.stats['blocked'] > 0
+    assert ingestor.stats['dropped_oldest'] == ingestor.stats['dropped_newest'] == 0
+
+
+def test_next_batch_is_fetched_while_one_is_parsed():
+    fetching = [threading.Event() for _ in range(3)]
+    prefetched = []
+
+    def generator():
+        for k in range(3):
+            fetching[k].set()
+            yield frames(2 * k, 2)
+
+    def parse(records):
+        k = records[0]['frame_Count'] // 2
+        if k < 2:
+            prefetched.append(fetching[k + 1].wait(5))
+        return records
+
+    cache = Cache()
+    ingestor = StreamIngestor(generator(), cache, parse=parse)
+    run_ingestor(ingestor)
+
+    assert prefetched == [True, True]
+    assert frame_counts(cache) == list(range(6))
+    assert ingestor.stats['batches'] == 3
+
+
+def test_stop_while_a_batch_is_parsed_is_not_lost_to_drop_oldest():
+    ingestor = None
+
+    def parse(records):
+        if records[0]['frame_Count'] == 2:
+            ingestor.stop()  # Arrives while a batch larger than the queue is being queued
+        return records
+
+    cache = Cache()
+    ingestor = StreamIngestor(iter([frames(0, 2), frames(2, 10)]), cache, max_queue=2, overflow='drop_oldest',
+                              parse=parse)
+    run_ingestor(ingestor)
+
+    assert frame_counts(cache) == [0, 1]
+    assert ingestor.stats['dropped_oldest'] == 0
+
+
+def test_full_cache_holds_frames_back_until_stop():
+    cache = Cache()
+    ingestor = StreamIngestor(iter([frames(0, 6)]), cache, max_queue=2, max_cache_entries=2, parse=list)
+
+    async def main():
+        task = asyncio.ensure_future(ingestor.run())
+        await wait_until(lambda: len(cache) == 2 and ingestor.queue.full())
+        # Taking an entry out of the cache lets the next frame in.
+        cache.pop_first()
+        await wait_until(lambda: ingestor.stats['consumed'] == 3)
+        assert len(cache) == 2
+        ingestor.stop()
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(main())
+    assert ingestor.stats['blocked'] > 0
+    assert ingestor.stats['consumed'] < 6
@@ -0,0 +1,44 @@
+import numpy as np
+
+from conftest import make_frame, make_object
+from utils import interpolate_frame, interpolate_objects, parse_timestamp_ns
+
+MS = 1_000_000
+START_NS = parse_timestamp_ns('2024-06-17 16:23:26.800000')
+
+
+def test_bearings_stay_in_the_sensor_range_across_the_wrap():
+    objects0 = [make_object(1, bearing_degrees=170.0), make_object(2, bearing_degrees=-10.0)]
+    objects1 = [make_object(1, bearing_degrees=-170.0), make_object(2, bearing_degrees=10.0)]
+    bearings = [obj['bearing_degrees'] for obj in interpolate_objects(objects0, objects1, 0.75)]
+    np.testing.assert_allclose(bearings, [-175.0, 5.0])
+    bearings = [obj['bearing_degrees'] for obj in interpolate_objects(objects0, objects1, 0.25)]
+    np.testing.assert_allclose(bearings, [175.0, -5.0])
+
+
+def test_positions_are_interpolated_by_obj_id():
+    objects0 = [make_object(1, position=(0.0, 0.0, 0.0)), make_object(2)]
+    objects1 = [make_object(3), make_object(1, position=(2.0, 4.0, 0.0))]
+    objects = interpolate_objects(objects0, objects1, 0.25)
+    assert [obj['obj_id'] for obj in objects] == [1, 2]
+    assert (objects[0]['pos_x'], objects[0]['pos_y']) == (0.5, 1.0)
+
+
+def test_interpolated_frame_times_agree_with_the_tick():
+    frame0 = make_frame(START_NS, frame_count=10)
+    frame1 = make_frame(START_NS + 100 * MS, frame_count=11)
+    # As at the museum: formatted_time is local time (UTC+1), time_s is epoch time.
+    frame0.update(formatted_time='2024-06-17 16:23:26.800000', time_s='1718637806.80')
+    frame1.update(formatted_time='2024-06-17 16:23:26.900000', time_s='1718637806.90')
+    for frame, sequence in ((frame0, '10'), (frame1, '11')):
+        frame.update(shard_id='shardId-0', sequence_number=sequence)
+    tick = START_NS + 70 * MS
+    frame = interpolate_frame(frame0, frame1, tick)
+
+    assert frame['frame_Count'] == 11
+    assert frame['timestamp_ns'] == tick
+    assert frame['formatted_time'] == '2024-06-17 16:23:26.870000'
+    assert parse_timestamp_ns(frame['formatted_time']) == tick
+    assert frame['time_s'] == '1718637806.870000'
+    assert frame['interpolated_from_ns'] == [START_NS, START_NS + 100 * MS]
+    assert frame['sequence_number'] == '10'
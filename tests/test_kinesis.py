@@ -0,0 +1,157 @@
+import threading
+
+from aggregation import aggregate, deaggregate_records, unpack
+from checkpoint import CheckpointStore
+from conftest import make_payload
+from fake_kinesis import FakeKinesisClient
+from kinesis_stream import KinesisProducer, KinesisStream
+from utils import records_to_frames
+
+
+def read_frames(stream, polls=3, **kwargs):
+    records = stream.get_records_iter(shard_iter_type='TRIM_HORIZON', limit=1000, poll_interval=0, **kwargs)
+    return [frame for _ in range(polls) for frame in records_to_frames(next(records), stats=None)]
+
+
+def test_producer_flushes_keep_the_put_order():
+    stream = KinesisStream('ordered', kinesis_client=FakeKinesisClient())
+    producer = KinesisProducer(stream, max_count=7, linger_ms=1)
+    threads = [threading.Thread(target=lambda: [producer.flush() for _ in range(200)]) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for frame_count in range(300):
+        producer.put(make_payload(frame_count))
+    for thread in threads:
+        thread.join()
+    producer.close()
+
+    frames = read_frames(stream, polls=1)
+    assert [frame['frame_Count'] for frame in frames] == list(range(300))
+    assert producer.stats['payloads'] == 300
+    assert producer.stats['records'] == 300
+    assert producer.stats['requests'] == stream.kinesis_client.calls['PutRecords']
+
+
+def test_checkpoint_inside_an_aggregated_record_resumes_at_the_next_frame(tmp_path):
+    stream = KinesisStream('aggregated', kinesis_client=FakeKinesisClient())
+    producer = KinesisProducer(stream, linger_ms=10000, aggregate=True)
+    for frame_count in range(10):
+        producer.put(make_payload(frame_count))
+    producer.close()
+
+    frames = read_frames(stream, polls=1)
+    assert [frame['sub_sequence_number'] for frame in frames] == list(range(10))
+    assert len({frame['sequence_number'] for frame in frames}) == 1
+
+    path = str(tmp_path / 'checkpoints.json')
+    store = CheckpointStore(path)
+    for frame in frames[:4]:
+        store.update(stream.name, frame['shard_id'], frame['sequence_number'], frame['sub_sequence_number'])
+    store.update(stream.name, frame['shard_id'], frame['sequence_number'], 1)  # Older, ignored
+    store.flush()
+
+    resumed = read_frames(stream, polls=2, checkpoint_store=CheckpointStore(path))
+    assert [frame['frame_Count'] for frame in resumed] == list(range(4, 10))
+
+    # Once the whole aggregate is processed, nothing is read again.
+    for frame in resumed:
+        store.update(stream.name, frame['shard_id'], frame['sequence_number'], frame['sub_sequence_number'])
+    store.flush()
+    assert read_frames(stream, polls=2, checkpoint_store=CheckpointStore(path)) == []
+
+
+def test_plain_checkpoints_resume_after_the_record(tmp_path):
+    stream = KinesisStream('plain', kinesis_client=FakeKinesisClient())
+    for frame_count in range(5):
+        stream.kinesis_client.put_record(StreamName=stream.name, Data=make_payload(frame_count), PartitionKey='a')
+    frames = read_frames(stream, polls=1)
+    assert 'sub_sequence_number' not in frames[0]
+
+    path = str(tmp_path / 'checkpoints.json')
+    store = CheckpointStore(path)
+    store.update(stream.name, frames[2]['shard_id'], frames[2]['sequence_number'])
+    store.flush()
+    resumed = read_frames(stream, polls=1, checkpoint_store=CheckpointStore(path))
+    assert [frame['frame_Count'] for frame in resumed] == [3, 4]
+
+
+def put_frames(stream, frame_counts, partition_key):
+    for frame_count in frame_counts:
+        stream.kinesis_client.put_record(StreamName=stream.name, Data=make_payload(frame_count),
+                                         PartitionKey=partition_key)
+
+
+def test_reading_follows_splits_and_merges():
+    client = FakeKinesisClient()
+    stream = KinesisStream('resharded', kinesis_client=client)
+    records = stream.get_records_iter(shard_iter_type='TRIM_HORIZON', limit=1000, poll_interval=0)
+    put_frames(stream, range(0, 5), 'a')
+    first = records_to_frames(next(records), stats=None)
+
+    client.split_shard(StreamName=stream.name, ShardToSplit='shardId-000000000000',
+                       NewStartingHashKey=str(2 ** 127))
+    put_frames(stream, range(5, 10), 'a')
+    put_frames(stream, range(10, 15), 'b')
+    client.merge_shards(StreamName=stream.name, ShardToMerge='shardId-000000000001',
+                        AdjacentShardToMerge='shardId-000000000002')
+    put_frames(stream, range(15, 20), 'a')
+
+    frames = first + [frame for _ in range(5) for frame in records_to_frames(next(records), stats=None)]
+    assert sorted(frame['frame_Count'] for frame in frames) == list(range(20))
+    shards = {frame['frame_Count']: frame['shard_id'] for frame in frames}
+    assert shards[0] == 'shardId-000000000000'
+    assert shards[19] == 'shardId-000000000003'
+    # Each partition key keeps its order across the split and the merge.
+    for key_frames in (list(range(0, 10)) + list(range(15, 20)), list(range(10, 15))):
+        order = [frame['frame_Count'] for frame in frames if frame['frame_Count'] in key_frames]
+        assert order == key_frames
+
+
+def test_children_of_a_resumed_shard_wait_until_it_is_drained(tmp_path):
+    client = FakeKinesisClient()
+    stream = KinesisStream('resumed', kinesis_client=client)
+    put_frames(stream, range(0, 6), 'a')
+    client.split_shard(StreamName=stream.name, ShardToSplit='shardId-000000000000',
+                       NewStartingHashKey=str(2 ** 127))
+    put_frames(stream, range(6, 10), 'a')
+
+    frames = read_frames(stream, polls=3)
+    assert [frame['frame_Count'] for frame in frames] == list(range(10))
+    path = str(tmp_path / 'checkpoints.json')
+    store = CheckpointStore(path)
+    store.update(stream.name, frames[3]['shard_id'], frames[3]['sequence_number'])
+    store.flush()
+
+    resumed = read_frames(stream, polls=3, checkpoint_store=CheckpointStore(path))
+    assert [frame['frame_Count'] for frame in resumed] == list(range(4, 10))
+
+
+def test_aggregated_records_round_trip_per_partition_key():
+    stream = KinesisStream('packed', kinesis_client=FakeKinesisClient())
+    payloads = [(make_payload(frame_count), 'ab'[frame_count % 2]) for frame_count in range(40)]
+    size = max(len(data) for data, _ in payloads)
+    producer = KinesisProducer(stream, linger_ms=10000, aggregate=True, max_aggregate_bytes=5 * (size + 4))
+    for data, key in payloads:
+        producer.put(data, partition_key=key)
+    producer.close()
+    assert producer.stats['payloads'] == 40
+    assert producer.stats['records'] == 8  # 20 payloads per key, at most 5 per aggregated record
+
+    raw = next(stream.get_records_iter(shard_iter_type='TRIM_HORIZON', limit=1000, poll_interval=0,
+                                       deaggregate=False))
+    assert len(raw) == 8
+    frames = read_frames(stream, polls=1)
+    for key in 'ab':
+        assert [frame['frame_Count'] for frame in frames if frame['frame_Count'] % 2 == 'ab'.index(key)] == \
+               list(range('ab'.index(key), 40, 2))
+    assert [record['Data'] for record in deaggregate_records(raw)] == \
+           [data for key in 'ab' for data, payload_key in payloads if payload_key == key]
+
+
+def test_plain_records_pass_through_deaggregation():
+    records = [{'Data': make_payload(0), 'SequenceNumber': '1'}, {'Data': aggregate([b'x', b'yz']),
+                                                                 'SequenceNumber': '2'}]
+    expanded = deaggregate_records(records)
+    assert [record['Data'] for record in expanded] == [make_payload(0), b'x', b'yz']
+    assert [record.get('SubSequenceNumber') for record in expanded] == [None, 0, 1]
+    assert unpack(aggregate([])) == []
@@ -0,0 +1,50 @@
+import pytest
+
+from conftest import make_object, make_payload
+from parse_pool import ParsePool
+from utils import OBJECT_CLASSES, objects_to_dicts, records_to_frames
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = ParsePool(1)
+    yield pool
+    pool.close()
+
+
+def make_batch(first, n, object_class='PERSON'):
+    return [{'Data': make_payload(i, [make_object(i, object_class=object_class, frame_count=i),
+                                      make_object(i + 1000, frame_count=i)]),
+             'SequenceNumber': str(i), 'ShardId': 'shardId-000000000000'} for i in range(first, first + n)]
+
+
+def test_pool_frames_match_in_process_decoding(pool):
+    batches = [make_batch(0, 20), make_batch(20, 20, object_class='FORKLIFT'), make_batch(40, 20)]
+    futures = [pool.submit(batch) for batch in batches]  # More batches in flight than workers
+    for batch, future in zip(batches, futures):
+        frames = future.result()
+        expected = records_to_frames(batch, columnar=True, stats=None)
+        assert [frame['frame_Count'] for frame in frames] == [frame['frame_Count'] for frame in expected]
+        assert [frame['sequence_number'] for frame in frames] == [record['SequenceNumber'] for record in batch]
+        for frame, reference in zip(frames, expected):
+            assert objects_to_dicts(frame['objects']) == objects_to_dicts(reference['objects'])
+    # Blocks are reused, and the frames keep their own copy of the objects.
+    assert len(pool._blocks) <= len(batches)
+    assert pool.parse(make_batch(60, 5))[0]['frame_Count'] == 60
+    assert frames[0]['objects']['obj_id'].tolist() == [40, 1040]
+
+
+def test_batches_larger_than_a_block_are_returned_whole():
+    pool = ParsePool(1, block_objects=4)
+    try:
+        frames = pool.parse(make_batch(0, 10))
+        assert [frame['objects']['obj_id'].tolist() for frame in frames[:2]] == [[0, 1000], [1, 1001]]
+        assert [frame['objects']['obj_id'].tolist() for frame in pool.parse(make_batch(10, 2))] == [[10, 1010],
+                                                                                                  [11, 1011]]
+    finally:
+        pool.close()
+
+
+def test_class_codes_are_the_same_in_the_workers(pool):
+    frames = pool.parse(make_batch(0, 3, object_class='TRUCK') + make_batch(3, 1, object_class='HOVERBOARD'))
+    assert [frame['objects']['class_code'][0] for frame in frames] == [OBJECT_CLASSES.index('TRUCK')] * 3 + [0]
@@ -0,0 +1,52 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from conftest import make_payload
+from replay import ReplayClock, ReplayStream, StreamRecorder, read_recording
+
+START = 1714564800.0
+
+
+def write_recording(path, arrivals):
+    recorder = StreamRecorder(str(path))
+    for i, arrival in enumerate(arrivals):
+        recorder.write([{'SequenceNumber': str(i), 'ShardId': 'shardId-000000000000', 'PartitionKey': 'a',
+                         'ApproximateArrivalTimestamp': datetime.fromtimestamp(arrival, timezone.utc),
+                         'Data': make_payload(i)}], arrival=arrival)
+    recorder.close()
+    return str(path)
+
+
+def test_recordings_read_back_record_by_record(tmp_path):
+    path = write_recording(tmp_path / 'a.rec', [START, START + 0.1, START + 0.1])
+    entries = list(read_recording(path))
+    assert [arrival for arrival, _ in entries] == [START, START + 0.1, START + 0.1]
+    assert [record['Data'] for _, record in entries] == [make_payload(i) for i in range(3)]
+    assert entries[1][1]['ShardId'] == 'shardId-000000000000'
+    assert [len(records) for records in ReplayStream(path).get_records_iter(speed=0)] == [1, 2]
+
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 10)  # Torn write at the end of the file
+    assert len(list(read_recording(path))) == 3
+
+
+def test_streams_of_a_run_share_one_time_origin(tmp_path):
+    # Stream b was recorded starting 2 s after stream a; replayed 20x faster, its
+    # first batch is due 100 ms after a's, not at the same time.
+    paths = [write_recording(tmp_path / 'a.rec', [START + 0.1 * i for i in range(3)]),
+             write_recording(tmp_path / 'b.rec', [START + 2.0 + 0.1 * i for i in range(3)])]
+    clock = ReplayClock.from_recordings(paths, speed=20)
+    first_batch = {}
+
+    def consume(path):
+        for records in ReplayStream(path).get_records_iter(clock=clock):
+            first_batch.setdefault(path, time.monotonic())
+
+    threads = [threading.Thread(target=consume, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert clock.start_arrival == START
+    assert 0.08 < first_batch[paths[1]] - first_batch[paths[0]] < 0.2
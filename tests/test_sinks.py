@@ -0,0 +1,87 @@
+import threading
+
+import numpy as np
+
+from conftest import make_frame, make_object
+from sinks import BinarySink, JsonLinesSink, read_binary_synced, read_jsonl_synced, segment_paths
+from utils import OBJECT_CLASSES
+
+
+def synced_entries(n):
+    classes = ['PERSON', 'CAR', 'TRUCK']
+    return [{'cache0': make_frame(i * 100, [make_object(i, classes[i % 3], frame_count=i)], frame_count=i),
+             'cache1': make_frame(i * 100 + 5, [make_object(i + 1000, classes[(i + 1) % 3])], frame_count=i),
+             'missing': []}
+            for i in range(n)]
+
+
+def test_binary_sink_round_trip_across_rotations(tmp_path):
+    path = str(tmp_path / 'synced.bin')
+    entries = synced_entries(20)
+    sink = BinarySink(path, rotate_bytes=600)
+    for entry in entries:
+        assert sink.write(entry)
+    sink.close()
+
+    assert len(segment_paths(path)) > 1
+    read = list(read_binary_synced(path))
+    assert len(read) == len(entries)
+    for expected, entry in zip(entries, read):
+        for key in ('cache0', 'cache1'):
+            objects = entry[key]['objects']
+            assert objects['obj_id'].tolist() == [obj['obj_id'] for obj in expected[key]['objects']]
+            assert [OBJECT_CLASSES[code] for code in objects['class_code']] == \
+                   [obj['object_class'] for obj in expected[key]['objects']]
+            assert entry[key]['timestamp_ns'] == expected[key]['timestamp_ns']
+
+
+def test_jsonl_sink_round_trip_across_rotations(tmp_path):
+    path = str(tmp_path / 'synced.jsonl')
+    entries = synced_entries(20)
+    sink = JsonLinesSink(path, rotate_bytes=1000)
+    for entry in entries:
+        sink.write(entry)
+    sink.close()
+
+    assert len(segment_paths(path)) > 1
+    assert list(read_jsonl_synced(path)) == entries
+    assert sink.stats['written'] == len(entries)
+
+
+def test_sink_without_rotation_writes_one_file(tmp_path):
+    path = str(tmp_path / 'synced.bin')
+    sink = BinarySink(path)
+    for entry in synced_entries(3):
+        sink.write(entry)
+    sink.close()
+    sink.close()  # Idempotent
+
+    assert sink.paths == [path]
+    read = list(read_binary_synced(path))
+    assert np.array_equal(read[2]['cache0']['objects']['obj_id'], [2])
+
+
+def test_sink_acknowledges_only_flushed_entries(tmp_path):
+    path = str(tmp_path / 'synced.jsonl')
+    entries = synced_entries(5)
+    flushing, release = threading.Event(), threading.Event()
+    flushed = []
+
+    def on_flushed(batch):
+        # The entries are on disk by the time they are acknowledged.
+        assert len(list(read_jsonl_synced(path))) == len(flushed) + len(batch)
+        flushed.extend(batch)
+        flushing.set()
+        release.wait(5)
+
+    sink = JsonLinesSink(path, flush_bytes=1, max_queue=1, on_flushed=on_flushed)
+    assert sink.write(entries[0])
+    assert flushing.wait(5)
+    # The writer thread is busy: one entry fits in the queue, the rest are dropped.
+    accepted = [entry for entry in entries[1:] if sink.write(entry)]
+    release.set()
+    sink.close()
+
+    assert accepted == entries[1:2]
+    assert sink.stats['dropped'] == 3
+    assert flushed == entries[:2]
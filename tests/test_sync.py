@@ -0,0 +1,285 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+import sync
+from clock_offset import ClockOffsetEstimator
+from conftest import make_frame, wait_until
+from sync import Cache, SyncConfig, SynchronizationManager
+
+MS = 1_000_000
+
+
+def filled_caches(n_caches, seed=0):
+    # Frames at ~50 ms with jitter and a per-stream phase; some caches stay empty.
+    rng = np.random.default_rng(seed)
+    caches = []
+    for i in range(n_caches):
+        cache = Cache()
+        if i % 5 != 4:
+            start = int(rng.integers(0, 50)) * MS
+            for k in range(40):
+                cache.add(make_frame(start + k * 50 * MS + int(rng.integers(-3, 4)) * MS, frame_count=k))
+        caches.append(cache)
+    return caches
+
+
+@pytest.mark.parametrize('n_caches', [3, 20])
+def test_both_match_paths_take_the_same_frames(monkeypatch, n_caches):
+    ticks = [500 * MS + k * 50 * MS for k in range(30)]
+    results = []
+    for min_caches in (1, 10 ** 6):
+        monkeypatch.setattr(sync, 'VECTORIZED_MATCH_MIN_CACHES', min_caches)
+        caches = filled_caches(n_caches)
+        manager = SynchronizationManager(None, caches, clock_hz=20, tolerance_s=0.02, verbose=False)
+        matched = [[None if entry is None else entry['timestamp_ns'] for entry in manager.process_entries(tick)]
+                   for tick in ticks]
+        results.append((matched, manager.stats['unmatched'], [len(cache) for cache in caches]))
+    assert results[0] == results[1]
+    assert any(timestamp is not None for row in results[0][0] for timestamp in row)
+
+
+def test_clock_corrections_stay_well_inside_the_tolerance():
+    config = SyncConfig(['a', {'name': 'b', 'tolerance_s': 0.08}], tolerance_s=0.2, correct_clock_offsets=True,
+                        clock_offset_window_s=1.0)
+    assert config.max_clock_offset_s == pytest.approx(0.02)
+    caches = [Cache(), Cache()]
+    manager = SynchronizationManager.from_config(config, caches, verbose=False)
+    # Stream b's clock runs 500 ms behind stream a's.
+    for k in range(50):
+        sensor_ns = k * 100 * MS
+        manager.observe_frame(0, {'timestamp_ns': sensor_ns, 'arrival_ns': sensor_ns + 30 * MS})
+        manager.observe_frame(1, {'timestamp_ns': sensor_ns - 500 * MS, 'arrival_ns': sensor_ns + 30 * MS})
+    manager.update_offsets(5000 * MS)
+    assert manager._offsets.tolist() == [0, 20 * MS]
+
+
+def test_clock_ticks_take_the_frames_nearest_them():
+    caches = [Cache(), Cache()]
+    for cache in caches:
+        for k in range(7):
+            cache.add(make_frame(1000 * MS + k * 50 * MS, frame_count=k))
+    manager = SynchronizationManager(None, caches, clock_hz=10, verbose=False)
+
+    async def ticks():
+        return [(await manager.next_tick())[0] for _ in range(4)]
+
+    tick_times = asyncio.run(ticks())
+    assert tick_times == [1000 * MS, 1100 * MS, 1200 * MS, 1300 * MS]
+    matched = [[entry['timestamp_ns'] for entry in manager.process_entries(tick)] for tick in tick_times]
+    assert matched == [[tick, tick] for tick in tick_times]
+
+
+def test_clock_tick_leaves_a_frame_closer_to_the_next_tick():
+    cache = Cache()
+    cache.add(make_frame(1070 * MS))
+    manager = SynchronizationManager(None, [cache], clock_hz=10, verbose=False)
+    assert manager.process_entries(1000 * MS) == [None]
+    assert manager.process_entries(1100 * MS)[0]['timestamp_ns'] == 1070 * MS
+
+
+def test_clock_offsets_are_reported_but_not_applied_by_default():
+    caches = [Cache(), Cache()]
+    manager = SynchronizationManager.from_config(SyncConfig(['a', 'b'], clock_offset_window_s=1.0), caches,
+                                                 verbose=False)
+    for k in range(50):
+        sensor_ns = k * 100 * MS
+        manager.observe_frame(0, {'timestamp_ns': sensor_ns, 'arrival_ns': sensor_ns + 30 * MS})
+        manager.observe_frame(1, {'timestamp_ns': sensor_ns - 10 * MS, 'arrival_ns': sensor_ns + 30 * MS})
+    manager.update_offsets(5000 * MS)
+    assert manager._offsets.tolist() == [0, 0]
+    assert manager.metrics()['clock']['offset_ms'] == {'cache0': 0.0, 'cache1': 10.0}
+
+
+def test_clock_offset_estimate_starts_over_after_a_backward_clock_jump():
+    estimator = ClockOffsetEstimator(2, window_s=1.0, max_offset_s=10.0)
+    for k in range(100):
+        arrival_ns = k * 100 * MS + 30 * MS
+        # Stream 1's clock is stepped back by 5 s halfway through.
+        sensor_ns = k * 100 * MS - (5000 * MS if k >= 50 else 0)
+        estimator.observe(0, k * 100 * MS, arrival_ns)
+        estimator.observe(1, sensor_ns, arrival_ns)
+    assert estimator.samples == [100, 100]
+    assert estimator.resets == [0, 1]
+    assert estimator.offset_ns(1, 9900 * MS) == pytest.approx(5000 * MS, abs=MS)
+
+
+def test_add_reports_staged_frames_rejected_on_release():
+    cache = Cache(capacity=2, policy='reject_newest', reorder_window_s=0.1)
+    assert cache.add(make_frame(0))
+    assert cache.add(make_frame(50 * MS))
+    assert cache.add(make_frame(150 * MS))  # Releases 0 and 50 ms into the ring
+    assert not cache.add(make_frame(300 * MS))  # Releases 150 ms, but the ring is full
+    assert cache.metrics()['rejected'] == 1
+    assert cache.flush_reorder() == 0
+    assert [cache.timestamp_at(i) for i in range(len(cache))] == [0, 50 * MS]
+
+
+def test_redelivered_frames_are_rejected_as_duplicates():
+    def frame(ms, sequence):
+        return dict(make_frame(ms * MS), shard_id='shardId-0', sequence_number=str(sequence))
+
+    cache = Cache(reorder_window_s=0.1)
+    assert cache.add(frame(0, 10))
+    assert cache.add(frame(50, 11))
+    assert not cache.add(frame(50, 11))  # Staged
+    assert cache.add(frame(150, 12))  # Releases 0 and 50 ms
+    assert not cache.add(frame(50, 11))  # Released
+    assert cache.pop_first()['sequence_number'] == '10'
+    assert not cache.add(frame(0, 10))  # Already consumed
+    assert not cache.add(dict(make_frame(150 * MS), frame_Count=1))  # Staged, read from elsewhere
+    assert cache.flush_reorder() == 1
+    assert not cache.add(frame(150, 12))
+    metrics = cache.metrics()
+    assert (metrics['duplicates'], metrics['late'], metrics['size']) == (5, 0, 2)
+
+
+def test_slice_left_counts_the_entries_it_skips():
+    cache = Cache()
+    for k in range(5):
+        cache.add(make_frame(k * 50 * MS, frame_count=k))
+    assert [entry['frame_Count'] for entry in cache.slice_left(2)] == [0, 1, 2]
+    cache.pop_first()
+    metrics = cache.metrics()
+    assert (metrics['consumed'], metrics['skipped'], metrics['size']) == (2, 2, 1)
+
+
+def test_timestamp_array_is_a_snapshot():
+    cache = Cache(capacity=3)
+    for k in range(3):
+        cache.add(make_frame(k * MS))
+    timestamps = cache.timestamp_array()
+    cache.pop_first()
+    cache.add(make_frame(10 * MS))  # Reuses the ring slot of the first entry
+    assert timestamps.tolist() == [0, MS, 2 * MS]
+    assert cache.timestamp_array().tolist() == [MS, 2 * MS, 10 * MS]
+
+
+def run_synchronization(manager, feed):
+    async def main():
+        task = asyncio.ensure_future(manager.start_synchronization())
+        await feed()
+        manager.stop()
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(main())
+
+
+def test_tick_is_emitted_with_missing_streams_after_max_delay():
+    base, partner = Cache(), Cache()
+    synced = []
+    manager = SynchronizationManager(base, [base, partner], on_synced=synced.append, max_delay_s=0.05,
+                                     tolerance_s=0.05, verbose=False)
+
+    async def feed():
+        base.add(make_frame(1000 * MS))
+        await wait_until(lambda: synced)
+
+    run_synchronization(manager, feed)
+    assert synced[0]['cache1'] is None
+    assert synced[0]['missing'] == ['cache1']
+    assert manager.stats['max_latency_s'] >= 0.05
+
+
+def test_frames_behind_the_watermark_are_counted_late_and_discarded():
+    base, partner = Cache(), Cache()
+    synced = []
+    manager = SynchronizationManager(base, [base, partner], on_synced=synced.append, max_delay_s=0.05,
+                                     tolerance_s=0.05, verbose=False)
+
+    async def feed():
+        base.add(make_frame(1000 * MS))
+        await wait_until(lambda: synced)
+        # Behind the watermark the emitted tick left: 1000 ms minus the 50 ms tolerance.
+        partner.add(make_frame(940 * MS))
+        partner.add(make_frame(1100 * MS))
+        base.add(make_frame(1100 * MS))
+        await wait_until(lambda: len(synced) == 2)
+
+    run_synchronization(manager, feed)
+    assert manager.stats['late'] == 1
+    assert synced[1]['cache1']['timestamp_ns'] == 1100 * MS
+    assert 'missing' not in synced[1]
+    assert len(partner) == 0
+
+
+def test_ticks_keep_coming_when_a_partner_stream_stops():
+    base, partner = Cache(), Cache()
+    synced = []
+    manager = SynchronizationManager(base, [base, partner], on_synced=synced.append, max_delay_s=0.02,
+                                     tolerance_s=0.05, verbose=False)
+
+    async def feed():
+        for k in range(2):
+            partner.add(make_frame(1000 * MS + k * 100 * MS))
+        for k in range(6):
+            base.add(make_frame(1000 * MS + k * 100 * MS))
+        await wait_until(lambda: len(synced) == 6)
+
+    run_synchronization(manager, feed)
+    assert [entry.get('missing', []) for entry in synced] == [[], []] + [['cache1']] * 4
+
+
+def test_waiters_wake_once_their_timestamp_is_added():
+    cache = Cache()
+    woken = []
+    thread = threading.Thread(target=lambda: woken.append(cache.wait_for_timestamp(100 * MS, timeout=5)))
+    thread.start()
+
+    async def main():
+        wait = asyncio.ensure_future(cache.wait_for_timestamp_async(100 * MS, timeout=5))
+        await asyncio.sleep(0.01)
+        # Frames are added from another thread, as the stream threads do.
+        adder = threading.Thread(target=cache.add, args=(make_frame(50 * MS),))
+        adder.start()
+        adder.join()
+        await asyncio.sleep(0.01)
+        assert not wait.done() and not woken
+        adder = threading.Thread(target=cache.add, args=(make_frame(100 * MS),))
+        adder.start()
+        adder.join()
+        return await wait
+
+    assert asyncio.run(main())
+    thread.join(5)
+    assert woken == [True]
+
+
+def test_interrupt_ends_waits_for_a_timestamp_not_yet_added():
+    cache = Cache()
+    cache.add(make_frame(0))
+    woken = []
+    thread = threading.Thread(target=lambda: woken.append(cache.wait_for_timestamp(100 * MS)))
+    thread.start()
+
+    async def main():
+        wait = asyncio.ensure_future(cache.wait_for_timestamp_async(100 * MS))
+        await asyncio.sleep(0.01)
+        cache.interrupt()
+        return await asyncio.wait_for(wait, 1)
+
+    assert asyncio.run(main()) is False
+    thread.join(5)
+    assert woken == [False]
+    assert cache.wait_for_timestamp(0, timeout=0)
+
+
+@pytest.mark.parametrize('clock_hz', [None, 10])
+def test_stop_interrupts_a_waiting_synchronization(clock_hz):
+    caches = [Cache(), Cache()]
+    base = None if clock_hz else caches[0]
+    manager = SynchronizationManager(base, caches, clock_hz=clock_hz, verbose=False)
+    if clock_hz:
+        caches[1].add(make_frame(0))  # The first tick then waits for the silent first stream
+
+    async def main():
+        task = asyncio.ensure_future(manager.start_synchronization())
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        manager.stop()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert manager.stats['synced'] == 0
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+from utils import frame_timestamp_ns, parse_timestamp_ns
+
+MUSEUM_FORMATTED_TIME = '2024-06-17 16:23:26.833684'  # Local time (UTC+1)
+MUSEUM_TIME_S = '1718637806.83'  # The same frame in epoch seconds
+
+
+def test_formatted_time_is_cut_to_whole_microseconds():
+    assert parse_timestamp_ns('2024-06-17 16:23:26.833684') % 1_000_000_000 == 833_684_000
+    assert parse_timestamp_ns('2024-06-17 16:23:26.8336849') == parse_timestamp_ns('2024-06-17 16:23:26.833684')
+    assert parse_timestamp_ns('2024-06-17 16:23:26') % 1000 == 0
+
+
+def test_time_s_is_parsed_without_float_rounding():
+    assert parse_timestamp_ns(time_s='1718637806.83') == 1_718_637_806_830_000_000
+    assert parse_timestamp_ns(time_s='1718637806.1234567891') == 1_718_637_806_123_456_789
+    assert parse_timestamp_ns(time_s=1718637806) == 1_718_637_806_000_000_000
+
+
+def test_time_s_is_the_fallback_for_a_missing_formatted_time():
+    for formatted_time in (None, ''):
+        assert parse_timestamp_ns(formatted_time, MUSEUM_TIME_S) == 1_718_637_806_830_000_000
+    assert frame_timestamp_ns({'time_s': MUSEUM_TIME_S}) == 1_718_637_806_830_000_000
+
+
+def test_naive_formatted_time_is_read_as_utc():
+    aware = '2024-06-17T15:23:26.833684+00:00'
+    assert parse_timestamp_ns('2024-06-17 15:23:26.833684') == parse_timestamp_ns(aware)
+    assert parse_timestamp_ns('2024-06-17T16:23:26.833684+01:00') == parse_timestamp_ns(aware)
+    local = datetime(2024, 6, 17, 16, 23, 26, 833684, tzinfo=timezone(timedelta(hours=1)))
+    assert parse_timestamp_ns(local) == parse_timestamp_ns(aware)
+
+
+def test_museum_local_formatted_time_wins_over_time_s():
+    # The museum sensors write local time without an offset; it is read as UTC, so
+    # the timestamp is an hour ahead of time_s. All streams share the offset, so
+    # matching is unaffected.
+    timestamp = parse_timestamp_ns(MUSEUM_FORMATTED_TIME, MUSEUM_TIME_S)
+    assert timestamp == parse_timestamp_ns(MUSEUM_FORMATTED_TIME)
+    assert timestamp - parse_timestamp_ns(time_s=MUSEUM_TIME_S) == 3600 * 1_000_000_000 + 3_684_000
+
+
+def test_frame_timestamp_prefers_the_stored_timestamp():
+    frame = {'formatted_time': MUSEUM_FORMATTED_TIME, 'time_s': MUSEUM_TIME_S}
+    assert frame_timestamp_ns(frame) == parse_timestamp_ns(MUSEUM_FORMATTED_TIME)
+    assert 'timestamp_ns' not in frame
+    assert frame_timestamp_ns(dict(frame, timestamp_ns=42)) == 42
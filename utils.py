@@ -1,32 +1,303 @@
-from datetime import datetime
+import time
+import logging
+from datetime import datetime, timedelta, timezone
 from pyquaternion import Quaternion
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
-from data_classes import Box
+from data_classes import Box, BoxArray
+from geometry_utils import matrices_to_quaternions, quaternions_to_matrices
+from aggregation import deaggregate_records
 from scipy.spatial.transform import Rotation as R
 import json
-def record_to_frame(record):
-    
-    if not record or len(record)==0:
-        return None
-    if 'Data' not in record[0]:
-        return None
-    
-    lines = record[0]['Data'].decode('utf-8').splitlines()
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def parse_timestamp_ns(formatted_time=None, time_s=None):
+    """
+    Parses a frame time into integer nanoseconds since the epoch. This is the one
+    timestamp the pipeline caches, sorts and compares frames by.
+
+    :param formatted_time: ISO time of the frame (microsecond precision). Naive times
+        are read as UTC so that all streams share one numeric time base.
+    :param time_s: Epoch seconds as a decimal string, used when there is no formatted_time.
+    """
+    if formatted_time:
+        if not isinstance(formatted_time, datetime):
+            formatted_time = datetime.fromisoformat(formatted_time)
+        if formatted_time.tzinfo is None:
+            formatted_time = formatted_time.replace(tzinfo=timezone.utc)
+        return (formatted_time - _EPOCH) // _MICROSECOND * 1000
+    seconds, _, fraction = str(time_s).partition('.')
+    return int(seconds) * 1_000_000_000 + int((fraction + '000000000')[:9])
+
+
+def frame_timestamp_ns(frame):
+    """
+    Timestamp of a frame in nanoseconds: the one stored by record_to_frame, or parsed
+    from the frame's time fields for frames built elsewhere (the frame is not modified).
+    """
+    timestamp = frame.get('timestamp_ns')
+    if timestamp is None:
+        timestamp = parse_timestamp_ns(frame.get('formatted_time'), frame.get('time_s'))
+    return timestamp
+
+
+def timestamp_ns_to_datetime(timestamp_ns):
+    return _EPOCH + timedelta(microseconds=timestamp_ns // 1000)
+
+
+# Columnar layout of the objects of a frame: one row per object, with the position
+# and dimensions stored as (N, 3) sub-arrays so they can be used without copies.
+OBJECT_DTYPE = np.dtype([
+    ('frame_count', np.int64),
+    ('obj_id', np.int64),
+    ('class_code', np.int16),
+    ('position', np.float64, (3,)),
+    ('dimensions', np.float64, (3,)),
+    ('speed_mph', np.float64),
+    ('bearing_degrees', np.float64),
+])
+OBJECT_FIELDS = 12  # Columns of an object line in an Outsight frame
+
+# Object class names by class code: the classes Outsight sensors report. The codes
+# are fixed, so they mean the same in every process and in every file written.
+OBJECT_CLASSES = ('UNKNOWN', 'PERSON', 'TROLLEY', 'BICYCLE', 'CAR', 'TRUCK')
+_OBJECT_CLASS_CODES = {name: code for code, name in enumerate(OBJECT_CLASSES)}
+_unlisted_classes = set()  # Names already warned about
+
+
+def object_class_code(name):
+    """
+    :return: Code of an object class name in OBJECT_CLASSES; names not listed there get
+        the code of 'UNKNOWN' (the object dicts of record_to_frame keep the name itself).
+    """
+    code = _OBJECT_CLASS_CODES.get(name)
+    if code is None:
+        if name not in _unlisted_classes:
+            _unlisted_classes.add(name)
+            logger.warning("Object class %r is not in OBJECT_CLASSES; stored as UNKNOWN.", name)
+        code = 0
+    return code
+
+
+# Object line as read by np.loadtxt (columns 1 to 11; column 0 is the record type).
+_OBJECT_LINE_DTYPE = np.dtype([
+    ('frame_count', np.int64),
+    ('obj_id', np.int64),
+    ('object_class', 'U32'),
+    ('position', np.float64, (3,)),
+    ('dimensions', np.float64, (3,)),
+    ('speed_mph', np.float64),
+    ('bearing_degrees', np.float64),
+])
+_SMALL_FRAME = 16  # Below this many objects per-line parsing beats np.loadtxt's set-up cost
+
+
+def parse_objects(lines):
+    """
+    Parses the object lines of a frame straight into an OBJECT_DTYPE array.
+
+    :param lines: Object lines of one frame (CSV, OBJECT_FIELDS columns each).
+    :return: <OBJECT_DTYPE: n>.
+    """
+    n = len(lines)
+    if n == 0:
+        return np.empty(0, dtype=OBJECT_DTYPE)
+
+    if n < _SMALL_FRAME:
+        rows = []
+        for line in lines:
+            fields = line.split(',')
+            rows.append((int(fields[1]), int(fields[2]), object_class_code(fields[3]),
+                         (float(fields[4]), float(fields[5]), float(fields[6])),
+                         (float(fields[7]), float(fields[8]), float(fields[9])),
+                         float(fields[10]), float(fields[11])))
+        return np.array(rows, dtype=OBJECT_DTYPE)
+
+    table = np.loadtxt(lines, delimiter=',', usecols=range(1, OBJECT_FIELDS), dtype=_OBJECT_LINE_DTYPE, ndmin=1)
+    objects = np.empty(n, dtype=OBJECT_DTYPE)
+    objects['frame_count'] = table['frame_count']
+    objects['obj_id'] = table['obj_id']
+    class_names, class_index = np.unique(table['object_class'], return_inverse=True)
+    objects['class_code'] = np.array([object_class_code(str(name)) for name in class_names],
+                                     dtype=np.int16)[class_index]
+    objects['position'] = table['position']
+    objects['dimensions'] = table['dimensions']
+    objects['speed_mph'] = table['speed_mph']
+    objects['bearing_degrees'] = table['bearing_degrees']
+    return objects
+
+
+def objects_to_array(objects):
+    """
+    Converts a list of object dicts (as produced by record_to_frame or loaded from JSON)
+    to an OBJECT_DTYPE array. Arrays are returned unchanged.
+    """
+    if isinstance(objects, np.ndarray):
+        return objects
+    array = np.empty(len(objects), dtype=OBJECT_DTYPE)
+    for i, obj in enumerate(objects):
+        array[i] = (obj['frame_count'], obj['obj_id'], object_class_code(obj['object_class']),
+                    (obj['pos_x'], obj['pos_y'], obj['pos_z']),
+                    (obj['dim_x'], obj['dim_y'], obj['dim_z']),
+                    obj['speed_mph'], obj['bearing_degrees'])
+    return array
+
+
+def objects_to_dicts(objects):
+    """
+    Converts an OBJECT_DTYPE array back to the object dicts of record_to_frame, e.g. for
+    JSON output. Lists of dicts are returned unchanged.
+    """
+    if not isinstance(objects, np.ndarray):
+        return objects
+    dicts = []
+    for frame_count, obj_id, class_code, position, dimensions, speed, bearing in objects.tolist():
+        dicts.append({
+            'frame_count': frame_count,
+            'obj_id': obj_id,
+            'object_class': OBJECT_CLASSES[class_code],
+            'pos_x': position[0],
+            'pos_y': position[1],
+            'pos_z': position[2],
+            'dim_x': dimensions[0],
+            'dim_y': dimensions[1],
+            'dim_z': dimensions[2],
+            'speed_mph': speed,
+            'bearing_degrees': bearing,
+        })
+    return dicts
+
+
+def interpolate_objects(objects0, objects1, alpha):
+    """
+    Moves the objects of two frames of the same sensor to an intermediate time.
+
+    Objects are matched by obj_id; matched ones get their position, speed and
+    bearing (along the shorter arc) interpolated linearly, or extrapolated when
+    alpha is outside [0, 1]. Every other field, and the objects seen in only one
+    frame, come from the frame nearest in time.
+
+    :param objects0: <OBJECT_DTYPE: n> or object dicts of the earlier frame.
+    :param objects1: <OBJECT_DTYPE: m> or object dicts of the later frame.
+    :param alpha: Position of the target time: 0 is frame 0, 1 is frame 1.
+    :return: <OBJECT_DTYPE: k>, or object dicts if the inputs were dicts.
+    """
+    as_dicts = not isinstance(objects0, np.ndarray)
+    objects0, objects1 = objects_to_array(objects0), objects_to_array(objects1)
+    nearest_is_1 = alpha >= 0.5
+    result = (objects1 if nearest_is_1 else objects0).copy()
+    _, index0, index1 = np.intersect1d(objects0['obj_id'], objects1['obj_id'], return_indices=True)
+    target = index1 if nearest_is_1 else index0
+
+    position0 = objects0['position'][index0]
+    result['position'][target] = position0 + alpha * (objects1['position'][index1] - position0)
+    speed0 = objects0['speed_mph'][index0]
+    result['speed_mph'][target] = speed0 + alpha * (objects1['speed_mph'][index1] - speed0)
+    bearing0 = objects0['bearing_degrees'][index0]
+    turn = (objects1['bearing_degrees'][index1] - bearing0 + 180.0) % 360.0 - 180.0
+    # Kept in the sensors' [-180, 180) range.
+    result['bearing_degrees'][target] = (bearing0 + alpha * turn + 180.0) % 360.0 - 180.0
+    return objects_to_dicts(result) if as_dicts else result
+
+
+def interpolate_frame(frame0, frame1, timestamp_ns):
+    """
+    Builds the frame a sensor would have produced at `timestamp_ns` from two of its
+    frames (see interpolate_objects). The header is the nearest frame's with its
+    times ('timestamp_ns', 'formatted_time', and 'time' and 'time_s' when present)
+    set to the target time. 'time_s' is the nearest frame's own epoch time shifted
+    by the same amount, as formatted_time may be the sensor's local time. The frame is marked with the source times under
+    'interpolated_from_ns'. Its stream position (shard and sequence numbers) is the
+    earlier frame's, so a checkpoint never passes a frame that is still cached.
+    """
+    time0, time1 = frame_timestamp_ns(frame0), frame_timestamp_ns(frame1)
+    alpha = (timestamp_ns - time0) / (time1 - time0)
+    nearest = frame1 if alpha >= 0.5 else frame0
+    frame = dict(nearest)
+    frame['objects'] = interpolate_objects(frame0['objects'], frame1['objects'], alpha)
+    frame['timestamp_ns'] = timestamp_ns
+    formatted_time = timestamp_ns_to_datetime(timestamp_ns).replace(tzinfo=None).isoformat(' ', 'microseconds')
+    frame['formatted_time'] = formatted_time
+    if 'time' in frame:
+        frame['time'] = formatted_time
+    if frame.get('time_s'):
+        time_s_ns = parse_timestamp_ns(time_s=frame['time_s']) + timestamp_ns - frame_timestamp_ns(nearest)
+        frame['time_s'] = f"{time_s_ns // 1_000_000_000}.{time_s_ns % 1_000_000_000 // 1000:06d}"
+    for key in ('shard_id', 'sequence_number', 'sub_sequence_number'):
+        frame.pop(key, None)
+        if key in frame0:
+            frame[key] = frame0[key]
+    frame['interpolated_from_ns'] = [time0, time1]
+    return frame
+
+
+class DecodeStats:
+    """
+    Counters and timings of batch decoding.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.records = 0
+        self.frames = 0
+        self.seconds = 0.0
+        self.last_batch_seconds = 0.0
+
+    def add(self, records, frames, seconds):
+        self.batches += 1
+        self.records += records
+        self.frames += frames
+        self.seconds += seconds
+        self.last_batch_seconds = seconds
+
+    def summary(self):
+        return {
+            'batches': self.batches,
+            'records': self.records,
+            'frames': self.frames,
+            'seconds': self.seconds,
+            'last_batch_seconds': self.last_batch_seconds,
+            'us_per_record': self.seconds * 1e6 / self.records if self.records else 0.0,
+        }
+
+
+decode_stats = DecodeStats()  # Default sink of records_to_frames timings
+
+_RECORD_SEPARATOR = '\x1e'
+
+
+def _parse_frame(text, record, columnar):
+    lines = text.splitlines()
     frame = lines[0].split(',')
 
     frame_dict = {
         'frame_Count': int(frame[1]),
         'time_s': frame[2],
         'formatted_time': frame[3],
-        'time': datetime.fromisoformat(frame[3]),
+        'timestamp_ns': parse_timestamp_ns(frame[3], frame[2]),
         'number_of_objects': int(frame[4]),
         'zone_bindings_len': int(frame[5]),
         'objects': [],
         }
-
+    if 'SequenceNumber' in record:
+        # Provenance used to checkpoint the stream once the frame has been synced.
+        frame_dict['shard_id'] = record.get('ShardId')
+        frame_dict['sequence_number'] = record['SequenceNumber']
+        if 'SubSequenceNumber' in record:
+            frame_dict['sub_sequence_number'] = record['SubSequenceNumber']
+    if record.get('ApproximateArrivalTimestamp') is not None:
+        # Stream-side arrival time, used to estimate the sensor clock offsets.
+        frame_dict['arrival_ns'] = parse_timestamp_ns(record['ApproximateArrivalTimestamp'])
 
     objects = lines[1:1+frame_dict['number_of_objects']]
+    if columnar:
+        frame_dict['objects'] = parse_objects(objects)
+        return frame_dict
+
     obj = dict()
     for object in objects:
         object = object.split(',')
@@ -48,12 +319,71 @@ def record_to_frame(record):
     return frame_dict
 
 
+def records_to_frames(records, columnar=False, stats=decode_stats):
+    """
+    Decodes every record of a GetRecords result into a frame dict, in order.
+
+    The payloads of the whole batch are UTF-8 decoded with a single call, then
+    each frame's header and objects are parsed. Aggregated records are expanded
+    first; records without data are skipped.
+
+    :param records: List of records.
+    :param columnar: Return the objects as one OBJECT_DTYPE array instead of a list of dicts.
+    :param stats: DecodeStats receiving the batch size and decode time, or None.
+    :return: List of frame dicts.
+    """
+    start = time.perf_counter()
+    # Records written by an aggregating KinesisProducer hold several frames.
+    records = [record for record in deaggregate_records(records or []) if record.get('Data')]
+    if not records:
+        return []
+
+    texts = b'\x1e'.join(record['Data'] for record in records).decode('utf-8').split(_RECORD_SEPARATOR)
+    if len(texts) != len(records):
+        # A payload contained the separator: fall back to decoding record by record.
+        texts = [record['Data'].decode('utf-8') for record in records]
+
+    frames = [_parse_frame(text, record, columnar) for text, record in zip(texts, records)]
+    if stats is not None:
+        stats.add(len(records), len(frames), time.perf_counter() - start)
+    return frames
+
+
+def record_to_frame(record, columnar=False):
+    """
+    Decodes the first record of a GetRecords result into a frame dict. Use
+    records_to_frames to decode every record of a batch.
+
+    :param record: List of records.
+    :param columnar: Return the objects as one OBJECT_DTYPE array instead of a list of dicts.
+    """
+    
+    if not record or len(record)==0:
+        return None
+    # Records written by an aggregating KinesisProducer hold several frames.
+    record = deaggregate_records(record)
+    if 'Data' not in record[0]:
+        return None
+    return _parse_frame(record[0]['Data'].decode('utf-8'), record[0], columnar)
+
+
 
 def objects2boxes(objects):
+    """
+    Builds one Box per object. Accepts object dicts or an OBJECT_DTYPE array.
+    The yaw quaternions are built from their elements, see objects2boxarray for
+    the array form.
+    """
+    if isinstance(objects, np.ndarray):
+        half_yaws = np.radians(objects['bearing_degrees']) / 2
+        return [Box(center, size, Quaternion(w, 0.0, 0.0, z), velocity=[speed, 0, 0])
+                for center, size, w, z, speed in zip(objects['position'], objects['dimensions'], np.cos(half_yaws),
+                                                     np.sin(half_yaws), objects['speed_mph'])]
+
     boxes = []
     for obj in objects:
-        yaw_angle = obj['bearing_degrees'] * np.pi / 180
-        yaw_quaternion = Quaternion(axis=[0, 0, 1], angle=yaw_angle)
+        half_yaw = obj['bearing_degrees'] * np.pi / 360
+        yaw_quaternion = Quaternion(np.cos(half_yaw), 0.0, 0.0, np.sin(half_yaw))  # About z
         center = [obj['pos_x'], obj['pos_y'], obj['pos_z']]
         size = [obj['dim_x'], obj['dim_y'], obj['dim_z']]
         box = Box(center, size, yaw_quaternion, velocity = [obj['speed_mph'], 0, 0]) # Convert this to 3D velocity
@@ -61,51 +391,72 @@ def objects2boxes(objects):
     return boxes
 
 
-def transform_box(box, transformation_matrix):
+def objects2boxarray(objects):
     """
-    Transforms the center and rotation of a 3D bounding box using a 4x4 transformation matrix.
-
-    :param center: The center of the bounding box in frame 1.
-    :param rotation: The rotation of the bounding box in frame 1 as a quaternion.
-    :param transformation_matrix: The 4x4 transformation matrix from frame 2 to frame 1.
-    :return: The new center and rotation of the bounding box in frame 2.
+    Builds a BoxArray of all objects of a frame, the array counterpart of
+    objects2boxes. Accepts object dicts or an OBJECT_DTYPE array; labels are the
+    object class codes and ids the object ids. The boxes are planar: their
+    orientation is the bearing, without quaternions or rotation matrices.
     """
-    # Transform the center
-    center_homogeneous = np.append(box.center, 1)
-    new_center_homogeneous = np.dot(transformation_matrix, center_homogeneous)
-    new_center = new_center_homogeneous[:3]
+    objects = objects_to_array(objects)
+    velocities = np.zeros((len(objects), 3))
+    velocities[:, 0] = objects['speed_mph']
+    return BoxArray(objects['position'], objects['dimensions'], yaws=np.radians(objects['bearing_degrees']),
+                    velocities=velocities, labels=objects['class_code'], ids=objects['obj_id'])
 
-    # Transform the rotation
 
-    rotation_matrix = box.orientation.rotation_matrix
-    rotation_part = transformation_matrix[:3, :3]
-    new_rotation_matrix = np.dot(rotation_part, rotation_matrix)
-
-    r = R.from_matrix(new_rotation_matrix)
-    quat = r.as_quat()
+def transform_boxes_batch(centers, rotations, velocities, transformation_matrix):
+    """
+    Applies a rigid 4x4 transformation to many boxes at once.
 
+    :param centers: <np.float: n, 3>.
+    :param rotations: <np.float: n, 3, 3>. Box orientations as rotation matrices.
+    :param velocities: <np.float: n, 3>, or None. Rotated like the boxes (NaNs stay NaN).
+    :param transformation_matrix: <np.float: 4, 4>. From the boxes' frame to the target frame.
+    :return: (centers, rotations, velocities) in the target frame.
+    """
+    transformation_matrix = np.asarray(transformation_matrix, dtype=float)
+    rotation_part = transformation_matrix[:3, :3]
+    new_centers = np.asarray(centers, dtype=float) @ rotation_part.T + transformation_matrix[:3, 3]
+    new_rotations = np.matmul(rotation_part, rotations)
+    new_velocities = None if velocities is None else np.asarray(velocities, dtype=float) @ rotation_part.T
+    return new_centers, new_rotations, new_velocities
 
-    new_rotation = Quaternion(quat[3], quat[0], quat[1], quat[2])
 
-    
-    box.center = new_center
-    box.orientation = new_rotation
+def transform_boxes_list(boxes, calibration_matrix):
+    """
+    Transforms boxes in place with one set of array operations (see
+    transform_boxes_batch): centers, orientations and velocities.
 
-    return box
+    :param boxes: Boxes, e.g. of a frame or of a whole recording.
+    :param calibration_matrix: <np.float: 4, 4>. From the boxes' frame to the target frame.
+    :return: The same boxes.
+    """
+    if not boxes:
+        return boxes
+    centers = np.array([box.center for box in boxes], dtype=float)
+    rotations = quaternions_to_matrices([box.orientation.elements for box in boxes])
+    velocities = np.array([box.velocity for box in boxes], dtype=float)
+    centers, rotations, velocities = transform_boxes_batch(centers, rotations, velocities, calibration_matrix)
+    quaternions = matrices_to_quaternions(rotations)
+    for box, center, quaternion, velocity in zip(boxes, centers, quaternions, velocities):
+        box.center = center
+        box.orientation = Quaternion(quaternion)
+        box.velocity = velocity
+    return boxes
 
 
+def transform_box(box, transformation_matrix):
+    """
+    Transforms the center, rotation and velocity of a 3D bounding box using a 4x4
+    transformation matrix. Prefer transform_boxes_list for more than one box.
 
-def transform_boxes_list(boxes, calibration_matrix):
-    # Use ProcessPoolExecutor to run the transformations in parallel
-    with ProcessPoolExecutor() as executor:
-        futures = [
-            executor.submit(transform_box, box, calibration_matrix)
-            for box in boxes
-        ]
+    :param box: The bounding box in frame 1; it is modified in place.
+    :param transformation_matrix: The 4x4 transformation matrix from frame 1 to frame 2.
+    :return: The bounding box in frame 2.
+    """
+    return transform_boxes_list([box], transformation_matrix)[0]
 
-        # Collect the results
-        boxes = [future.result() for future in futures]
-    return boxes 
 
 def string2array(data_string):
 
@@ -147,36 +498,61 @@ def transform_point(point, transformation_matrix):
     return transformed_point
 
 def load_synced_data_from_json(filename: str):
+    """
+    Loads synced entries from a JSON list, or from the (possibly rotated) output of
+    a JsonLinesSink (.jsonl) or BinarySink (.bin).
+    """
+    if filename.endswith('.jsonl'):
+        from sinks import read_jsonl_synced
+        return list(read_jsonl_synced(filename))
+    if filename.endswith('.bin'):
+        from sinks import read_binary_synced
+        return list(read_binary_synced(filename))
     with open(filename, 'r') as f:
         frames = json.load(f)
 
     return frames
 
 
+def frame_calibration(calibration_dict, cache_key):
+    """
+    :param calibration_dict: Calibration matrices by cache key (see SyncConfig.calibration_dict),
+        or the legacy 'sensor<i>_sensor0' keys.
+    :return: <np.float: 4, 4> transform of the frames of `cache_key` to the reference
+        sensor, or None if they are already in its frame.
+    """
+    if cache_key in calibration_dict:
+        return calibration_dict[cache_key]
+    index = cache_key[len('cache'):]
+    if cache_key.startswith('cache') and index.isdigit():
+        return calibration_dict.get(f'sensor{index}_sensor0')
+    return None
+
+
 def transform_frames(frames_dict, calibration_dict):
+    """
+    Builds the boxes of every synced entry and moves them into the reference
+    sensor's frame; the boxes of each sensor are transformed in one batch for the
+    whole recording.
+    """
     frames = []
+    to_transform = {}  # Cache key -> boxes of all frames
 
     for frame in frames_dict:
         new_frame = {}
         for cache_key, cache in frame.items():
-            
+            if not isinstance(cache, dict):
+                continue  # Sensors missing from the synced entry, and the 'missing' list
             boxes = objects2boxes(cache['objects'])
-            if cache_key == 'cache0':
-                new_frame['cache0'] = boxes
-            if cache_key == 'cache1':
-                new_frame['cache1'] = transform_boxes_list(boxes, calibration_dict['sensor1_sensor0'])
+            if frame_calibration(calibration_dict, cache_key) is not None:
+                to_transform.setdefault(cache_key, []).extend(boxes)
+            new_frame[cache_key] = boxes
         frames.append(new_frame)
+    for cache_key, boxes in to_transform.items():
+        transform_boxes_list(boxes, frame_calibration(calibration_dict, cache_key))
     return frames
 
 
-calibration_string = """[[ 0.2314198  -0.         -0.97285398  0.        ]
- [ 0.          1.         -0.          0.        ]
- [ 0.97285398  0.          0.2314198  -2.01845491]
- [ 0.          0.          0.          1.        ]]"""
-
-calibration_matrix = string2array(calibration_string)
-
-
 
 # for frame in loaded_frames:
 #     print("Frame:")
@@ -3,7 +3,18 @@ import numpy as np
 import threading
 import time
 from utils import objects2boxes, load_synced_data_from_json, transform_frames
+from fusion import default_sync_config
 from open3d_viz import return_geometries
+
+SENSOR_COLORS = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [1, 0, 1], [0, 1, 1], [1, 0.5, 0], [0.5, 0, 1]]
+
+
+def sensor_color(cache_key):
+    # Boxes of cache<i> get the i-th color (cache0 red, cache1 green, ...).
+    index = cache_key[len('cache'):]
+    return SENSOR_COLORS[int(index) % len(SENSOR_COLORS)] if index.isdigit() else [1, 1, 1]
+
+
 class BoundingBoxVisualizer:
     def __init__(self, initial_geometries, loaded_frames, max_boxes=100, check_interval=0.1):
         self.loaded_frames = loaded_frames
@@ -86,12 +97,8 @@ class BoundingBoxVisualizer:
                     print("Warning: More boxes than expected, increase max_boxes.")
                     break
                 corners = box.corners()
-                if cache_key == 'cache0':
-                    self.update_bounding_box(self.bbox_geometries[bbox_idx], corners.T)
-                    self.bbox_geometries[bbox_idx].paint_uniform_color([1, 0, 0])
-                elif cache_key == 'cache1':
-                    self.update_bounding_box(self.bbox_geometries[bbox_idx], corners.T)
-                    self.bbox_geometries[bbox_idx].paint_uniform_color([0, 1, 0])
+                self.update_bounding_box(self.bbox_geometries[bbox_idx], corners.T)
+                self.bbox_geometries[bbox_idx].paint_uniform_color(sensor_color(cache_key))
                 bbox_idx += 1
 
         # Hide remaining boxes
@@ -116,10 +123,11 @@ class BoundingBoxVisualizer:
 
 # Example usage:
 # Assume `loaded_frames` is a list of frames, each containing bounding boxes
-loaded_frames_dict = load_synced_data_from_json('synced_data.json')  # Populate this with actual data
-geometries, calibration_matrix = return_geometries()
+loaded_frames_dict = load_synced_data_from_json('synced_data.jsonl')  # Populate this with actual data
+geometries, _ = return_geometries()
 
-calibration_dict = {'sensor1_sensor0': calibration_matrix}
+# The calibrations of the sensor group that wrote synced_data.jsonl, by cache key.
+calibration_dict = default_sync_config().calibration_dict()
 # print(loaded_frames_dict)
 frames = transform_frames(loaded_frames_dict, calibration_dict)
 # print(frames[1])